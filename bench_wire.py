@@ -0,0 +1,158 @@
+"""
+Benchmarks the lossy wire on its own: how many packets per second it can
+forward, and how closely it keeps to its delay, as the offered load grows.
+
+For each rate, timestamped packets are sent through a server.py wire at
+that rate, for a fixed time, to a socket that records when each arrives.
+The wire is only as fast as its forwarding engine, so once the offered load
+is more than it can keep up with, packets back up, arrive late and are
+dropped by the kernel before the wire reads them.
+"""
+import argparse
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+import util.utils
+import util.wire
+
+DESC = sys.modules[globals()['__name__']].__doc__
+PARSER = argparse.ArgumentParser(description=DESC)
+PARSER.add_argument('-p', '--port', type=int, default=9998,
+                    help="The port to run the wire on (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-d', '--delay', type=float, default=0.01,
+                    help="The wire's delay, in seconds (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-r', '--rates', default="1000,2000,5000,10000,20000",
+                    help="The offered loads to measure, in packets per "
+                         "second, separated by commas (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-t', '--duration', type=float, default=2.0,
+                    help="How long, in seconds, to offer each load for "
+                         "(defaults to %(default)s).")
+PARSER.add_argument('-s', '--size', type=int, default=64,
+                    help="The size of each packet, in bytes (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('--batch-window', type=float,
+                    default=util.wire.BATCH_WINDOW,
+                    help="The wire's batch window, in seconds (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('--uvloop', action="store_true",
+                    help="Run the wire on uvloop's event loop.")
+ARGS = PARSER.parse_args()
+
+# Sequence number, and when the packet was sent on the monotonic clock,
+# which every process on the machine shares.
+PACKET = struct.Struct("!Qd")
+# Loss, as a fraction, up to which a load still counts as sustained.
+SUSTAINED_LOSS = 0.01
+# How long, in seconds past the delay, to wait for stragglers.
+DRAIN_GRACE = 0.5
+RECEIVE_BUFFER = 1 << 22
+# How long, in seconds, the wire may take to start up.
+STARTUP_TIMEOUT = 10.0
+
+if ARGS.size < PACKET.size:
+    PARSER.error("packets must be at least {} bytes".format(PACKET.size))
+
+
+def measure(rate: int) -> dict:
+    """Offers the wire a load and measures what comes out the other side.
+
+    Args:
+        rate -- The packets to send per second.
+
+    Return:
+        The packets sent and received, and the extra delay, beyond the
+        wire's own, of each packet received.
+    """
+    # Each load gets a flow of its own, so the sockets of earlier ones
+    # aren't sent anything.
+    flow = "bench-{}".format(rate).encode()
+    receiving = util.wire.bad_socket(ARGS.port, flow)
+    receiving.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    receiving.setblocking(False)
+    sending = util.wire.bad_socket(ARGS.port, flow)
+    padding = bytes(ARGS.size - PACKET.size)
+    sent = received = 0
+    errors = []
+
+    def drain():
+        nonlocal received
+        while True:
+            try:
+                data = receiving.recv(ARGS.size)
+            except BlockingIOError:
+                return
+            arrived = time.monotonic()
+            _, sent_at = PACKET.unpack_from(data)
+            errors.append(arrived - sent_at - ARGS.delay)
+            received += 1
+
+    start = time.monotonic()
+    end = start + ARGS.duration
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        due = min(int((now - start) * rate) + 1, int(ARGS.duration * rate))
+        while sent < due:
+            sending.send(PACKET.pack(sent, time.monotonic()) + padding)
+            sent += 1
+        wait = min(end, start + sent / rate) - time.monotonic()
+        select.select([receiving], [], [], max(0.0, wait))
+        drain()
+
+    end += ARGS.delay + DRAIN_GRACE
+    while received < sent and time.monotonic() < end:
+        select.select([receiving], [], [], end - time.monotonic())
+        drain()
+
+    sending.close()
+    receiving.close()
+    return {"sent": sent, "received": received, "errors": errors}
+
+
+SERVER_ARGS = [sys.executable, "server.py", "--port", str(ARGS.port),
+               "--delay", str(ARGS.delay), "--buffer", "1000000",
+               "--batch-window", str(ARGS.batch_window)]
+if ARGS.uvloop:
+    SERVER_ARGS.append("--uvloop")
+
+STATUS_READ, STATUS_WRITE = os.pipe()
+SERVER_PROCESS = subprocess.Popen(
+    SERVER_ARGS + ["--status-fd", str(STATUS_WRITE)],
+    stdout=subprocess.DEVNULL, pass_fds=(STATUS_WRITE,))
+os.close(STATUS_WRITE)
+with os.fdopen(STATUS_READ) as SERVER_STATUS:
+    READY = util.utils.read_status(SERVER_STATUS, STARTUP_TIMEOUT)
+    if not READY or READY[0] != util.utils.STATUS_READY:
+        SERVER_PROCESS.kill()
+        sys.exit("The wire didn't start up")
+
+ROW = "{:>12} {:>12} {:>14} {:>8} {:>14} {:>14}"
+print(ROW.format("offered pps", "sent pps", "delivered pps", "lost %",
+                 "extra p50 ms", "extra p99 ms"))
+SUSTAINED = 0
+try:
+    for RATE in (int(a_rate) for a_rate in ARGS.rates.split(",")):
+        RESULT = measure(RATE)
+        LOSS = 1 - RESULT["received"] / RESULT["sent"]
+        DELIVERED = RESULT["received"] / ARGS.duration
+        if LOSS <= SUSTAINED_LOSS:
+            SUSTAINED = max(SUSTAINED, DELIVERED)
+        print(ROW.format(
+            RATE, round(RESULT["sent"] / ARGS.duration),
+            round(DELIVERED), round(LOSS * 100, 2),
+            round(util.utils.percentile(RESULT["errors"], 0.5) * 1000, 3),
+            round(util.utils.percentile(RESULT["errors"], 0.99) * 1000, 3)))
+finally:
+    SERVER_PROCESS.terminate()
+    SERVER_PROCESS.wait()
+
+print("\nSustained: {} packets/s, with at most {}% lost".format(
+    round(SUSTAINED), round(SUSTAINED_LOSS * 100)))
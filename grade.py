@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
+import argparse
+import concurrent.futures
 import os
 import signal
-from subprocess import Popen, PIPE
-
 import subprocess
 import enum
 import collections
+import tempfile
 import time
 import sys
 
+PARSER = argparse.ArgumentParser(description="Runs the grading test cases, "
+                                             "several at once.")
+PARSER.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                    help="How many test cases to run at once (defaults to "
+                         "the number of cores, %(default)s).")
+ARGS = PARSER.parse_args()
+
 
 class TestResultType(enum.Enum):
     TRANSFER_ERROR = 0
@@ -21,23 +29,36 @@ TestCase = collections.namedtuple("TestCase", "args secs")
 TestResult = collections.namedtuple("TestResult", "type duration")
 
 def run_test_case(case: TestCase) -> TestResult:
+    """Runs one test case through tester.py, on a port of its own and with
+    its files in a temporary directory of its own, so that cases can run
+    alongside each other.  The wire binds whichever port is free itself, so
+    no two cases can be handed the same one.
+    """
     full_credit_time = case.secs * 1.5
     half_credit_time = case.secs * 2.0
-    start_time = time.time()
 
-    test_args = ["python3", "tester.py", "--file", case.args.file, "--loss",
-                 case.args.loss, "--buffer", case.args.buffer,
-                 "--delay", case.args.delay]
+    with tempfile.TemporaryDirectory() as work_dir:
+        test_args = [sys.executable, "tester.py", "--file", case.args.file,
+                     "--loss", case.args.loss, "--buffer", case.args.buffer,
+                     "--delay", case.args.delay,
+                     "--port", "0",
+                     "--receive", os.path.join(work_dir, "received")]
+        env = dict(os.environ, TMPDIR=work_dir)
+        start_time = time.time()
+        # In a session of its own, so that on a timeout the wire and
+        # endpoints tester.py started can be killed along with it.
+        process = subprocess.Popen(test_args, stdout=subprocess.PIPE,
+                                   env=env, start_new_session=True)
+        try:
+            process.communicate(timeout=half_credit_time)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            return TestResult(TestResultType.TRANSFER_TIMEOUT, None)
+        if process.returncode != 0:
+            return TestResult(TestResultType.TRANSFER_ERROR, None)
+        end_time = time.time()
 
-    try:
-        subprocess.run(test_args, timeout=half_credit_time, check=True,
-                       stdout=subprocess.PIPE)
-    except subprocess.TimeoutExpired:
-        return TestResult(TestResultType.TRANSFER_TIMEOUT, None)
-    except subprocess.CalledProcessError:
-        return TestResult(TestResultType.TRANSFER_ERROR, None)
-
-    end_time = time.time()
     duration = end_time - start_time
     if duration <= full_credit_time:
         result_type = TestResultType.FAST_TRANSFER
@@ -85,7 +106,14 @@ MAX_SCORE = 20
 MAX_CASE = 10
 TOTAL_TIME = 0
 TIME_LIST = []
-for CASE_NUM, A_CASE in enumerate(TEST_CASES):
+
+# The cases spend their time waiting on tester.py, so threads are enough to
+# run them at once.
+with concurrent.futures.ThreadPoolExecutor(max(1, ARGS.jobs)) as POOL:
+    CASE_RESULTS = list(POOL.map(run_test_case, TEST_CASES))
+
+for CASE_NUM, (A_CASE, CASE_RESULT) in enumerate(zip(TEST_CASES,
+                                                     CASE_RESULTS)):
     FULL_CREDIT_TIME = A_CASE.secs * 1.5
     HALF_CREDIT_TIME = FULL_CREDIT_TIME * 1.5
     print("Test case: {}".format(CASE_NUM + 1))
@@ -97,18 +125,6 @@ for CASE_NUM, A_CASE in enumerate(TEST_CASES):
     print("  - Half credit: {} secs".format(round(HALF_CREDIT_TIME)))
     print("----------")
 
-    port = 9999
-    process = Popen(["lsof", "-i", ":{0}".format(port)], stdout=PIPE, stderr=PIPE)
-    stdout, stderr = process.communicate()
-    for process in str(stdout.decode("utf-8")).split("\n")[1:]:
-        data = [x for x in process.split(" ") if x != '']
-        if (len(data) <= 1):
-            continue
-
-        os.kill(int(data[1]), signal.SIGKILL)
-
-
-    CASE_RESULT = run_test_case(A_CASE)
     TIME_LIST.append(CASE_RESULT.duration)
     if CASE_RESULT.duration:
         TOTAL_TIME += CASE_RESULT.duration
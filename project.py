@@ -1,18 +1,520 @@
 """
 Where solution code to project should be written.  No other files should
 be modified.
+
+The transport implemented here is a selective-repeat sliding window.  The
+sender keeps up to a congestion window's worth of segments in flight, and the
+receiver answers every data segment with a cumulative acknowledgement plus
+selective acknowledgement (SACK) ranges describing what it holds beyond the
+cumulative point, so a single loss only costs the missing segment.
+
+Optionally, the sender also protects blocks of segments with forward error
+correction (see util.fec), so the receiver can rebuild lost segments from
+repair symbols without waiting a round trip for a retransmission.
+
+Both ends speak the packet format defined in util.packet, and are written as
+state machines (`_Sender` and `_Receiver`) that asyncio datagram protocols
+drive, so timers, ACK processing and retransmissions all run on one event
+loop.  `send` and `recv` are blocking wrappers around `send_async` and
+`recv_async`.
+
+There is no separate handshake: the first data segment carries SYN, so data
+flows from the first packet, and the last one doubles as FIN.  The
+receiver's ACK completing the transfer is the FINACK, and the sender's ACK of
+it closes the connection, so both ends exit as soon as delivery is
+confirmed rather than waiting to be killed.
+
+When the receiver already has a copy of an earlier version of the data, the
+sender can be given the signatures of its blocks (see util.delta), and then
+sends only what differs from that copy, as literal data and instructions to
+copy the blocks that are unchanged.  The delta is carried like a compressed
+stream, and the receiver rebuilds the data from it and its copy.
 """
 
+import asyncio
+import hashlib
 import socket
 import io
-import time
+import os
 import typing
-import struct
+import collections
 import util
+import util.compression
+import util.congestion
+import util.delta
+import util.fec
 import util.logging
+import util.metrics
+import util.packet
+import util.ranges
+import util.source
+import util.timerwheel
+
+# Transmissions between updates of the sender's loss estimate.
+LOSS_INTERVAL = 32
+
+# A segment is presumed lost once this many later transmissions have been
+# delivered, or once one sent a quarter round trip after it has been.
+DUP_THRESHOLD = 3
+
+# Resolution of the sender's retransmission timers.
+TIMER_TICK = 0.005
+
+# The receiver acknowledges every ACK_EVERY in order segments, or ACK_DELAY
+# seconds after the first one it hasn't acknowledged, whichever comes first.
+# ACKs share the wire's buffer with data, so each one saved leaves room for
+# a segment.  Anything out of order is acknowledged straight away.
+ACK_EVERY = 2
+ACK_DELAY = 0.01
+# The first segments of a transfer are all acknowledged individually: while
+# the sender's window is only a couple of segments, a lost ACK that covered
+# all of them would leave it waiting for its initial timeout.
+QUICK_ACKS = 16
+
+# Once everything has been delivered, the receiver waits for the sender's
+# closing ACK, re-sending its FIN whenever a retransmission shows the sender
+# hasn't seen it yet.  A sender that hasn't seen it keeps retransmitting,
+# backing its timeout off up to MAX_RTO, so the receiver only gives up after
+# the time this many of those timeouts take without hearing from the sender,
+# see `linger_time`.
+LINGER_RTOS = 8
+# The closing ACK is never retransmitted, so it is sent this many times.
+FINAL_ACKS = 3
+# Segments written straight into a file at their offsets after arriving out
+# of order are hashed by reading them back once they are in order, this many
+# bytes at a time.
+DIGEST_CHUNK = 1 << 20
+# The sender gives up after this many timeouts in a row without any ACK,
+# taking the receiver to be gone.
+MAX_TIMEOUTS = 30
+
+
+def linger_time(rto: float) -> float:
+    """Returns how long a receiver whose round trips give the given
+    retransmission timeout lingers for the sender's closing ACK: as long as
+    a sender with that timeout takes to retransmit LINGER_RTOS times, doubling
+    the timeout each time, up to MAX_RTO.
+    """
+    return sum(min(util.congestion.MAX_RTO, rto * 2 ** backoff)
+               for backoff in range(LINGER_RTOS))
+
+
+def symbol_size(flags: int) -> int:
+    """Returns the size of the repair symbols of a protected transfer whose
+    packets carry the given option flags.
+    """
+    return util.MAX_PACKET - util.packet.header_size(util.packet.TYPE_REPAIR,
+                                                     flags)
+
+
+def segment_size(flags: int, fec: bool) -> int:
+    """Returns the payload size of the data segments of a transfer whose
+    packets carry the given option flags.  Repair symbols fill a whole
+    datagram, so protected segments are a little shorter, leaving room for
+    the symbol's length prefix.
+    """
+    if fec:
+        return symbol_size(flags) - util.fec.LENGTH_BYTES
+    return util.MAX_PACKET - util.packet.header_size(util.packet.TYPE_DATA,
+                                                     flags)
+
+
+def sack_blocks(out_of_order: util.ranges.Ranges,
+                latest: typing.Optional[int] = None
+                ) -> typing.List[typing.Tuple[int, int]]:
+    """Lists the contiguous (start, end) ranges, end exclusive, of the
+    sequence numbers received out of order.
+
+    Args:
+        out_of_order -- Sequence numbers held beyond the cumulative ack.
+        latest -- If given, the range holding this sequence number is listed
+                  first, so the sender hears about the newest arrival even
+                  when not every range fits in one ACK.
+
+    Return:
+        At most util.packet.MAX_SACK_BLOCKS ranges.
+    """
+    return out_of_order.blocks(util.packet.MAX_SACK_BLOCKS, latest)
+
+
+class _Sender:
+    """Selective-repeat sender state, independent of how packets actually
+    reach the socket.
+
+    Segments are numbered from zero.  `_outstanding` maps every segment in
+    flight to the time it was (last) transmitted, in transmission order, so
+    the oldest transmission is always at the front.  Loss is detected the way
+    RACK does it: once SACKs show that enough transmissions made after an
+    outstanding segment were delivered, the older one is presumed lost and
+    queued for retransmission.  Every transmission also arms a retransmission
+    timer in a util.timerwheel wheel, so arming and cancelling one costs the
+    same however many segments are in flight, and timers due together expire
+    as one batch.
+
+    How many segments may be in flight is left to a congestion controller
+    from util.congestion, which is fed every acknowledgement and loss.
+    Payloads are pulled from a util.source segment source only when first
+    transmitted, and released once acknowledged.
+
+    With forward error correction, every util.fec.BLOCK_SIZE new segments
+    are followed by enough repair symbols to cover the loss rate the
+    receiver's packet counts suggest.  Repairs aren't retransmitted, but
+    they count against the window for a round trip, and a segment of a
+    protected block is only presumed lost once transmissions made after its
+    block's repairs have been delivered.
+
+    When packets carry timestamps, every ACK echoes the timestamp of the
+    transmission that triggered it, so round trips are measured from ACKs
+    rather than per segment, and retransmissions are timed too.  Data
+    segments echo the latest ACK's timestamp in turn, so the path can be
+    timed from the receiver's side, or from a capture, as well.
+
+    There is no separate handshake: the first segment carries SYN along
+    with its data, and the rest of the initial window follows right away.
+    The last segment doubles as the FIN, so the ACK completing the transfer
+    is the receiver's FIN, which `final_ack` answers.
+
+    Args:
+        source -- Where segment payloads come from.
+        congestion -- The name of the congestion controller to use.
+        now -- The current time, to start the timer wheel from.
+        fec -- The loss rate to plan repairs for until it is measured, or
+               None to send without forward error correction.
+        options -- util.packet.OPTION_FLAGS to set on every packet.
+
+    Attributes:
+        retransmissions -- The segments retransmitted.
+        fast_retransmits -- The segments loss detection queued for
+                            retransmission.
+        timeout_retransmits -- The segments expired timers queued for
+                               retransmission.
+        duplicate_acks -- The ACKs that acknowledged nothing new.
+        repairs_sent -- The repair symbols sent.
+    """
 
+    def __init__(self, source: util.source.SegmentSource, congestion: str,
+                 now: float, fec: typing.Optional[float] = None,
+                 options: int = util.packet.FLAG_TIMESTAMP):
+        self._source = source
+        self._header = bytearray(max(
+            util.packet.header_size(packet_type, util.packet.OPTION_FLAGS)
+            for packet_type in (util.packet.TYPE_REPAIR,
+                                util.packet.TYPE_ACK)))
+        self._header_view = memoryview(self._header)
+        self._ack_header = util.packet.Header()
+        self._flags = options & util.packet.OPTION_FLAGS
+        self._timestamps = bool(options & util.packet.FLAG_TIMESTAMP)
+        self._encoder = None
+        if fec is not None:
+            self._encoder = util.fec.RepairEncoder(symbol_size(self._flags))
+            self._flags |= util.packet.FLAG_FEC
+        if source.announced:
+            self._flags |= util.packet.FLAG_LENGTH
+        if source.compressed:
+            self._flags |= util.packet.FLAG_COMPRESSED
+        self._repairs = collections.deque()
+        self._repairs_in_flight = collections.deque()
+        self._block_tx = {}
+        self.loss_rate = fec or 0.0
+        self._loss_estimate = self.loss_rate
+        self._loss_mark = (0, 0)
+        self._last_received = 0
+        self._next_seq = 0
+        self._snd_una = 0
+        self._outstanding = collections.OrderedDict()
+        self._timers = util.timerwheel.TimerWheel(TIMER_TICK, now)
+        self._last_timeout = float("-inf")
+        self._silent_timeouts = 0
+        self._tx_index = {}
+        self._transmissions = 0
+        self._lost = collections.OrderedDict()
+        self._sacked = util.ranges.Ranges()
+        self._retransmitted = set()
+        self._rtt = util.congestion.RttEstimator()
+        self._cc = util.congestion.create(congestion, self._rtt)
+        self.retransmissions = 0
+        self.fast_retransmits = 0
+        self.timeout_retransmits = 0
+        self.duplicate_acks = 0
+        self.repairs_sent = 0
+        self._ts_recent = 0
+        self.established = False
 
-def send(sock: socket.socket, data: bytes):
+    @property
+    def done(self) -> bool:
+        """Whether every segment has been acknowledged."""
+        num_segments = self._source.num_segments
+        return num_segments is not None and self._snd_una >= num_segments
+
+    def _segment(self, seq: int, payload: typing.Union[bytes, memoryview],
+                 now: float) -> typing.Tuple[memoryview,
+                                             typing.Union[bytes, memoryview]]:
+        flags = self._flags
+        if seq == 0:
+            flags |= util.packet.FLAG_SYN
+        if self._source.is_last(seq):
+            flags |= util.packet.FLAG_LAST
+        size = util.packet.pack_data(self._header, flags, seq,
+                                     util.packet.timestamp(now),
+                                     self._ts_recent, payload)
+        return self._header_view[:size], payload
+
+    def _repair(self, first: int, count: int, index: int, symbol: bytes,
+                last: bool, now: float) -> typing.Tuple[memoryview, bytes]:
+        flags = self._flags & (util.packet.OPTION_FLAGS |
+                               util.packet.STREAM_FLAGS)
+        if last:
+            flags |= util.packet.FLAG_LAST
+        size = util.packet.pack_repair(self._header, flags, first, count,
+                                       index, util.packet.timestamp(now),
+                                       symbol)
+        return self._header_view[:size], symbol
+
+    def _protect(self, seq: int, payload: typing.Union[bytes, memoryview]):
+        self._encoder.add(seq, payload)
+        last = self._source.is_last(seq)
+        if len(self._encoder) < util.fec.BLOCK_SIZE and not last:
+            return
+        num_repairs = util.fec.repair_count(len(self._encoder),
+                                            self.loss_rate)
+        first, count, symbols = self._encoder.finish(num_repairs)
+        for index, symbol in enumerate(symbols):
+            self._repairs.append((first, count, index, symbol, last))
+
+    def _in_flight(self, now: float) -> int:
+        lifetime = self._rtt.srtt or self._rtt.rto
+        while self._repairs_in_flight and (self._repairs_in_flight[0] +
+                                           lifetime <= now):
+            self._repairs_in_flight.popleft()
+        return len(self._outstanding) + len(self._repairs_in_flight)
+
+    @property
+    def timers(self) -> util.timerwheel.TimerWheel:
+        """The retransmission timers, for their expiry statistics."""
+        return self._timers
+
+    def snapshot(self, now: float) -> dict:
+        """Returns the sender's state, for util.metrics."""
+        rtt = self._rtt
+        return {"cwnd": self._cc.cwnd, "in_flight": self._in_flight(now),
+                "srtt": rtt.srtt, "rttvar": rtt.rttvar, "rto": rtt.rto,
+                "retransmissions": self.retransmissions,
+                "fast_retransmits": self.fast_retransmits,
+                "timeout_retransmits": self.timeout_retransmits,
+                "duplicate_acks": self.duplicate_acks,
+                "repairs": self.repairs_sent,
+                "bytes": min(self._snd_una * self._source.segment_size,
+                             self._source.length)}
+
+    def next_deadline(self) -> typing.Optional[float]:
+        """Returns when `on_timeout` should next be called."""
+        return self._timers.next_expiry()
+
+    def packets_to_send(self, now: float
+                        ) -> typing.Iterator[typing.Tuple[
+                            memoryview, typing.Union[bytes, memoryview]]]:
+        """Yields the segments the window currently allows to be sent,
+        repair symbols and retransmissions first, as a (header, payload) pair
+        to be sent with scatter / gather IO.  The header buffer is shared, so
+        each pair is only valid until the next one is requested.
+        """
+        while self._in_flight(now) < int(self._cc.cwnd):
+            if self._repairs:
+                first, count, index, symbol, last = self._repairs.popleft()
+                self._repairs_in_flight.append(now)
+                self._block_tx[first] = self._transmissions
+                self._transmissions += 1
+                self.repairs_sent += 1
+                yield self._repair(first, count, index, symbol, last, now)
+                continue
+            if self._lost:
+                seq, _ = self._lost.popitem(last=False)
+                self._retransmitted.add(seq)
+                self.retransmissions += 1
+                is_new = False
+            elif self._source.available(self._next_seq):
+                seq = self._next_seq
+                self._next_seq += 1
+                is_new = True
+            else:
+                break
+            self._outstanding[seq] = now
+            self._timers.arm(seq, now + self._rtt.rto)
+            self._tx_index[seq] = self._transmissions
+            self._transmissions += 1
+            payload = self._source.segment(seq)
+            if is_new and self._encoder is not None:
+                self._protect(seq, payload)
+            yield self._segment(seq, payload, now)
+
+    def _mark_acked(self, seq: int, now: float, newest: list) -> int:
+        sent_at = self._outstanding.pop(seq, None)
+        self._lost.pop(seq, None)
+        if sent_at is None:
+            return 0
+        self._timers.cancel(seq)
+        tx_index = self._tx_index.pop(seq)
+        # Karn's rule: only time segments that were transmitted once.
+        if not self._timestamps and seq not in self._retransmitted:
+            self._rtt.sample(now - sent_at)
+        if tx_index > newest[1]:
+            newest[0] = sent_at
+            newest[1] = tx_index
+        return 1
+
+    def on_ack(self, packet: memoryview, now: float):
+        """Processes an acknowledgement from the receiver."""
+        header = self._ack_header
+        try:
+            header.unpack_from(packet, len(packet))
+        except util.packet.MalformedPacket:
+            return
+        if header.type != util.packet.TYPE_ACK:
+            return
+        self._silent_timeouts = 0
+        cum_ack = header.number
+        received, blocks = util.packet.unpack_ack(packet, header, len(packet))
+        if header.flags & util.packet.FLAG_TIMESTAMP:
+            self._rtt.sample(util.packet.elapsed(now, header.echo))
+            self._ts_recent = header.timestamp
+        if header.flags & util.packet.FLAG_SYN:
+            self.established = True
+        # Send time and transmission index of the latest transmission this
+        # ACK newly reports as delivered.
+        newest = [0.0, -1]
+        acked = 0
+        cum_ack = min(cum_ack, self._next_seq)
+        for seq in range(self._snd_una, cum_ack):
+            acked += self._mark_acked(seq, now, newest)
+            self._retransmitted.discard(seq)
+            self._source.release(seq)
+        self._snd_una = max(self._snd_una, cum_ack)
+        self._sacked.trim(self._snd_una)
+        while self._block_tx:
+            block_first = next(iter(self._block_tx))
+            if block_first + util.fec.BLOCK_SIZE > self._snd_una:
+                break
+            del self._block_tx[block_first]
+        # Blocks are mostly repeated from one ACK to the next, so only the
+        # part of each not SACKed before is walked.
+        for start, end in blocks:
+            start = max(start, self._snd_una)
+            end = min(end, self._next_seq)
+            for first, last in self._sacked.missing(start, end):
+                for seq in range(first, last):
+                    acked += self._mark_acked(seq, now, newest)
+            self._sacked.add(start, end)
+        # Repairs take up the window without ever being acknowledged, so a
+        # protected transfer reports every packet the receiver counted as
+        # delivered, keeping the controller's rate model in packets.
+        arrived = (received - self._last_received) & 0xFFFFFFFF
+        if arrived < 0x80000000:
+            self._last_received = received
+            if self._encoder is not None:
+                acked = max(acked, arrived)
+        if not acked:
+            self.duplicate_acks += 1
+        else:
+            self._rtt.reset_backoff()
+            self._cc.on_ack(acked, self._in_flight(now), now)
+            self._measure_loss(received, newest[1])
+            self._detect_losses(newest[0], newest[1], now)
+
+    def _measure_loss(self, received: int, newest_tx: int):
+        # When the receiver acknowledged the newest transmission, everything
+        # sent before it had either arrived or been lost, unless jitter
+        # reordered it and it is still on its way.  A late packet counted as
+        # lost in one interval is counted as delivered in a later one, so
+        # intervals aren't clamped, only the estimate the sender uses, and
+        # the two errors cancel out.  Copies the link duplicated count as
+        # delivered too, which can only understate loss, by the duplication
+        # rate.
+        marked_received, marked_sent = self._loss_mark
+        sent = newest_tx + 1
+        if sent - marked_sent < LOSS_INTERVAL:
+            return
+        delivered = (received - marked_received) & 0xFFFFFFFF
+        if delivered >= 0x80000000:
+            # An ACK overtaken by a later one, with an older count.
+            return
+        interval_loss = 1 - delivered / (sent - marked_sent)
+        self._loss_estimate += (interval_loss - self._loss_estimate) / 4
+        self.loss_rate = min(1.0, max(0.0, self._loss_estimate))
+        self._loss_mark = (received, sent)
+
+    def _detect_losses(self, newest_sent: float, newest_tx: int, now: float):
+        reorder_window = (self._rtt.srtt or 0) / 4
+        lost = []
+        for seq, sent_at in self._outstanding.items():
+            tx_index = self._tx_index[seq]
+            if tx_index >= newest_tx:
+                break
+            # Protected segments may still be rebuilt from their block's
+            # repairs, so they are judged from the last repair onwards.
+            block_tx = self._block_tx.get(seq - seq % util.fec.BLOCK_SIZE, -1)
+            if block_tx > tx_index:
+                if newest_tx - block_tx < DUP_THRESHOLD:
+                    continue
+            elif (newest_tx - tx_index < DUP_THRESHOLD and
+                  sent_at >= newest_sent - reorder_window):
+                break
+            lost.append((seq, sent_at))
+        for seq, sent_at in lost:
+            del self._outstanding[seq]
+            del self._tx_index[seq]
+            self._timers.cancel(seq)
+            self._lost[seq] = None
+            self.fast_retransmits += 1
+            self._cc.on_loss(sent_at, len(self._outstanding), now)
+
+    @property
+    def unresponsive(self) -> bool:
+        """Whether the receiver has stopped answering, after MAX_TIMEOUTS
+        timeouts in a row.
+        """
+        return self._silent_timeouts >= MAX_TIMEOUTS
+
+    def final_ack(self, now: float) -> memoryview:
+        """Returns the ACK answering the receiver's FIN, to be sent FINAL_ACKS
+        times once the transfer is `done`.  It isn't retransmitted: if every
+        copy is lost, the receiver gives up waiting for it after lingering.
+        """
+        flags = (self._flags & util.packet.OPTION_FLAGS) | util.packet.FLAG_FIN
+        size = util.packet.pack_ack(self._header, flags, self._snd_una, 0, (),
+                                    util.packet.timestamp(now),
+                                    self._ts_recent)
+        return self._header_view[:size]
+
+    def on_timeout(self, now: float):
+        """Moves every segment whose retransmission timer has expired onto
+        the retransmission queue.
+
+        The controller is told, and the timeout backed off, once per flight
+        of segments: timers of segments that were already in flight at the
+        previous timeout, and expire in the ticks after it, only requeue
+        their segment.
+        """
+        expired = self._timers.advance(now)
+        if not expired:
+            return
+        newest_sent = float("-inf")
+        for seq in expired:
+            newest_sent = max(newest_sent, self._outstanding.pop(seq))
+            del self._tx_index[seq]
+            self._lost[seq] = None
+        self.timeout_retransmits += len(expired)
+        if newest_sent <= self._last_timeout:
+            return
+        self._last_timeout = now
+        self._silent_timeouts += 1
+        self._cc.on_timeout(len(self._outstanding), now)
+        self._rtt.back_off()
+
+
+def send(sock: socket.socket, data: bytes,
+         congestion: str = util.congestion.DEFAULT_CONTROLLER,
+         metrics: typing.Optional[util.metrics.Metrics] = None,
+         signatures: typing.Optional[util.delta.Signatures] = None):
     """
     Implementation of the sending logic for sending data over a slow,
     lossy, constrained network.
@@ -21,44 +523,808 @@ def send(sock: socket.socket, data: bytes):
         sock -- A socket object, constructed and initialized to communicate
                 over a simulated lossy network.
         data -- A bytes object, containing the data to send over the network.
+        congestion -- The name of the congestion controller to use for this
+                      transfer, one of util.congestion.CONTROLLERS.
+        metrics -- If given, filled in with telemetry of the transfer.
+        signatures -- If given, send only what differs from the receiver's
+                      copy these signatures describe.
+    """
+    send_stream(sock, data, congestion, metrics=metrics,
+                signatures=signatures)
+
+
+def send_stream(sock: socket.socket, source,
+                congestion: str = util.congestion.DEFAULT_CONTROLLER,
+                fec: typing.Optional[float] = None, timestamps: bool = True,
+                checksum: bool = False,
+                stats: typing.Optional[dict] = None,
+                metrics: typing.Optional[util.metrics.Metrics] = None,
+                compression: typing.Optional[str] = None,
+                signatures: typing.Optional[util.delta.Signatures] = None
+                ) -> int:
+    """
+    Sends data that doesn't have to be held in memory up front.  Segments
+    are read from the source only as the window opens, so sending starts
+    straight away, and inputs larger than memory can be sent.
+
+    Blocks until the transfer completes, running send_async on an event loop
+    of its own.  Takes the same arguments as send_async.
+
+    Return:
+        The number of bytes sent.
+    """
+    return _run_blocking(sock, send_async(
+        sock.dup(), source, congestion=congestion, fec=fec,
+        timestamps=timestamps, checksum=checksum, stats=stats,
+        metrics=metrics, compression=compression, signatures=signatures))
+
+
+def _run_blocking(sock: socket.socket, transfer: typing.Awaitable) -> int:
+    """Runs a transfer on a duplicate of a blocking socket, which asyncio
+    switches to non-blocking mode and closes, then restores the mode of the
+    original socket.
+    """
+    timeout = sock.gettimeout()
+    try:
+        return asyncio.run(transfer)
+    finally:
+        sock.settimeout(timeout)
+
+
+class _SenderProtocol(asyncio.DatagramProtocol):
+    """Drives a _Sender from an event loop.  ACKs are processed as they
+    arrive and the retransmission timer is a loop callback, so timers and
+    IO share one thread, and a timer fires when it is due rather than when
+    a thread gets scheduled.
+
+    Args:
+        sender -- The sender state to drive.
+        done -- Resolved once every segment has been acknowledged, and the
+                receiver's FIN answered.
+    """
+
+    def __init__(self, sender: _Sender, done: asyncio.Future):
+        self._sender = sender
+        self._done = done
+        self._loop = done.get_loop()
+        self._transport = None
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        # Datagram transports don't do scatter / gather IO, so each packet
+        # is assembled here, and only copied again if the socket is full.
+        self._packet = bytearray(util.MAX_PACKET)
+        self._view = memoryview(self._packet)
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._pump()
+
+    def datagram_received(self, data, addr):
+        self._sender.on_ack(memoryview(data), self._loop.time())
+        self._pump()
+
+    def error_received(self, exc):
+        self._finish(exc)
+
+    def connection_lost(self, exc):
+        self._finish(exc or ConnectionError("socket closed mid transfer"))
+
+    def _finish(self, exc: typing.Optional[BaseException] = None):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._done.done():
+            return
+        if exc is None:
+            self._done.set_result(None)
+        else:
+            self._done.set_exception(exc)
+
+    def _on_timer(self):
+        self._timer = None
+        self._sender.on_timeout(self._loop.time())
+        if self._sender.unresponsive:
+            self._finish(TimeoutError("receiver stopped acknowledging"))
+            return
+        self._pump()
+
+    def _pump(self):
+        if self._done.done():
+            return
+        sender = self._sender
+        now = self._loop.time()
+        for header, payload in sender.packets_to_send(now):
+            size = len(header)
+            end = size + len(payload)
+            self._packet[:size] = header
+            self._packet[size:end] = payload
+            self._transport.sendto(self._view[:end])
+        if sender.done:
+            final_ack = sender.final_ack(now)
+            for _ in range(FINAL_ACKS):
+                self._transport.sendto(final_ack)
+            self._finish()
+            return
+        # With nothing outstanding, repairs may still be holding the window
+        # for a while, so check back after the shortest timeout.
+        deadline = sender.next_deadline()
+        if deadline is None:
+            deadline = now + util.congestion.MIN_RTO
+        if self._timer is not None:
+            # A timer that fires early just reschedules itself.
+            if self._timer.when() <= deadline:
+                return
+            self._timer.cancel()
+        self._timer = self._loop.call_at(deadline, self._on_timer)
+
+
+async def send_async(sock: socket.socket, source,
+                     congestion: str = util.congestion.DEFAULT_CONTROLLER,
+                     fec: typing.Optional[float] = None,
+                     timestamps: bool = True, checksum: bool = False,
+                     stats: typing.Optional[dict] = None,
+                     metrics: typing.Optional[util.metrics.Metrics] = None,
+                     compression: typing.Optional[str] = None,
+                     signatures: typing.Optional[util.delta.Signatures] = None
+                     ) -> int:
     """
+    Sends data over the running event loop.  The socket is handed to the
+    loop's datagram transport, which closes it once the transfer is over.
 
-    # Naive implementation where we chunk the data to be sent into
-    # packets as large as the network will allow, and then send them
-    # over the network, pausing half a second between sends to let the
-    # network "rest" :)
+    Args:
+        sock -- A socket object, constructed and initialized to communicate
+                over a simulated lossy network.
+        source -- What to send: a bytes-like object or mmap, a binary file
+                  object, or an iterable of bytes chunks.
+        congestion -- The name of the congestion controller to use for this
+                      transfer, one of util.congestion.CONTROLLERS.
+        fec -- If given, protect the transfer with forward error correction,
+               planning repair symbols for this loss rate until the actual
+               rate has been measured.
+        timestamps -- Whether packets carry timestamps for the receiver to
+                      echo, which lets retransmissions be timed.
+        checksum -- Whether packets carry a CRC32, for links that may corrupt
+                    data without the UDP checksum catching it.
+        stats -- If given, a dict to fill in with how many "retransmissions"
+                 and "repairs" were sent, and how many retransmission
+                 "timeouts" expired.
+        metrics -- If given, filled in with telemetry of the transfer.
+        compression -- If given, the codec to compress the data with, one of
+                       util.compression.CODECS, unless a sample of it
+                       doesn't compress.
+        signatures -- If given, the signatures of the receiver's existing
+                      copy of the data, so only what differs from it is
+                      sent.  Signatures of an empty copy are ignored.  Can't
+                      be combined with compression.
+
+    Return:
+        The number of bytes sent, compressed or not.
+
+    Raises:
+        ValueError -- If given both compression and signatures.
+    """
     logger = util.logging.get_logger("project-sender")
-    chunk_size = util.MAX_PACKET
-    pause = .1
-    offsets = range(0, len(data), util.MAX_PACKET)
-    for chunk in [data[i:i + chunk_size] for i in offsets]:
-        sock.send(chunk)
-        logger.info("Pausing for %f seconds", round(pause, 2))
-        time.sleep(pause)
+    options = 0
+    if timestamps:
+        options |= util.packet.FLAG_TIMESTAMP
+    if checksum:
+        options |= util.packet.FLAG_CHECKSUM
+    size = segment_size(options, fec is not None)
+    if signatures is not None and not len(signatures):
+        signatures = None
+    if signatures is not None:
+        if compression is not None:
+            raise ValueError("A delta transfer can't also be compressed")
+        segments = util.compression.open_delta_source(source, size,
+                                                      signatures)
+    elif compression is not None:
+        segments = util.compression.open_source(source, size, compression)
+    else:
+        segments = util.source.open_source(source, size)
+    loop = asyncio.get_running_loop()
+    sender = _Sender(segments, congestion, loop.time(), fec, options)
+    done = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _SenderProtocol(sender, done), sock=sock)
+    if metrics is not None:
+        metrics.start(loop, sender.snapshot)
+    try:
+        await done
+    finally:
+        transport.close()
+        if metrics is not None:
+            metrics.stop()
+        if stats is not None:
+            stats["retransmissions"] = sender.retransmissions
+            stats["repairs"] = sender.repairs_sent
+            stats["timeouts"] = sender.timers.fired
+    logger.info("Sent %d bytes with %d retransmissions and %d repairs",
+                segments.length, sender.retransmissions, sender.repairs_sent)
+    if signatures is not None:
+        logger.info("Sent %d bytes of input as a delta of %d (%.1f%%)",
+                    segments.input_length, segments.length,
+                    100 * segments.length / max(1, segments.input_length))
+    elif segments.compressed:
+        logger.info("Compressed %d bytes of input to %d (%.1f%%)",
+                    segments.input_length, segments.length,
+                    100 * segments.length / max(1, segments.input_length))
+    timers = sender.timers
+    logger.info("%d retransmission timers expired, at most %d in one tick",
+                timers.fired, max(timers.fired_per_tick, default=0))
+    return segments.length
+
+
+class _Receiver:
+    """Receiver state: reassembles segments in order into the destination,
+    and builds the ACKs describing what has arrived.
+
+    When the destination is a regular file open for reading too, so what
+    was written can be read back to be hashed, every segment is written with
+    pwrite at its offset as soon as it arrives, whatever its order, and the
+    file is sized up front once the sender's announced length arrives, so
+    nothing is held in memory for the segments ahead of the next expected
+    one.  Otherwise, those segments wait in `_out_of_order` as the datagram
+    they arrived in, with the bounds of their payload, and are written in
+    order.  Either way the destination is only flushed once
+    the transfer is complete.  A compressed transfer is always written in
+    order, decompressed as it is, and so is a delta transfer, decoded
+    against the basis the receiver was given.  The SHA-256 of the data is
+    worked out as it is delivered: from the segments themselves as they are
+    written in order, and, for a file, by reading back what segments that
+    arrived out of order wrote, from the page cache, a DIGEST_CHUNK at a
+    time, once the segments before them are in.  For protected transfers, the
+    symbols of recent segments are also kept, so a block's decoder can be
+    seeded with them when its first repair symbol arrives.
+
+    ACKs for in order segments are delayed, so one ACK covers several
+    segments.  A segment that arrives out of order, fills a hole, is a
+    duplicate or is the last one, and a repair symbol that recovers a
+    segment, are all acknowledged immediately, so the sender learns of
+    losses without delay, as are the first QUICK_ACKS segments.  A delayed
+    ACK echoes the timestamp of the oldest packet it covers, so the delay is
+    counted in the sender's round trip time rather than hidden from it.
+
+    ACKs carry SYN once the SYN segment has arrived.  Once the last segment
+    has been delivered, ACKs carry FIN, and the receiver lingers until the
+    sender's closing ACK arrives, or until `linger_time` passes without a
+    packet from it.  The timeout it is worked out from is measured like the
+    sender's, from round trips: each new ACK timestamp a packet echoes
+    times the trip from this ACK being sent to the packet arriving.  Every
+    packet arriving while lingering shows the sender timed out without our
+    FIN, so backs the timeout off as the sender's was.
+
+    Args:
+        dest -- Where the reassembled data is written.
+        ack_every -- How many in order segments one ACK may cover.
+        ack_delay -- The longest an ACK may be held back, in seconds.
+        basis -- The receiver's existing copy of the data, if any, which
+                 a delta transfer's copy instructions read from.
+
+    Attributes:
+        packets -- The number of data and repair packets received.
+        acks_sent -- The number of ACKs built.
+        finished -- Whether the transfer has been closed.
+        first_data -- When the first data or repair packet arrived.
+        last_data -- When data was last delivered to the destination.
+        length -- The length the sender announced, once it has arrived.
+        digest -- The SHA-256 of the data delivered in order so far.
+    """
+
+    def __init__(self, dest: io.BufferedIOBase, ack_every: int = ACK_EVERY,
+                 ack_delay: float = ACK_DELAY,
+                 basis: typing.Optional[typing.BinaryIO] = None):
+        self._dest = dest
+        self._basis = basis
+        self._fd: typing.Optional[int] = None
+        self._start = 0
+        if util.source.is_regular_file(dest) and dest.readable():
+            dest.flush()
+            self._fd = dest.fileno()
+            self._start = dest.tell()
+        # The payload size of every segment but the last, and how far the
+        # announced length shifts them, known from the first packet.
+        self._segment_size: typing.Optional[int] = None
+        self._skip = 0
+        self._compressed = False
+        self._decompressor = None
+        self.length: typing.Optional[int] = None
+        self._settled = False
+        self.digest = hashlib.sha256()
+        self._hashed = 0
+        self._ack_every = max(1, ack_every)
+        self._ack_delay = ack_delay
+        self._logger = util.logging.get_logger("project-receiver")
+        self.num_bytes = 0
+        self._expected = 0
+        self._out_of_order = {}
+        # The same sequence numbers, as the ranges ACKs SACK.
+        self._sack_ranges = util.ranges.Ranges()
+        self._received = 0
+        self._symbols = {}
+        self._decoders = {}
+        self._header = util.packet.Header()
+        self._ack = bytearray(util.packet.MAX_ACK_LEN)
+        self._ack_view = memoryview(self._ack)
+        self._unacked = 0
+        self._ack_due: typing.Optional[float] = None
+        self._ack_flags = 0
+        self._echo = 0
+        self._rtt = util.congestion.RttEstimator()
+        self._echoed = 0
+        self._latest: typing.Optional[int] = None
+        self.acks_sent = 0
+        self._syn_received = False
+        self._last_seq: typing.Optional[int] = None
+        self._linger_due: typing.Optional[float] = None
+        self.finished = False
+        self.first_data: typing.Optional[float] = None
+        self.last_data: typing.Optional[float] = None
+
+    @property
+    def complete(self) -> bool:
+        """Whether every segment, up to the last, has been delivered."""
+        return self._last_seq is not None and self._expected > self._last_seq
+
+    @property
+    def packets(self) -> int:
+        """The number of data and repair packets received."""
+        return self._received
+
+    @property
+    def ack_ratio(self) -> float:
+        """ACKs sent per data or repair packet received."""
+        return self.acks_sent / self._received if self._received else 0.0
+
+    def snapshot(self, now: float) -> dict:
+        """Returns the receiver's state, for util.metrics."""
+        return {"packets": self._received,
+                "out_of_order": len(self._out_of_order),
+                "acks_sent": self.acks_sent, "bytes": self.num_bytes}
+
+    def _known(self, seq: int) -> bool:
+        return seq < self._expected or seq in self._out_of_order
+
+    def _layout(self, flags: int):
+        if self._segment_size is None:
+            self._segment_size = segment_size(
+                flags & util.packet.OPTION_FLAGS,
+                bool(flags & util.packet.FLAG_FEC))
+            if flags & util.packet.FLAG_LENGTH:
+                self._skip = util.packet.LENGTH.size
+            if flags & util.packet.FLAG_COMPRESSED:
+                # Decompressed sizes aren't known until decompressed, in
+                # order.
+                self._compressed = True
+                self._fd = None
+
+    def _place(self, seq: int, buffer: bytes, start: int, end: int):
+        self._sack_ranges.add(seq, seq + 1)
+        if seq == 0 and self._skip:
+            self.length, = util.packet.LENGTH.unpack_from(buffer, start)
+            start += self._skip
+            if self._fd is not None:
+                os.ftruncate(self._fd, self._start + self.length)
+        if seq == 0 and self._compressed:
+            try:
+                codec = util.compression.from_ident(
+                    buffer[start] if end > start else None, self._basis)
+            except ValueError as error:
+                raise ValueError("Can't decompress the transfer: {}".format(
+                    error))
+            self._decompressor = codec.decompressor()
+            start += 1
+        if self._fd is None:
+            self._out_of_order[seq] = buffer, start, end
+            return
+        offset = max(0, seq * self._segment_size - self._skip)
+        payload = memoryview(buffer)[start:end]
+        os.pwrite(self._fd, payload, self._start + offset)
+        if seq == self._expected:
+            # In order, so hashed as it is written, once the segments that
+            # arrived out of order ahead of it have been read back.
+            self._hash_written()
+            self.digest.update(payload)
+            self._hashed += len(payload)
+        self._out_of_order[seq] = None, start, end
+
+    def _accept(self, seq: int, buffer: bytes, start: int, end: int):
+        self._place(seq, buffer, start, end)
+        decoder = self._decoder_for(seq)
+        if decoder is not None:
+            symbol = self._symbols.get(seq)
+            if symbol is not None:
+                for recovered in decoder.add_source(seq, symbol):
+                    self._accept_recovered(*recovered)
+
+    def _accept_recovered(self, seq: int, payload: bytes):
+        if self._known(seq):
+            return
+        self._logger.debug("Recovered segment %d from repairs", seq)
+        self._place(seq, payload, 0, len(payload))
+
+    def _decoder_for(self, seq: int) -> typing.Optional[util.fec.BlockDecoder]:
+        for decoder in self._decoders.values():
+            if decoder.first <= seq < decoder.first + decoder.count:
+                return decoder
+        return None
+
+    def _deliver(self) -> bool:
+        delivered = False
+        while self._expected in self._out_of_order:
+            segment, start, end = self._out_of_order.pop(self._expected)
+            if segment is None:
+                self.num_bytes += end - start
+            else:
+                payload = memoryview(segment)[start:end]
+                if self._decompressor is not None:
+                    payload = self._decompressor.decompress(payload)
+                self._dest.write(payload)
+                self.digest.update(payload)
+                self.num_bytes += len(payload)
+            self._symbols.pop(self._expected - util.fec.MAX_BLOCK_SIZE, None)
+            self._expected += 1
+            delivered = True
+        if delivered:
+            self._sack_ranges.trim(self._expected)
+            if self._fd is not None and (
+                    self.num_bytes - self._hashed >= DIGEST_CHUNK):
+                self._hash_written()
+            if self.complete:
+                self.close()
+            for first in [first for first, decoder in self._decoders.items()
+                          if first + decoder.count <= self._expected]:
+                del self._decoders[first]
+        return delivered
+
+    def _hash_written(self):
+        while self._hashed < self.num_bytes:
+            chunk = os.pread(self._fd,
+                             min(DIGEST_CHUNK, self.num_bytes - self._hashed),
+                             self._start + self._hashed)
+            if not chunk:
+                break
+            self.digest.update(chunk)
+            self._hashed += len(chunk)
+
+    def close(self):
+        """Settles the destination: flushes it, and when it is a file,
+        trims it to the data delivered in order, which is the announced
+        length unless the transfer ended early, and moves its position past
+        the data, as if it had been written in order.
+        """
+        if self._settled:
+            return
+        self._settled = True
+        if self._fd is not None:
+            self._hash_written()
+            os.ftruncate(self._fd, self._start + self.num_bytes)
+            self._dest.seek(self._start + self.num_bytes)
+        self._dest.flush()
 
+    def _on_data(self, buffer: bytes, length: int) -> int:
+        header = self._header
+        seq = header.number
+        if header.flags & util.packet.FLAG_LAST:
+            self._last_seq = seq
+        if self._known(seq):
+            return seq
+        self._layout(header.flags)
+        if header.flags & util.packet.FLAG_FEC:
+            self._symbols[seq] = util.fec.to_symbol(
+                memoryview(buffer)[header.size:length],
+                symbol_size(header.flags))
+        self._accept(seq, buffer, header.size, length)
+        return seq
 
-def recv(sock: socket.socket, dest: io.BufferedIOBase) -> int:
+    def _on_repair(self, buffer: bytes, length: int) -> bool:
+        header = self._header
+        first = header.number
+        count, index = util.packet.unpack_repair(buffer, header)
+        if header.flags & util.packet.FLAG_LAST:
+            self._last_seq = first + count - 1
+        size = symbol_size(header.flags)
+        symbol = bytes(buffer[length - size:length])
+        if all(self._known(seq) for seq in range(first, first + count)):
+            return False
+        self._layout(header.flags | util.packet.FLAG_FEC)
+        decoder = self._decoders.get(first)
+        if decoder is None:
+            decoder = util.fec.BlockDecoder(first, count, size)
+            self._decoders[first] = decoder
+            for seq in range(first, first + count):
+                if seq in self._symbols:
+                    decoder.add_source(seq, self._symbols[seq])
+        recovered = decoder.add_repair(index, symbol)
+        for seq, payload in recovered:
+            self._symbols[seq] = util.fec.to_symbol(payload, size)
+            self._accept_recovered(seq, payload)
+        return bool(recovered)
+
+    def on_packet(self, buffer: bytes, length: int, now: float) -> bool:
+        """Processes a datagram.  Segments that can't be written yet keep a
+        reference to it, rather than a copy, so it mustn't be modified
+        afterwards.
+
+        Return:
+            Whether an ACK should be sent straight away.  Otherwise, one may
+            be due by `ack_deadline`.
+
+        Raises:
+            ValueError -- If the transfer is compressed with a codec this
+                          receiver can't decode, or its data doesn't decode.
+        """
+        header = self._header
+        try:
+            header.unpack_from(buffer, length)
+        except util.packet.MalformedPacket as error:
+            self._logger.debug("Dropped packet: %s", error)
+            return False
+        if header.type == util.packet.TYPE_ACK:
+            # The sender's answer to our FIN.
+            if (header.flags & util.packet.FLAG_FIN and
+                    header.number >= self._expected):
+                self.finished = True
+            return False
+        if (header.flags & util.packet.FLAG_TIMESTAMP and
+                header.echo != self._echoed):
+            # The first packet to echo an ACK was most likely sent in answer
+            # to it, where later ones may have been held back.
+            self._echoed = header.echo
+            self._rtt.sample(util.packet.elapsed(now, header.echo))
+        expected = self._expected
+        was_complete = self.complete
+        had_holes = bool(self._out_of_order)
+        if self.first_data is None:
+            self.first_data = now
+        if header.type == util.packet.TYPE_DATA:
+            self._received += 1
+            latest = self._on_data(buffer, length)
+            syn = bool(header.flags & util.packet.FLAG_SYN)
+            self._syn_received |= syn
+            immediate = (latest != expected or had_holes or syn or
+                         bool(header.flags & util.packet.FLAG_LAST))
+        elif (header.type == util.packet.TYPE_REPAIR and
+              length == util.MAX_PACKET):
+            # Repairs always fill a whole datagram, see symbol_size.
+            self._received += 1
+            if not self._on_repair(buffer, length):
+                return False
+            latest = None
+            immediate = True
+        else:
+            return False
+        if self._deliver():
+            self.last_data = now
+        self._logger.debug("Received segment %s, expecting %d", latest,
+                           self._expected)
+        if not self._unacked:
+            # The ACK carries the same options as the packets it answers.
+            self._ack_flags = header.flags & util.packet.OPTION_FLAGS
+            self._echo = header.timestamp
+        self._unacked += 1
+        self._latest = latest
+        if self.complete:
+            # Anything arriving now means the sender hasn't seen our FIN.
+            if was_complete:
+                self._rtt.back_off()
+            self._linger_due = now + linger_time(self._rtt.rto)
+            return True
+        if (immediate or self._unacked >= self._ack_every or
+                self._expected <= QUICK_ACKS):
+            return True
+        if self._ack_due is None:
+            self._ack_due = now + self._ack_delay
+        return False
+
+    def ack_deadline(self) -> typing.Optional[float]:
+        """Returns when the delayed ACK being held back is due, if any."""
+        return self._ack_due
+
+    def linger_deadline(self) -> typing.Optional[float]:
+        """Returns when to stop waiting for the sender's closing ACK, once
+        the transfer is complete.
+        """
+        return self._linger_due
+
+    def on_linger_timeout(self, now: float):
+        """Closes the transfer if the linger deadline has passed."""
+        if self._linger_due is not None and now >= self._linger_due:
+            self.finished = True
+
+    def ack(self, now: float) -> memoryview:
+        """Builds the ACK describing everything received so far, covering
+        every packet not acknowledged yet.
+        """
+        flags = self._ack_flags
+        if self._syn_received:
+            flags |= util.packet.FLAG_SYN
+        if self.complete:
+            flags |= util.packet.FLAG_FIN
+        length = util.packet.pack_ack(
+            self._ack, flags, self._expected, self._received,
+            sack_blocks(self._sack_ranges, self._latest),
+            util.packet.timestamp(now), self._echo)
+        self._unacked = 0
+        self._ack_due = None
+        self.acks_sent += 1
+        return self._ack_view[:length]
+
+
+class _ReceiverProtocol(asyncio.DatagramProtocol):
+    """Feeds the datagrams an event loop receives to a _Receiver, answering
+    with its ACKs, and sends delayed ACKs from a loop timer once they are
+    due.  The transfer ends once the receiver has closed it, or on an empty
+    datagram.  Each datagram is handed to the receiver as the transport
+    received it, without being copied.
+
+    Args:
+        receiver -- The receiver state to drive.
+        done -- Resolved once the transfer ends.
+    """
+
+    def __init__(self, receiver: _Receiver, done: asyncio.Future):
+        self._receiver = receiver
+        self._done = done
+        self._loop = done.get_loop()
+        self._transport = None
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._linger: typing.Optional[asyncio.TimerHandle] = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data:
+            self._finish()
+            return
+        receiver = self._receiver
+        now = self._loop.time()
+        try:
+            immediate = receiver.on_packet(data, len(data), now)
+        except Exception as error:
+            # Data that can't be decoded ends the transfer with the error,
+            # rather than going to the loop's exception handler and leaving
+            # the transfer to time out.
+            self._finish(error)
+            return
+        if immediate:
+            self._send_ack(now)
+        else:
+            deadline = receiver.ack_deadline()
+            if deadline is not None and self._timer is None:
+                self._timer = self._loop.call_at(deadline, self._on_timer)
+        if receiver.finished:
+            self._finish()
+        elif receiver.linger_deadline() is not None and self._linger is None:
+            self._linger = self._loop.call_at(receiver.linger_deadline(),
+                                              self._on_linger)
+
+    def _send_ack(self, now: float):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._transport.sendto(self._receiver.ack(now))
+
+    def _on_timer(self):
+        self._timer = None
+        if self._receiver.ack_deadline() is not None:
+            self._send_ack(self._loop.time())
+
+    def _on_linger(self):
+        # The deadline moves later with every packet, so this may be early.
+        self._linger = None
+        receiver = self._receiver
+        receiver.on_linger_timeout(self._loop.time())
+        if receiver.finished:
+            self._finish()
+        else:
+            self._linger = self._loop.call_at(receiver.linger_deadline(),
+                                              self._on_linger)
+
+    def error_received(self, exc):
+        self._finish(exc)
+
+    def connection_lost(self, exc):
+        self._finish(exc)
+
+    def _finish(self, exc: typing.Optional[BaseException] = None):
+        for timer in (self._timer, self._linger):
+            if timer is not None:
+                timer.cancel()
+        self._timer = self._linger = None
+        if self._done.done():
+            return
+        if exc is None:
+            self._done.set_result(None)
+        else:
+            self._done.set_exception(exc)
+
+
+def recv(sock: socket.socket, dest: io.BufferedIOBase,
+         ack_every: int = ACK_EVERY, ack_delay: float = ACK_DELAY,
+         times: typing.Optional[dict] = None,
+         metrics: typing.Optional[util.metrics.Metrics] = None,
+         summary: typing.Optional[dict] = None,
+         basis: typing.Optional[typing.BinaryIO] = None) -> int:
     """
     Implementation of the receiving logic for receiving data over a slow,
     lossy, constrained network.
 
+    Blocks until the transfer ends, running recv_async on an event loop of
+    its own.
+
+    Args:
+        sock -- A socket object, constructed and initialized to communicate
+                over a simulated lossy network.
+        dest -- Where the received data is written.
+        ack_every -- How many in order segments one ACK may cover.
+        ack_delay -- The longest an ACK may be held back, in seconds.
+        times -- If given, filled in as by recv_async.
+        metrics -- If given, filled in with telemetry of the transfer.
+        summary -- If given, filled in as by recv_async.
+        basis -- If given, as for recv_async.
+
+    Return:
+        The number of bytes written to the destination.
+    """
+    return _run_blocking(sock, recv_async(sock.dup(), dest, ack_every,
+                                          ack_delay, times, metrics,
+                                          summary, basis))
+
+
+async def recv_async(sock: socket.socket, dest: io.BufferedIOBase,
+                     ack_every: int = ACK_EVERY,
+                     ack_delay: float = ACK_DELAY,
+                     times: typing.Optional[dict] = None,
+                     metrics: typing.Optional[util.metrics.Metrics] = None,
+                     summary: typing.Optional[dict] = None,
+                     basis: typing.Optional[typing.BinaryIO] = None) -> int:
+    """
+    Receives data over the running event loop.  The socket is handed to the
+    loop's datagram transport, which closes it once the transfer is over.
+
     Args:
         sock -- A socket object, constructed and initialized to communicate
                 over a simulated lossy network.
+        dest -- Where the received data is written.
+        ack_every -- How many in order segments one ACK may cover.
+        ack_delay -- The longest an ACK may be held back, in seconds.
+        times -- If given, a dict to fill in with "first" and "last": when,
+                 on the loop's clock, the first packet of data arrived and
+                 the last byte was delivered, or None if they never did.
+        metrics -- If given, filled in with telemetry of the transfer.
+        summary -- If given, a dict to fill in with the "length" and the
+                   "sha256" hex digest of the data written, worked out as
+                   it was written, so checking it needn't read it back.
+        basis -- The receiver's existing copy of the data, a binary file
+                 open for reading, which a delta transfer is decoded
+                 against.  It must not be the destination, whose writes
+                 would overwrite the blocks still to be copied.
 
     Return:
         The number of bytes written to the destination.
     """
     logger = util.logging.get_logger("project-receiver")
-    # Naive solution, where we continually read data off the socket
-    # until we don't receive any more data, and then return.
-    num_bytes = 0
-    while True:
-        data = sock.recv(util.MAX_PACKET)
-        if not data:
-            break
-        logger.info("Received %d bytes", len(data))
-        dest.write(data)
-        num_bytes += len(data)
-        dest.flush()
-    return num_bytes
+    receiver = _Receiver(dest, ack_every, ack_delay, basis)
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _ReceiverProtocol(receiver, done), sock=sock)
+    if metrics is not None:
+        metrics.start(loop, receiver.snapshot)
+    try:
+        await done
+    finally:
+        transport.close()
+        receiver.close()
+        if metrics is not None:
+            metrics.stop()
+        if times is not None:
+            times["first"] = receiver.first_data
+            times["last"] = receiver.last_data
+        if summary is not None:
+            summary["length"] = receiver.num_bytes
+            summary["sha256"] = receiver.digest.hexdigest()
+    logger.info("Received %d bytes in %d packets, sending %d ACKs (%.2f per "
+                "packet)", receiver.num_bytes, receiver.packets,
+                receiver.acks_sent, receiver.ack_ratio)
+    return receiver.num_bytes
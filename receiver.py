@@ -5,8 +5,13 @@ to STDOUT.
 """
 
 import argparse
+import os
 import sys
 import logging
+import tempfile
+import util.delta
+import util.utils
+import util.metrics
 import util.wire
 import project
 
@@ -18,18 +23,95 @@ PARSER.add_argument("-p", "--port", type=int, default=9999,
 PARSER.add_argument("-f", "--file", type=str,
                     help="The path to write the data recorded over the buffer "
                          "to (default=STDOUT).")
+PARSER.add_argument("--ack-every", type=int, default=project.ACK_EVERY,
+                    help="How many in order segments one ACK may cover "
+                         "(default=%(default)s).")
+PARSER.add_argument("--ack-delay", type=float, default=project.ACK_DELAY,
+                    help="The longest, in seconds, an ACK may be held back "
+                         "(default=%(default)s).")
+PARSER.add_argument("--delta", action="store_true",
+                    help="Advertise the block signatures of the existing "
+                         "--file to the sender, which then only sends what "
+                         "differs from it.  The sender must be started with "
+                         "--delta too.")
+PARSER.add_argument("--flow", default="",
+                    help="The ID of the flow to join on the wire, when "
+                         "several transfers share it.")
+PARSER.add_argument("--status-fd", type=int, default=None,
+                    help="A pipe to report on: once connected to the wire, "
+                         "and with when data first and last arrived, and the "
+                         "length and SHA-256 of what was written, once "
+                         "done.")
+PARSER.add_argument("--metrics", default=None,
+                    help="Write a time series of the transfer's telemetry "
+                         "to this path, as CSV if it ends in .csv, otherwise "
+                         "as JSON lines.")
+PARSER.add_argument("--metrics-interval", type=float,
+                    default=util.metrics.DEFAULT_INTERVAL,
+                    help="The seconds between telemetry samples "
+                         "(default=%(default)s).")
 PARSER.add_argument('-v', '--verbose', action="store_true",
                     help="Enable extra verbose mode.")
 ARGS = PARSER.parse_args()
 
+if ARGS.delta and not ARGS.file:
+    PARSER.error("--delta needs the existing --file to update")
+
 if ARGS.verbose:
-    logging.getLogger('project-receiver').setLevel(logging.DEBUG)
+    for A_NAME in ("project-receiver", "project-sender"):
+        logging.getLogger(A_NAME).setLevel(logging.DEBUG)
+
+# A delta transfer copies blocks from the existing file as it goes, so the
+# new version is written alongside it, and only replaces it once complete.
+BASIS = None
+if ARGS.delta:
+    if os.path.exists(ARGS.file):
+        BASIS = open(ARGS.file, 'rb')
+    OUTPUT = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(os.path.abspath(ARGS.file)), delete=False)
+elif ARGS.file:
+    OUTPUT = open(ARGS.file, 'w+b')
+else:
+    OUTPUT = sys.stdout.buffer
+
+SOC = util.wire.bad_socket(ARGS.port, ARGS.flow.encode())
+SIGNATURE_SOC = None
+if ARGS.delta:
+    SIGNATURE_SOC = util.wire.bad_socket(
+        ARGS.port, util.delta.signature_flow(ARGS.flow.encode()))
+
+util.utils.report_status(ARGS.status_fd, util.utils.STATUS_READY)
 
-OUTPUT = open(ARGS.file, 'wb') if ARGS.file else sys.stdout.buffer
+METRICS = None
+if ARGS.metrics:
+    METRICS = util.metrics.Metrics(ARGS.metrics_interval)
 
-SOC = util.wire.bad_socket(ARGS.port)
+if SIGNATURE_SOC is not None:
+    project.send(SIGNATURE_SOC, util.delta.signatures(BASIS).pack())
+    SIGNATURE_SOC.close()
 
-project.recv(SOC, OUTPUT)
+TIMES = {}
+SUMMARY = {}
+try:
+    project.recv(SOC, OUTPUT, ack_every=ARGS.ack_every,
+                 ack_delay=ARGS.ack_delay, times=TIMES, metrics=METRICS,
+                 summary=SUMMARY, basis=BASIS)
+except BaseException:
+    if ARGS.delta:
+        os.remove(OUTPUT.name)
+    raise
+if ARGS.delta:
+    OUTPUT.close()
+    if BASIS is not None:
+        os.chmod(OUTPUT.name, os.fstat(BASIS.fileno()).st_mode & 0o7777)
+        BASIS.close()
+    os.replace(OUTPUT.name, ARGS.file)
+if METRICS is not None:
+    METRICS.write(ARGS.metrics)
+util.utils.report_status(ARGS.status_fd, util.utils.STATUS_TIMES,
+                         TIMES["first"], TIMES["last"])
+util.utils.report_status(ARGS.status_fd, util.utils.STATUS_DIGEST,
+                         SUMMARY["length"], SUMMARY["sha256"])
 
 SOC.close()
 OUTPUT.close()
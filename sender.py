@@ -4,7 +4,12 @@ Client that sends STDIN, over a simulated faulty network connection.
 """
 
 import argparse
+import io
 import logging
+import util.compression
+import util.congestion
+import util.delta
+import util.metrics
 import util.wire
 import project
 
@@ -15,16 +20,70 @@ PARSER.add_argument("-p", "--port", type=int, default=9999,
                     help="The port to connect to the simulated network over.")
 PARSER.add_argument("-f", "--file", required=True,
                     help="The file to send over the simulated network.")
+PARSER.add_argument("-c", "--congestion",
+                    choices=sorted(util.congestion.CONTROLLERS),
+                    default=util.congestion.DEFAULT_CONTROLLER,
+                    help="The congestion controller to use for the transfer.")
+PARSER.add_argument("--fec", type=float, nargs="?", const=0.1, default=None,
+                    metavar="LOSS",
+                    help="Protect the transfer with forward error correction, "
+                         "planning repair symbols for the given loss rate "
+                         "(default 0.1) until the real rate is measured.")
+PARSER.add_argument("--checksum", action="store_true",
+                    help="Protect every packet with a CRC32.")
+PARSER.add_argument("-z", "--compress", default=None,
+                    choices=sorted(util.compression.CODECS),
+                    help="Compress the transfer with this codec, unless the "
+                         "start of the file doesn't compress.")
+PARSER.add_argument("--delta", action="store_true",
+                    help="Wait for the receiver to advertise the block "
+                         "signatures of its existing copy, and send only "
+                         "what differs from it.  The receiver must be "
+                         "started with --delta too.")
+PARSER.add_argument("--flow", default="",
+                    help="The ID of the flow to join on the wire, when "
+                         "several transfers share it.")
+PARSER.add_argument("--metrics", default=None,
+                    help="Write a time series of the transfer's telemetry "
+                         "to this path, as CSV if it ends in .csv, otherwise "
+                         "as JSON lines.")
+PARSER.add_argument("--metrics-interval", type=float,
+                    default=util.metrics.DEFAULT_INTERVAL,
+                    help="The seconds between telemetry samples "
+                         "(default=%(default)s).")
 PARSER.add_argument('-v', '--verbose', action="store_true",
                     help="Enable extra verbose mode.")
 ARGS = PARSER.parse_args()
 
+if ARGS.delta and ARGS.compress:
+    PARSER.error("--delta and --compress can't be combined")
+
 if ARGS.verbose:
-    logging.getLogger('project-sender').setLevel(logging.DEBUG)
+    for A_NAME in ("project-sender", "project-receiver"):
+        logging.getLogger(A_NAME).setLevel(logging.DEBUG)
+
+INPUT = open(ARGS.file, 'rb')
+SOC = util.wire.bad_socket(ARGS.port, ARGS.flow.encode())
+
+SIGNATURES = None
+if ARGS.delta:
+    SIGNATURE_SOC = util.wire.bad_socket(
+        ARGS.port, util.delta.signature_flow(ARGS.flow.encode()))
+    SIGNATURE_DATA = io.BytesIO()
+    project.recv(SIGNATURE_SOC, SIGNATURE_DATA)
+    SIGNATURE_SOC.close()
+    SIGNATURES = util.delta.Signatures.unpack(SIGNATURE_DATA.getvalue())
+
+METRICS = None
+if ARGS.metrics:
+    METRICS = util.metrics.Metrics(ARGS.metrics_interval)
 
-DATA = open(ARGS.file, 'rb').read()
-SOC = util.wire.bad_socket(ARGS.port)
+project.send_stream(SOC, INPUT, congestion=ARGS.congestion, fec=ARGS.fec,
+                    checksum=ARGS.checksum, metrics=METRICS,
+                    compression=ARGS.compress, signatures=SIGNATURES)
 
-project.send(SOC, DATA)
+if METRICS is not None:
+    METRICS.write(ARGS.metrics)
 
 SOC.close()
+INPUT.close()
@@ -4,17 +4,24 @@ socket connections.
 """
 import sys
 import argparse
+import json
 import logging
+import signal
+import util.capture
+import util.flows
+import util.link
 import util.wire
 import util.logging
+import util.utils
 
 # Grab the dockblock of the current module, to avoid redundantly describing
 # what this program does.
 DESC = sys.modules[globals()['__name__']].__doc__
 PARSER = argparse.ArgumentParser(description=DESC)
 PARSER.add_argument('-p', '--port', type=int, default=9999,
-                    help="The port this program should listen on (defaults to "
-                         "9999).")
+                    help="The port this program should listen on, or 0 for "
+                         "any free one, reported on --status-fd (defaults "
+                         "to 9999).")
 PARSER.add_argument('-l', '--loss', type=float, default=0.0,
                     help="The percentage of packets to drop.")
 PARSER.add_argument('-d', '--delay', type=float, default=0.0,
@@ -24,13 +31,79 @@ PARSER.add_argument('-b', '--buffer', type=int, default=100000,
                     help="The size of the buffer to simulate.")
 PARSER.add_argument('-v', '--verbose', action="store_true",
                     help="Enable extra verbose mode.")
+PARSER.add_argument('--capture', default=None,
+                    help="Record every packet into an in memory ring, "
+                         "written to this path as a pcap file on shutdown.")
+PARSER.add_argument('--capture-size', type=int,
+                    default=util.capture.DEFAULT_RECORDS,
+                    help="The number of most recent packets the capture "
+                         "keeps (defaults to {}).".format(
+                             util.capture.DEFAULT_RECORDS))
+PARSER.add_argument('--queue', default=util.flows.DEFAULT_QUEUE,
+                    choices=sorted(util.flows.QUEUES),
+                    help="How flows sharing the wire are queued (defaults "
+                         "to %(default)s).")
+PARSER.add_argument('--batch-window', type=float,
+                    default=util.wire.BATCH_WINDOW,
+                    help="Release packets due within the same window of this "
+                         "many seconds together (defaults to %(default)s).")
+PARSER.add_argument('--uvloop', action="store_true",
+                    help="Run the wire on uvloop's event loop, which must be "
+                         "installed.")
+PARSER.add_argument('--status-fd', type=int, default=None,
+                    help="A pipe to report on once the wire is listening, "
+                         "and on which port.")
+PARSER.add_argument('--stats', default=None,
+                    help="Write the wire's statistics to this path, as JSON, "
+                         "instead of printing them, on shutdown and on "
+                         "SIGUSR1.")
+util.link.add_arguments(PARSER)
 ARGS = PARSER.parse_args()
 
 if ARGS.verbose:
     logging.getLogger('project-wire').setLevel(logging.DEBUG)
 
+CAPTURE = None
+if ARGS.capture:
+    CAPTURE = util.capture.CaptureRing(ARGS.capture_size)
+
+LINK = util.link.from_arguments(ARGS)
+
+if ARGS.uvloop and util.wire.uvloop is None:
+    PARSER.error("--uvloop needs uvloop to be installed")
+
 TRANSPORT, LOOP = util.wire.create_server(ARGS.port, ARGS.loss,
-                                               ARGS.delay, ARGS.buffer)
+                                          ARGS.delay, ARGS.buffer, CAPTURE,
+                                          LINK, ARGS.queue,
+                                          ARGS.batch_window, ARGS.uvloop)
+WIRE = TRANSPORT.get_protocol()
+
+
+def dump_stats():
+    """Prints the wire's statistics, or writes them to the --stats path.
+    When several flows shared the wire, each one's share is included.
+    """
+    now = LOOP.time()
+    shared = len(WIRE.flow_stats) > 1
+    if ARGS.stats:
+        stats = WIRE.stats.to_dict(now)
+        if shared:
+            stats.update(util.flows.to_dict(WIRE.flow_stats))
+        with open(ARGS.stats, "w") as handle:
+            json.dump(stats, handle, indent=2)
+    else:
+        lines = WIRE.stats.summarize(now)
+        if shared:
+            lines += util.flows.summarize(WIRE.flow_stats)
+        print("\n".join(lines), flush=True)
+
+
+# Being terminated is the usual way to stop the wire, so shut down cleanly
+# on it, to get the chance to write the capture out.
+LOOP.add_signal_handler(signal.SIGTERM, LOOP.stop)
+LOOP.add_signal_handler(signal.SIGUSR1, dump_stats)
+util.utils.report_status(ARGS.status_fd, util.utils.STATUS_READY,
+                         TRANSPORT.get_extra_info('sockname')[1])
 
 try:
     LOOP.run_forever()
@@ -38,4 +111,8 @@ except KeyboardInterrupt:
     pass
 
 TRANSPORT.close()
+dump_stats()
 LOOP.close()
+
+if CAPTURE is not None:
+    CAPTURE.dump(ARGS.capture)
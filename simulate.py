@@ -0,0 +1,165 @@
+"""
+Runs a transfer through the lossy wire entirely in simulated time, in one
+process, under the same conditions tester.py would set up.  Runs are
+repeatable given the same seed.  With --flows, several transfers of the file
+share the wire at once, each as its own flow, and how fairly they shared it
+is reported too.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import logging
+import pathlib
+import sys
+import time
+import typing
+import util.congestion
+import util.flows
+import util.link
+import util.sim
+import project
+
+DESC = sys.modules[globals()['__name__']].__doc__
+PARSER = argparse.ArgumentParser(description=DESC)
+PARSER.add_argument('-l', '--loss', type=float, default=0.0,
+                    help="The percentage of packets to drop.")
+PARSER.add_argument('-d', '--delay', type=float, default=0.0,
+                    help="The number of seconds, as a float, to wait before "
+                         "forwarding a packet on.")
+PARSER.add_argument('-b', '--buffer', type=int, default=2,
+                    help="The size of the buffer to simulate (defaults to "
+                         "2 packets).")
+PARSER.add_argument('-f', '--file', required=True,
+                    help="The file to send over the wire.")
+PARSER.add_argument('-r', '--receive', default=None,
+                    help="The path to write the received file to, if "
+                         "anywhere.")
+PARSER.add_argument('-c', '--congestion',
+                    default=util.congestion.DEFAULT_CONTROLLER,
+                    choices=sorted(util.congestion.CONTROLLERS),
+                    help="The congestion controller the sender uses "
+                         "(defaults to %(default)s).")
+PARSER.add_argument('--fec', type=float, nargs='?', const=0.1, default=None,
+                    metavar="LOSS",
+                    help="Protect the transfer with forward error "
+                         "correction, optionally planning for this loss "
+                         "rate (default 0.1) until it has been measured.")
+PARSER.add_argument('--flows', type=int, default=1,
+                    help="The number of transfers to run at once, each as "
+                         "its own flow on the wire (defaults to 1).")
+PARSER.add_argument('--queue', default=util.flows.DEFAULT_QUEUE,
+                    choices=sorted(util.flows.QUEUES),
+                    help="How the flows are queued on the wire (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-s', '--summary', action="store_true",
+                    help="Print a one line summary of whether the "
+                         "transaction was successful, instead of a more "
+                         "verbose description of the result.")
+PARSER.add_argument('-v', '--verbose', action="store_true",
+                    help="Enable extra verbose mode.")
+util.link.add_arguments(PARSER)
+PARSER.set_defaults(seed=0)
+ARGS = PARSER.parse_args()
+
+if ARGS.verbose:
+    for A_NAME in ("project-wire", "project-sender", "project-receiver"):
+        logging.getLogger(A_NAME).setLevel(logging.DEBUG)
+
+INPUT_PATH = pathlib.Path(ARGS.file)
+INPUT_DATA = INPUT_PATH.read_bytes()
+
+SIMULATION = util.sim.Simulation(ARGS.loss, ARGS.delay, ARGS.buffer,
+                                 link=util.link.from_arguments(ARGS),
+                                 queue=ARGS.queue)
+# The receiving socket, sending socket and output of each flow.
+FLOWS = []
+for A_FLOW in range(1, ARGS.flows + 1):
+    FLOW_ID = (str(A_FLOW).encode() if ARGS.flows > 1
+               else util.flows.DEFAULT_FLOW)
+    FLOWS.append((SIMULATION.connect(FLOW_ID), SIMULATION.connect(FLOW_ID),
+                  io.BytesIO()))
+
+
+async def transfer_flow(receiving_socket, sending_socket,
+                        output: io.BytesIO) -> float:
+    """Runs both ends of one transfer, returning how long the sender took."""
+    receiving = asyncio.ensure_future(
+        project.recv_async(receiving_socket, output))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await project.send_async(sending_socket, INPUT_DATA,
+                             congestion=ARGS.congestion, fec=ARGS.fec)
+    duration = loop.time() - start
+    await receiving
+    return duration
+
+
+async def transfer() -> typing.List[float]:
+    """Runs every flow's transfer at once, returning how long each sender
+    took.
+    """
+    return await asyncio.gather(*(transfer_flow(*flow) for flow in FLOWS))
+
+
+START_CPU = time.process_time()
+try:
+    DURATIONS = SIMULATION.run(transfer())
+finally:
+    SIMULATION.close()
+CPU_SECONDS = time.process_time() - START_CPU
+
+INPUT_HASH = hashlib.sha256(INPUT_DATA).hexdigest()
+RECEIVED = [output.getvalue() for _, _, output in FLOWS]
+if ARGS.receive:
+    pathlib.Path(ARGS.receive).write_bytes(RECEIVED[0])
+
+RECV_HASHES = [hashlib.sha256(data).hexdigest() for data in RECEIVED]
+SUCCESSES = [a_hash == INPUT_HASH for a_hash in RECV_HASHES]
+IS_SUCCESS = all(SUCCESSES)
+# A transfer can finish without any simulated time passing, on a wire with
+# no delay or rate limit, which has no rate to report: it is shown as
+# instant, and left out of the fairness index rather than counted as starved.
+RATES = [round(((len(data) / seconds) / 1000), 2) if seconds else None
+         for data, seconds in zip(RECEIVED, DURATIONS)]
+RATE_TEXTS = ["{} kB/s".format(rate) if rate is not None else "instant"
+              for rate in RATES]
+FAIRNESS = "Jain's fairness index: {:.3f}".format(
+    util.flows.jain_index([rate for rate in RATES if rate is not None]))
+TEMPLATE = "[{}] latency={}ms, packet loss={}%, buffer={}, throughput={}"
+if ARGS.summary:
+    for IS_CORRECT, RATE in zip(SUCCESSES, RATES):
+        SUMMARY = TEMPLATE.format(
+            "SUCCESS" if IS_CORRECT else "INCORRECT",
+            round(ARGS.delay * 1000),
+            round(ARGS.loss * 100, 2),
+            ARGS.buffer,
+            "{} Kb/s".format(RATE) if RATE is not None else "instant"
+        )
+        print(SUMMARY)
+    if len(FLOWS) > 1:
+        print(FAIRNESS)
+else:
+    print("\n")
+    print("Success" if IS_SUCCESS else "Incorrect")
+    print("===\n")
+
+    print("Input")
+    print("---")
+    print("File: {}\nLength: {}\nHash: {}".format(
+        str(INPUT_PATH), len(INPUT_DATA), INPUT_HASH))
+
+    for IDX, (DATA, RECV_HASH) in enumerate(zip(RECEIVED, RECV_HASHES)):
+        print("\nReceived" + (" (flow {})".format(IDX + 1)
+                              if len(FLOWS) > 1 else ""))
+        print("---")
+        print("Length: {}\nHash: {}".format(len(DATA), RECV_HASH))
+
+    print("\nStats")
+    print("---")
+    print("Time: {} secs (simulated), {} secs of CPU\nRate: {}".format(
+        round(max(DURATIONS), 2), round(CPU_SECONDS, 2),
+        ", ".join(RATE_TEXTS)))
+    if len(FLOWS) > 1:
+        print(FAIRNESS)
+sys.exit(0 if IS_SUCCESS else 1)
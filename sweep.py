@@ -0,0 +1,260 @@
+"""
+Sweeps the transport across a grid of wire conditions, in simulated time.
+
+Every combination of the given losses, delays, buffer sizes and file sizes
+is a point of the grid, and each point is run as several trials, each with
+the wire seeded differently, so one lucky or unlucky roll of the wire's
+losses doesn't decide the result.  Each trial's throughput, completion time
+and retransmissions are recorded, and summarized per point as the median
+and 95th percentile over the trials.
+
+The results can be written as CSV or JSON, and compared against the JSON of
+an earlier run: if the median throughput of any point has fallen by more
+than the threshold, the sweep fails.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+import json
+import random
+import sys
+import time
+import typing
+import util.congestion
+import util.sim
+import util.utils
+import project
+
+DESC = sys.modules[globals()['__name__']].__doc__
+PARSER = argparse.ArgumentParser(
+    description=DESC, formatter_class=argparse.RawDescriptionHelpFormatter)
+PARSER.add_argument('-l', '--loss', default="0,0.01,0.05",
+                    help="The loss rates to sweep, separated by commas "
+                         "(defaults to %(default)s).")
+PARSER.add_argument('-d', '--delay', default="0.01,0.05",
+                    help="The delays, in seconds, to sweep (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-b', '--buffer', default="10,50",
+                    help="The buffer sizes, in packets, to sweep (defaults "
+                         "to %(default)s).")
+PARSER.add_argument('-z', '--size', default="100000,1000000",
+                    help="The file sizes, in bytes, to sweep (defaults to "
+                         "%(default)s).")
+PARSER.add_argument('-k', '--trials', type=int, default=5,
+                    help="The number of trials, each with its own seed, to "
+                         "run at every point (defaults to %(default)s).")
+PARSER.add_argument('--seed', type=int, default=0,
+                    help="The seed of each point's first trial; the rest "
+                         "count up from it (defaults to %(default)s).")
+PARSER.add_argument('-c', '--congestion',
+                    default=util.congestion.DEFAULT_CONTROLLER,
+                    choices=sorted(util.congestion.CONTROLLERS),
+                    help="The congestion controller the sender uses "
+                         "(defaults to %(default)s).")
+PARSER.add_argument('--fec', type=float, nargs='?', const=0.1, default=None,
+                    metavar="LOSS",
+                    help="Protect the transfers with forward error "
+                         "correction, optionally planning for this loss "
+                         "rate (default 0.1) until it has been measured.")
+PARSER.add_argument('--csv', default=None,
+                    help="Write the summary of every point to this CSV "
+                         "file.")
+PARSER.add_argument('--json', default=None,
+                    help="Write every trial and the summary of every point "
+                         "to this JSON file, which can later serve as a "
+                         "--baseline.")
+PARSER.add_argument('--baseline', default=None,
+                    help="The JSON written by an earlier sweep, to compare "
+                         "this one against.")
+PARSER.add_argument('--threshold', type=float, default=0.1,
+                    help="Fail if a point's median throughput is lower than "
+                         "the baseline's by more than this fraction "
+                         "(defaults to %(default)s).")
+ARGS = PARSER.parse_args()
+
+# The parameters that make up a point of the grid.
+POINT_KEYS = ("loss", "delay", "buffer", "size")
+# The per trial measurements summarized at each point.
+METRICS = ("throughput", "seconds", "retransmissions")
+
+
+def parse_list(text: str, kind: typing.Callable) -> list:
+    """Parses a comma separated list of values of one type."""
+    return [kind(a_value) for a_value in text.split(",") if a_value.strip()]
+
+
+def file_data(size: int) -> bytes:
+    """Returns the contents of the file of the given size every trial
+    sends, the same from one sweep to the next.
+    """
+    return random.Random(size).randbytes(size)
+
+
+def run_trial(loss: float, delay: float, buffer: int, data: bytes,
+              seed: int) -> dict:
+    """Transfers data over a simulated wire.
+
+    Return:
+        Whether the data arrived intact, its throughput in kB/s, the
+        simulated seconds the sender took, and how many retransmissions,
+        repairs and retransmission timeouts the sender needed.  A transfer
+        that took no simulated time at all, as on a wire with no delay, has
+        no throughput, and is marked instant instead.
+    """
+    simulation = util.sim.Simulation(loss, delay, buffer, seed)
+    receiving_socket = simulation.connect()
+    sending_socket = simulation.connect()
+    output = io.BytesIO()
+    stats = {}
+
+    async def transfer() -> float:
+        receiving = asyncio.ensure_future(
+            project.recv_async(receiving_socket, output))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await project.send_async(sending_socket, data,
+                                 congestion=ARGS.congestion, fec=ARGS.fec,
+                                 stats=stats)
+        duration = loop.time() - start
+        await receiving
+        return duration
+
+    try:
+        seconds = simulation.run(transfer())
+        success = output.getvalue() == data
+    except (util.sim.SimulationStalled, TimeoutError):
+        seconds, success = None, False
+    finally:
+        simulation.close()
+    throughput = None
+    if success and seconds:
+        throughput = round(len(data) / seconds / 1000, 2)
+    return {"success": success, "throughput": throughput,
+            "instant": success and seconds == 0,
+            "seconds": seconds,
+            "retransmissions": stats.get("retransmissions"),
+            "repairs": stats.get("repairs"),
+            "timeouts": stats.get("timeouts")}
+
+
+def summarize(point: dict, trials: typing.List[dict]) -> dict:
+    """Returns a point's parameters, how many of its trials succeeded, and
+    the median and 95th percentile of each metric over those that did.
+    Instant trials are counted, but have no throughput to contribute.
+    """
+    summary = dict(point)
+    summary["trials"] = len(trials)
+    summary["successes"] = sum(1 for a_trial in trials if a_trial["success"])
+    summary["instant"] = sum(1 for a_trial in trials if a_trial["instant"])
+    for a_metric in METRICS:
+        values = [a_trial[a_metric] for a_trial in trials
+                  if a_trial["success"] and a_trial[a_metric] is not None]
+        summary[a_metric + "_median"] = util.utils.percentile(values, 0.5)
+        summary[a_metric + "_p95"] = util.utils.percentile(values, 0.95)
+    return summary
+
+
+def rate_text(summary: dict, key: str) -> str:
+    """Returns one of a point's throughput statistics to print, or instant
+    if every trial that succeeded took no time.
+    """
+    value = summary[key]
+    if value != value and summary["instant"]:
+        return "instant"
+    return str(round(value, 2))
+
+
+def compare(points: typing.List[dict], baseline: typing.List[dict]
+            ) -> typing.List[str]:
+    """Prints how each point's median throughput changed from the baseline.
+
+    Return:
+        A description of each point that regressed by more than the
+        threshold.
+    """
+    previous = {tuple(a_point[a_key] for a_key in POINT_KEYS): a_point
+                for a_point in baseline}
+    regressions = []
+    print("\nChange in median throughput from {}".format(ARGS.baseline))
+    for a_point in points:
+        key = tuple(a_point[a_key] for a_key in POINT_KEYS)
+        before = previous.get(key)
+        label = "loss={} delay={} buffer={} size={}".format(*key)
+        if before is None:
+            print("  {}: not in the baseline".format(label))
+            continue
+        old = before["throughput_median"]
+        new = a_point["throughput_median"]
+        if not old or old != old:
+            print("  {}: no baseline throughput".format(label))
+            continue
+        if new != new and a_point["instant"]:
+            print("  {}: {:.2f} kB/s -> instant".format(label, old))
+            continue
+        change = (new / old - 1) if new == new else -1.0
+        print("  {}: {:.2f} -> {:.2f} kB/s ({:+.1%})".format(
+            label, old, new, change))
+        if change < -ARGS.threshold:
+            regressions.append("{} fell {:.1%}".format(label, -change))
+    return regressions
+
+
+GRID = list(itertools.product(parse_list(ARGS.loss, float),
+                              parse_list(ARGS.delay, float),
+                              parse_list(ARGS.buffer, int),
+                              parse_list(ARGS.size, int)))
+SEEDS = range(ARGS.seed, ARGS.seed + ARGS.trials)
+
+TRIALS = []
+POINTS = []
+START_CPU = time.process_time()
+ROW = "{:>6} {:>6} {:>6} {:>9} {:>7} {:>12} {:>12} {:>10} {:>10}"
+print(ROW.format("loss", "delay", "buffer", "size", "ok", "kB/s p50",
+                 "kB/s p95", "rtx p50", "rtx p95"))
+for LOSS, DELAY, BUFFER, SIZE in GRID:
+    POINT = dict(zip(POINT_KEYS, (LOSS, DELAY, BUFFER, SIZE)))
+    DATA = file_data(SIZE)
+    POINT_TRIALS = []
+    for A_SEED in SEEDS:
+        TRIAL = dict(POINT, seed=A_SEED)
+        TRIAL.update(run_trial(LOSS, DELAY, BUFFER, DATA, A_SEED))
+        POINT_TRIALS.append(TRIAL)
+    TRIALS += POINT_TRIALS
+    SUMMARY = summarize(POINT, POINT_TRIALS)
+    POINTS.append(SUMMARY)
+    print(ROW.format(LOSS, DELAY, BUFFER, SIZE,
+                     "{}/{}".format(SUMMARY["successes"], SUMMARY["trials"]),
+                     rate_text(SUMMARY, "throughput_median"),
+                     rate_text(SUMMARY, "throughput_p95"),
+                     SUMMARY["retransmissions_median"],
+                     SUMMARY["retransmissions_p95"]))
+print("\n{} trials in {} secs of CPU".format(
+    len(TRIALS), round(time.process_time() - START_CPU, 2)))
+
+if ARGS.csv:
+    with open(ARGS.csv, "w", newline="") as HANDLE:
+        WRITER = csv.DictWriter(HANDLE, fieldnames=list(POINTS[0]))
+        WRITER.writeheader()
+        WRITER.writerows(POINTS)
+
+if ARGS.json:
+    with open(ARGS.json, "w") as HANDLE:
+        json.dump({"congestion": ARGS.congestion, "fec": ARGS.fec,
+                   "points": POINTS, "trials": TRIALS}, HANDLE, indent=2)
+
+FAILURES = [a_point for a_point in POINTS
+            if a_point["successes"] < a_point["trials"]]
+for A_POINT in FAILURES:
+    print("! loss={loss} delay={delay} buffer={buffer} size={size}: "
+          "{successes} of {trials} trials succeeded".format(**A_POINT))
+
+REGRESSIONS = []
+if ARGS.baseline:
+    with open(ARGS.baseline) as HANDLE:
+        REGRESSIONS = compare(POINTS, json.load(HANDLE)["points"])
+    for A_REGRESSION in REGRESSIONS:
+        print("! Regression: {}".format(A_REGRESSION))
+
+sys.exit(1 if FAILURES or REGRESSIONS else 0)
@@ -3,22 +3,34 @@ Utility script for testing ptoject solutions under user set conditions.
 """
 import time
 import argparse
+import asyncio
 import subprocess
 import hashlib
+import io
+import json
 import pathlib
 import sys
 import os
+import shutil
 import tempfile
 import signal
 import logging
+import util.capture
+import util.compression
+import util.congestion
+import util.delta
+import util.flows
 import util.logging
+import util.metrics
 import util.utils
+import util.wire
+import project
 
 DESC = sys.modules[globals()['__name__']].__doc__
 PARSER = argparse.ArgumentParser(description=DESC)
 PARSER.add_argument('-p', '--port', type=int, default=9999,
-                    help="The port to simulate the lossy wire on (defaults to "
-                         "9999).")
+                    help="The port to simulate the lossy wire on, or 0 for "
+                         "any free one (defaults to 9999).")
 PARSER.add_argument('-l', '--loss', type=float, default=0.0,
                     help="The percentage of packets to drop.")
 PARSER.add_argument('-d', '--delay', type=float, default=0.0,
@@ -39,21 +51,144 @@ PARSER.add_argument('-s', '--summary', action="store_true",
                          "verbose description of the result.")
 PARSER.add_argument('-v', '--verbose', action="store_true",
                     help="Enable extra verbose mode.")
+PARSER.add_argument('-c', '--capture', default=None,
+                    help="Have the wire record every packet, writing them "
+                         "to this path as a pcap file once done.")
+PARSER.add_argument('-i', '--in-process', action="store_true",
+                    help="Run the wire, receiver and sender on one event "
+                         "loop in this process, rather than as scripts of "
+                         "their own.")
+PARSER.add_argument('-m', '--metrics', default=None,
+                    help="Have the sender and receiver write time series of "
+                         "their telemetry, as sender.jsonl and "
+                         "receiver.jsonl, into this directory.")
+PARSER.add_argument('-w', '--wire-stats', action="store_true",
+                    help="Include the wire's statistics, such as why it "
+                         "dropped packets, in the results.")
+PARSER.add_argument('-z', '--compress', default=None,
+                    choices=sorted(util.compression.CODECS),
+                    help="Have the sender compress the transfer with this "
+                         "codec.")
+PARSER.add_argument('--basis', default=None,
+                    help="Start the receiver off with a copy of this file, "
+                         "an earlier version of --file, and have the sender "
+                         "only send what differs from it.")
 ARGS = PARSER.parse_args()
+if ARGS.basis and ARGS.compress:
+    PARSER.error("--basis and --compress can't be combined")
 
 LOGGER = util.logging.get_logger("project-tester")
 if ARGS.verbose:
     LOGGER.setLevel(logging.DEBUG)
 
 PYTHON_BINARY = sys.executable
-SERVER_ARGS = [PYTHON_BINARY, "server.py"]
 
-if ARGS.verbose:
-    SERVER_ARGS.append("-v")
+# How long, in seconds, the receiver may take to exit after the sender has:
+# as long as it lingers for the sender's closing ACK, by the same rule it
+# uses, from the timeout a round trip over this wire gives.  The timeout is
+# backed off a couple of times, as it is for every retransmission the
+# receiver sees while lingering, each adding at most MAX_RTO, and there is a
+# margin for writing out what it received.
+WIRE_RTT = util.congestion.RttEstimator()
+WIRE_RTT.sample(2 * ARGS.delay + project.ACK_DELAY)
+for _ in range(2):
+    WIRE_RTT.back_off()
+RECEIVER_LINGER = project.linger_time(WIRE_RTT.rto) + 1.0
+# How long, in seconds, the wire and the receiver may take to start up.
+STARTUP_TIMEOUT = 10.0
+
+if ARGS.receive:
+    DEST_FILE_PATH = ARGS.receive
+else:
+    TEMP_HANDLE, TEMP_FILE_NAME = tempfile.mkstemp()
+    DEST_FILE_PATH = TEMP_FILE_NAME
+    os.close(TEMP_HANDLE)
+
+if ARGS.basis:
+    shutil.copyfile(ARGS.basis, DEST_FILE_PATH)
+
+INPUT_PATH = pathlib.Path(ARGS.file)
+INPUT_LEN, INPUT_HASH = util.utils.file_summary(INPUT_PATH)
+
+# Where the sender's and receiver's telemetry is written, if anywhere.
+METRICS_PATHS = {}
+if ARGS.metrics:
+    os.makedirs(ARGS.metrics, exist_ok=True)
+    for A_ROLE in ("sender", "receiver"):
+        METRICS_PATHS[A_ROLE] = os.path.join(ARGS.metrics, A_ROLE + ".jsonl")
+
+# What the wire reported doing with the packets, see
+# util.wire.WireStats.to_dict.
+WIRE_STATS = {}
+
+# When the first data arrived at the receiver and when the last was
+# delivered, as the receiver saw it, if it reports them.
+TIMES = {}
+
+# The length and digest of what the receiver wrote, worked out as it wrote
+# it, if it reports them.
+RECEIVED_SUMMARY = {}
+
+
+def run_in_process():
+    """Runs the wire, receiver and sender together on this process's event
+    loop, sparing the startup of three interpreters.
+    """
+    if ARGS.verbose:
+        for a_name in ("project-wire", "project-sender", "project-receiver"):
+            logging.getLogger(a_name).setLevel(logging.DEBUG)
+    capture = util.capture.CaptureRing() if ARGS.capture else None
+    transport, loop = util.wire.create_server(ARGS.port, ARGS.loss,
+                                              ARGS.delay, ARGS.buffer,
+                                              capture)
+    port = transport.get_extra_info('sockname')[1]
+    receiving_socket = util.wire.bad_socket(port)
+    sending_socket = util.wire.bad_socket(port)
+    metrics = {a_role: util.metrics.Metrics() for a_role in METRICS_PATHS}
+    try:
+        signatures = None
+        basis = None
+        if ARGS.basis:
+            basis = open(ARGS.basis, 'rb')
+            signatures = loop.run_until_complete(
+                exchange_signatures(port, basis))
+        with open(DEST_FILE_PATH, 'w+b') as output, \
+                open(ARGS.file, 'rb') as source:
+            loop.run_until_complete(asyncio.gather(
+                project.recv_async(receiving_socket, output, times=TIMES,
+                                   metrics=metrics.get("receiver"),
+                                   summary=RECEIVED_SUMMARY, basis=basis),
+                project.send_async(sending_socket, source,
+                                   metrics=metrics.get("sender"),
+                                   compression=ARGS.compress,
+                                   signatures=signatures)))
+    finally:
+        if basis is not None:
+            basis.close()
+        WIRE_STATS.update(
+            transport.get_protocol().stats.to_dict(loop.time()))
+        transport.close()
+        loop.close()
+    if capture is not None:
+        capture.dump(ARGS.capture)
+    for a_role, a_metrics in metrics.items():
+        a_metrics.write(METRICS_PATHS[a_role])
+
+
+async def exchange_signatures(port: int, basis) -> util.delta.Signatures:
+    """Has the receiver advertise the signatures of its basis to the
+    sender, over a flow of their own on the wire at the given port, as
+    receiver.py and sender.py do with --delta.
+    """
+    flow = util.delta.signature_flow(util.flows.DEFAULT_FLOW)
+    advertised = io.BytesIO()
+    await asyncio.gather(
+        project.send_async(util.wire.bad_socket(port, flow),
+                           util.delta.signatures(basis).pack()),
+        project.recv_async(util.wire.bad_socket(port, flow),
+                           advertised))
+    return util.delta.Signatures.unpack(advertised.getvalue())
 
-for AN_ARG in ("port", "loss", "delay", "buffer"):
-    SERVER_ARGS.append("--" + AN_ARG)
-    SERVER_ARGS.append(str(getattr(ARGS, AN_ARG)))
 
 SERVER_PROCESS = None
 RECEIVING_PROCESS = None
@@ -69,61 +204,160 @@ def on_end(signal, frame):
         except:
             pass
 
-for A_SIGNAL in (signal.SIGTERM, signal.SIGINT):
-    signal.signal(A_SIGNAL, on_end)
 
+def kill_launched():
+    """Kills the scripts started so far, and waits for them to exit, so
+    none is left running, or holding on to the wire's port.
+    """
+    global SERVER_PROCESS, RECEIVING_PROCESS
+    for a_process in (RECEIVING_PROCESS, SERVER_PROCESS):
+        if a_process is not None:
+            a_process.kill()
+            a_process.wait()
+    SERVER_PROCESS = RECEIVING_PROCESS = None
 
-SERVER_PROCESS = subprocess.Popen(SERVER_ARGS)
-LOGGER.info("Starting wire process: {}".format(SERVER_PROCESS.pid))
-time.sleep(1)
 
-if ARGS.receive:
-    DEST_FILE_PATH = ARGS.receive
-else:
-    TEMP_HANDLE, TEMP_FILE_NAME = tempfile.mkstemp()
-    DEST_FILE_PATH = TEMP_FILE_NAME
-    os.close(TEMP_HANDLE)
+def launch(args: list) -> tuple:
+    """Starts a script that reports on a status pipe, and waits for it to
+    say it's ready.
 
-RECEIVING_ARGS = [PYTHON_BINARY, "receiver.py",
-                  "--port", str(ARGS.port),
-                  "--file", DEST_FILE_PATH]
+    Return:
+        The process, the read end of its status pipe, and whatever else its
+        ready line reported.
 
-if ARGS.verbose:
-    RECEIVING_ARGS.append("-v")
+    Raises:
+        RuntimeError -- If the script didn't become ready in time.
+    """
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(args + ["--status-fd", str(write_fd)],
+                               pass_fds=(write_fd,))
+    os.close(write_fd)
+    status = os.fdopen(read_fd)
+    ready = util.utils.read_status(status, STARTUP_TIMEOUT)
+    if not ready or ready[0] != util.utils.STATUS_READY:
+        process.kill()
+        process.wait()
+        status.close()
+        raise RuntimeError("{} didn't start up".format(args[1]))
+    return process, status, ready[1:]
 
-RECEIVING_PROCESS = subprocess.Popen(RECEIVING_ARGS)
-LOGGER.info("Starting receiving process: {}".format(RECEIVING_PROCESS.pid))
-time.sleep(1)
 
-SENDER_ARGS = [PYTHON_BINARY, "sender.py",
-               "--port", str(ARGS.port),
-               "--file", ARGS.file]
+def run_processes():
+    """Runs the wire, receiver and sender as scripts of their own."""
+    global SERVER_PROCESS, RECEIVING_PROCESS
 
-if ARGS.verbose:
-    SENDER_ARGS.append("-v")
+    for a_signal in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(a_signal, on_end)
 
-INPUT_PATH = pathlib.Path(ARGS.file)
-INPUT_LEN, INPUT_HASH = util.utils.file_summary(INPUT_PATH)
-START_TIME = time.time()
+    server_args = [PYTHON_BINARY, "server.py"]
+    if ARGS.verbose:
+        server_args.append("-v")
+    for an_arg in ("port", "loss", "delay", "buffer"):
+        server_args.append("--" + an_arg)
+        server_args.append(str(getattr(ARGS, an_arg)))
+    if ARGS.capture:
+        server_args += ["--capture", ARGS.capture]
+    stats_handle, stats_path = tempfile.mkstemp(suffix=".json")
+    os.close(stats_handle)
+    server_args += ["--stats", stats_path]
 
-LOGGER.info("Starting sending process: {}".format(SERVER_PROCESS.pid))
-SENDING_RESULT = subprocess.run(SENDER_ARGS)
+    # The wire reports the port it bound, which is the only way to learn it
+    # when asked for any free one.
+    SERVER_PROCESS, server_status, (port,) = launch(server_args)
+    server_status.close()
+    LOGGER.info("Started wire process: {}".format(SERVER_PROCESS.pid))
 
-END_TIME = time.time()
+    receiving_args = [PYTHON_BINARY, "receiver.py",
+                      "--port", port,
+                      "--file", DEST_FILE_PATH]
+    if ARGS.verbose:
+        receiving_args.append("-v")
+    if ARGS.metrics:
+        receiving_args += ["--metrics", METRICS_PATHS["receiver"]]
+    if ARGS.basis:
+        receiving_args.append("--delta")
 
-# Sleep the delay time, to allow the buffer to drain.
-time.sleep(ARGS.delay)
-RECEIVING_PROCESS.terminate()
-RECEIVING_PROCESS = None
-SERVER_PROCESS.terminate()
-SERVER_PROCESS = None
+    try:
+        RECEIVING_PROCESS, receiving_status, _ = launch(receiving_args)
+    except BaseException:
+        kill_launched()
+        os.remove(stats_path)
+        raise
+    LOGGER.info("Started receiving process: {}".format(
+        RECEIVING_PROCESS.pid))
+
+    sender_args = [PYTHON_BINARY, "sender.py",
+                   "--port", port,
+                   "--file", ARGS.file]
+    if ARGS.verbose:
+        sender_args.append("-v")
+    if ARGS.metrics:
+        sender_args += ["--metrics", METRICS_PATHS["sender"]]
+    if ARGS.compress:
+        sender_args += ["--compress", ARGS.compress]
+    if ARGS.basis:
+        sender_args.append("--delta")
+
+    LOGGER.info("Starting sending process")
+    subprocess.run(sender_args)
+
+    # The receiver exits on its own once the sender has closed the
+    # connection, or once it has lingered long enough to be sure the sender
+    # is gone.  Only kill it if that takes implausibly long.
+    try:
+        RECEIVING_PROCESS.wait(timeout=ARGS.delay + RECEIVER_LINGER)
+    except subprocess.TimeoutExpired:
+        LOGGER.info("Receiving process didn't exit, terminating it")
+        RECEIVING_PROCESS.terminate()
+        RECEIVING_PROCESS.wait()
+    RECEIVING_PROCESS = None
+    # The receiver is gone, so whatever it reported is all in the pipe.
+    for a_line in receiving_status:
+        status = a_line.split()
+        if status and status[0] == util.utils.STATUS_TIMES:
+            for a_key, a_value in zip(("first", "last"), status[1:]):
+                TIMES[a_key] = None if a_value == "None" else float(a_value)
+        elif status and status[0] == util.utils.STATUS_DIGEST:
+            RECEIVED_SUMMARY["length"] = int(status[1])
+            RECEIVED_SUMMARY["sha256"] = status[2]
+    receiving_status.close()
+
+    SERVER_PROCESS.terminate()
+    # Give the wire the chance to write out its capture and statistics.
+    SERVER_PROCESS.wait()
+    SERVER_PROCESS = None
+    try:
+        with open(stats_path) as handle:
+            WIRE_STATS.update(json.load(handle))
+    except ValueError:
+        LOGGER.info("The wire didn't write its statistics")
+    os.remove(stats_path)
+
+
+START_TIME = time.monotonic()
+if ARGS.in_process:
+    run_in_process()
+else:
+    run_processes()
+END_TIME = time.monotonic()
 
 RECV_PATH = pathlib.Path(DEST_FILE_PATH)
-RECV_LEN, RECV_HASH = util.utils.file_summary(RECV_PATH)
+if RECEIVED_SUMMARY:
+    RECV_LEN = RECEIVED_SUMMARY["length"]
+    RECV_HASH = RECEIVED_SUMMARY["sha256"]
+else:
+    # Each run writes a new file, so there's no point caching its digest.
+    RECV_LEN, RECV_HASH = util.utils.file_summary(RECV_PATH, cache=False)
 
 IS_SUCCESS = RECV_HASH == INPUT_HASH
-NUM_SECONDS = END_TIME - START_TIME
-RATE = round(((RECV_LEN / NUM_SECONDS) / 1000), 2)
+# Time the transfer from the first data to the last, as the receiver saw
+# them, leaving out starting up and shutting down.  Fall back to the whole
+# run if the receiver never saw any.
+if TIMES.get("first") is not None and TIMES.get("last") is not None:
+    NUM_SECONDS = TIMES["last"] - TIMES["first"]
+else:
+    NUM_SECONDS = END_TIME - START_TIME
+RATE = round(((RECV_LEN / NUM_SECONDS) / 1000), 2) if NUM_SECONDS else 0
 TEMPLATE = "[{}] latency={}ms, packet loss={}%, buffer={}, throughput={} Kb/s"
 if ARGS.summary:
     SUMMARY = TEMPLATE.format(
@@ -133,6 +367,13 @@ if ARGS.summary:
         ARGS.buffer,
         RATE
     )
+    if ARGS.wire_stats and WIRE_STATS:
+        SUMMARY += (", wire drops: {} buffer full / {} loss, busy "
+                    "{:.0%}").format(
+            WIRE_STATS["dropped"][util.wire.DROP_BUFFER_FULL],
+            WIRE_STATS["dropped"][util.wire.DROP_LOSS],
+            WIRE_STATS["busy"] / WIRE_STATS["elapsed"]
+            if WIRE_STATS["elapsed"] else 0)
     print(SUMMARY)
 else:
     print("\n")
@@ -152,4 +393,9 @@ else:
     print("\nStats")
     print("---")
     print("Time: {} secs\nRate: {} kB/s".format(round(NUM_SECONDS, 2), RATE))
+
+    if ARGS.wire_stats and WIRE_STATS:
+        print("\nWire")
+        print("---")
+        print("\n".join(util.wire.summarize_stats(WIRE_STATS)))
 sys.exit(0 if IS_SUCCESS else 1)
@@ -0,0 +1,31 @@
+test = {
+  'name': 'Simulate a transfer over a wire with no delay',
+  'points': 0,
+  'suites': [
+    {
+      'cases': [
+        {
+          'code': r"""
+          >>> result = subprocess.run(
+          ...     [sys.executable, "simulate.py", "--file", "test_data.txt",
+          ...      "--delay", "0", "--summary"],
+          ...     capture_output=True, text=True, timeout=120)
+          >>> result.returncode
+          0
+          >>> "Traceback" in result.stderr
+          False
+          """,
+          'hidden': False,
+          'locked': False
+        }
+      ],
+      'scored': False,
+      'setup': r"""
+      >>> import subprocess
+      >>> import sys
+      """,
+      'teardown': '',
+      'type': 'doctest'
+    }
+  ]
+}
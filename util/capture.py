@@ -0,0 +1,148 @@
+"""
+A fixed size, in memory packet capture for the wire.
+
+Tracing every packet as a line of text costs enough to change the timing of
+the transfer being traced.  Instead, the wire can record each packet's fate
+into a CaptureRing: a preallocated ring of fixed size records holding the
+time, direction, length and verdict of the packet, and its first SNAPLEN
+bytes, which covers every header util.packet defines.  Recording a packet is
+a single struct.pack_into into the ring, and once the ring is full the
+oldest records are overwritten.
+
+`CaptureRing.dump` writes the ring out as a pcap file, with microsecond
+timestamps and the LINKTYPE_USER0 link type.  Each captured frame is a
+two byte prefix, the direction and verdict, followed by the start of the
+datagram, and the frame's original length is the datagram's.  `load` reads
+such a file back.
+"""
+
+import collections
+import struct
+import time
+import typing
+
+# Bytes of each datagram kept.
+SNAPLEN = 32
+# Records kept by default, the most recent ones winning.
+DEFAULT_RECORDS = 65536
+
+# Directions, relative to the wire.
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+# What the wire did with a packet.
+VERDICT_QUEUED = 0
+VERDICT_BUFFER_FULL = 1
+VERDICT_LOST = 2
+VERDICT_FORWARDED = 3
+VERDICT_CONNECT = 4
+
+VERDICT_NAMES = {
+    VERDICT_QUEUED: "queued",
+    VERDICT_BUFFER_FULL: "buffer-full",
+    VERDICT_LOST: "lost",
+    VERDICT_FORWARDED: "forwarded",
+    VERDICT_CONNECT: "connect",
+}
+
+# time, direction, verdict, length, captured length, captured bytes.
+_RECORD = struct.Struct("!dBBIH{}s".format(SNAPLEN))
+
+_PCAP_MAGIC = 0xa1b2c3d4
+_LINKTYPE_USER0 = 147
+# magic, version major, minor, timezone, sigfigs, snaplen, link type.
+_PCAP_HEADER = struct.Struct("<IHHiIII")
+# seconds, microseconds, captured length, original length.
+_PCAP_FRAME = struct.Struct("<IIII")
+_PREFIX = struct.Struct("!BB")
+
+Record = collections.namedtuple(
+    "Record", ["time", "direction", "verdict", "length", "data"])
+
+
+class CaptureRing:
+    """A ring of the most recent packet records.
+
+    Args:
+        size -- The number of records the ring holds.
+
+    Attributes:
+        recorded -- The number of records ever written, including those
+                    since overwritten.
+    """
+
+    def __init__(self, size: int = DEFAULT_RECORDS):
+        self._size = max(1, size)
+        self._ring = bytearray(self._size * _RECORD.size)
+        self.recorded = 0
+        # Records are stamped with the wall clock's offset from the
+        # monotonic one, so a dump lines up with other logs.
+        self._epoch = time.time() - time.monotonic()
+
+    def __len__(self) -> int:
+        return min(self.recorded, self._size)
+
+    def record(self, now: float, direction: int, verdict: int, data: bytes):
+        """Records a packet.
+
+        Args:
+            now -- When the packet was seen, on the time.monotonic() clock
+                   the event loop uses.
+            direction -- DIRECTION_IN or DIRECTION_OUT.
+            verdict -- One of the VERDICT_ constants.
+            data -- The datagram; only its first SNAPLEN bytes are kept.
+        """
+        offset = (self.recorded % self._size) * _RECORD.size
+        _RECORD.pack_into(self._ring, offset, now, direction, verdict,
+                          len(data), min(len(data), SNAPLEN), data)
+        self.recorded += 1
+
+    def records(self) -> typing.Iterator[Record]:
+        """Yields the records held, oldest first, with wall clock times."""
+        start = self.recorded - len(self)
+        for idx in range(start, self.recorded):
+            offset = (idx % self._size) * _RECORD.size
+            now, direction, verdict, length, captured, data = \
+                _RECORD.unpack_from(self._ring, offset)
+            yield Record(now + self._epoch, direction, verdict, length,
+                         data[:captured])
+
+    def dump(self, path: str) -> int:
+        """Writes the records held to a pcap file.
+
+        Return:
+            The number of records written.
+        """
+        count = 0
+        with open(path, "wb") as handle:
+            handle.write(_PCAP_HEADER.pack(_PCAP_MAGIC, 2, 4, 0, 0,
+                                           _PREFIX.size + SNAPLEN,
+                                           _LINKTYPE_USER0))
+            for record in self.records():
+                seconds = int(record.time)
+                micros = int((record.time - seconds) * 1000000)
+                handle.write(_PCAP_FRAME.pack(
+                    seconds, micros, _PREFIX.size + len(record.data),
+                    _PREFIX.size + record.length))
+                handle.write(_PREFIX.pack(record.direction, record.verdict))
+                handle.write(record.data)
+                count += 1
+        return count
+
+
+def load(path: str) -> typing.Iterator[Record]:
+    """Yields the records of a capture written by `CaptureRing.dump`."""
+    with open(path, "rb") as handle:
+        header = handle.read(_PCAP_HEADER.size)
+        if (len(header) < _PCAP_HEADER.size or
+                _PCAP_HEADER.unpack(header)[0] != _PCAP_MAGIC):
+            raise ValueError("{} is not a wire capture".format(path))
+        while True:
+            frame = handle.read(_PCAP_FRAME.size)
+            if len(frame) < _PCAP_FRAME.size:
+                return
+            seconds, micros, captured, length = _PCAP_FRAME.unpack(frame)
+            body = handle.read(captured)
+            direction, verdict = _PREFIX.unpack_from(body)
+            yield Record(seconds + micros / 1000000, direction, verdict,
+                         length - _PREFIX.size, body[_PREFIX.size:])
@@ -0,0 +1,261 @@
+"""
+Compression of a transfer's data, declared by the sender.
+
+The sender picks one of CODECS and compresses the input as a stream, so the
+compressed output is cut into full sized segments as it comes, without the
+input or its compressed form ever being held in memory whole.  Every data
+segment and repair symbol of a compressed transfer carries
+util.packet.FLAG_COMPRESSED, and the stream of segments begins with the
+codec's one byte ID, so the receiver, which can decode any of CODECS, knows
+from the SYN segment how to decompress the rest.  Nothing is negotiated:
+a receiver that can't decode the codec named fails the transfer.
+
+Compression is skipped when it wouldn't pay: the first SAMPLE_SIZE bytes of
+the input are compressed on their own first, and unless that shrinks them
+to at most SAMPLE_RATIO of their size, the input is sent as it is.
+
+A delta transfer is carried the same way, by DeltaCodec, which encodes the
+input against the signatures of the receiver's existing copy, see
+util.delta.  It can't be picked by name, as it needs those signatures, and
+a receiver can only decode it given that copy as its basis.
+"""
+
+import itertools
+import lzma
+import typing
+import zlib
+import util.delta
+import util.source
+
+# How much of the input is compressed to decide whether compressing pays,
+# and the most that sample may compress to, as a fraction of its size.
+SAMPLE_SIZE = 1 << 16
+SAMPLE_RATIO = 0.9
+
+
+class Codec:
+    """Interface every codec implements.
+
+    Attributes:
+        name -- The name the codec is chosen by.
+        ident -- The byte that identifies the codec in a transfer.
+    """
+
+    name: str = ""
+    ident: int = 0
+    # Whether decoding needs the receiver's existing copy of the data.
+    needs_basis = False
+
+    def compressor(self):
+        """Returns a fresh streaming compressor, with the `compress` and
+        `flush` methods of zlib's.
+        """
+        raise NotImplementedError()
+
+    def decompressor(self):
+        """Returns a fresh streaming decompressor, with a `decompress`
+        method returning all the output its input allows.
+        """
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+    """DEFLATE, fast and with modest ratios."""
+
+    name = "zlib"
+    ident = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class LzmaCodec(Codec):
+    """LZMA, slower, but with better ratios."""
+
+    name = "lzma"
+    ident = 2
+
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def compressor(self):
+        return lzma.LZMACompressor(preset=self.preset)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+class DeltaCodec(Codec):
+    """Only what differs from the receiver's existing copy, see util.delta.
+
+    Args:
+        signatures -- The signatures of the receiver's copy, to encode
+                      against.
+        basis -- The receiver's copy, to decode against.
+    """
+
+    name = "delta"
+    ident = 3
+    needs_basis = True
+
+    def __init__(self,
+                 signatures: typing.Optional[util.delta.Signatures] = None,
+                 basis: typing.Optional[typing.BinaryIO] = None):
+        self.signatures = signatures
+        self.basis = basis
+
+    def compressor(self):
+        return util.delta.DeltaEncoder(self.signatures)
+
+    def decompressor(self):
+        return util.delta.DeltaDecoder(self.basis)
+
+
+CODECS: typing.Dict[str, typing.Type[Codec]] = {
+    ZlibCodec.name: ZlibCodec,
+    LzmaCodec.name: LzmaCodec,
+}
+
+_BY_IDENT = {codec_cls.ident: codec_cls
+             for codec_cls in list(CODECS.values()) + [DeltaCodec]}
+
+
+def create(name: str) -> Codec:
+    """Builds the codec registered under the given name.
+
+    Args:
+        name -- One of the keys of CODECS.
+    """
+    try:
+        codec_cls = CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown codec {!r}, expected one of {}".format(
+            name, ", ".join(sorted(CODECS))))
+    return codec_cls()
+
+
+def from_ident(ident: int,
+               basis: typing.Optional[typing.BinaryIO] = None) -> Codec:
+    """Builds the codec a transfer's stream identifies itself as using.
+
+    Args:
+        ident -- The codec's ID.
+        basis -- The receiver's existing copy of the data, if it has one.
+
+    Raises:
+        ValueError -- If no codec has the ID, or the codec needs a basis
+                      and there is none.
+    """
+    try:
+        codec_cls = _BY_IDENT[ident]
+    except KeyError:
+        raise ValueError("Unknown codec ID {}".format(ident))
+    if not codec_cls.needs_basis:
+        return codec_cls()
+    if basis is None:
+        raise ValueError("The {} codec needs the receiver's existing "
+                         "copy".format(codec_cls.name))
+    return codec_cls(basis=basis)
+
+
+class CompressedSource(util.source.IteratorSource):
+    """Segments of an input compressed as a stream.  Input is only read and
+    compressed as new segments are needed.
+
+    Attributes:
+        input_length -- The number of bytes of input compressed so far.
+    """
+
+    compressed = True
+
+    def __init__(self, chunks: util.source.Chunks, codec: Codec,
+                 segment_size: int):
+        self.input_length = 0
+        super().__init__(self._compress(chunks, codec), segment_size)
+
+    def _compress(self, chunks: util.source.Chunks,
+                  codec: Codec) -> util.source.Chunks:
+        compressor = codec.compressor()
+        yield bytes([codec.ident])
+        for chunk in chunks:
+            self.input_length += len(chunk)
+            output = compressor.compress(chunk)
+            if output:
+                yield output
+        yield compressor.flush()
+
+
+def _chunks(source) -> util.source.Chunks:
+    try:
+        view = memoryview(source).cast("B")
+    except TypeError:
+        pass
+    else:
+        return (view[offset:offset + SAMPLE_SIZE]
+                for offset in range(0, len(view), SAMPLE_SIZE))
+    if hasattr(source, "read"):
+        return iter(lambda: source.read(SAMPLE_SIZE), b'')
+    return iter(source)
+
+
+def open_source(source, segment_size: int,
+                name: str) -> util.source.SegmentSource:
+    """Wraps what is to be sent in a source that compresses it, if a sample
+    of it compresses well enough, or else in the source util.source would
+    have picked.
+
+    Args:
+        source -- Anything util.source.open_source takes, but for an existing
+                  SegmentSource, which is used as it is.
+        segment_size -- The payload size of each segment.
+        name -- The codec to compress with, one of CODECS.
+    """
+    codec = create(name)
+    if isinstance(source, util.source.SegmentSource):
+        return source
+    position = None
+    if util.source.is_regular_file(source):
+        position = source.tell()
+    chunks = _chunks(source)
+    sample = bytearray()
+    for chunk in chunks:
+        sample += chunk
+        if len(sample) >= SAMPLE_SIZE:
+            break
+    compressor = codec.compressor()
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    if compressed <= SAMPLE_RATIO * len(sample):
+        return CompressedSource(itertools.chain([bytes(sample)], chunks),
+                                codec, segment_size)
+    if position is not None:
+        source.seek(position)
+        return util.source.open_source(source, segment_size)
+    try:
+        return util.source.open_source(memoryview(source), segment_size)
+    except TypeError:
+        return util.source.open_source(
+            itertools.chain([bytes(sample)], chunks), segment_size)
+
+
+def open_delta_source(source, segment_size: int,
+                      signatures: util.delta.Signatures
+                      ) -> util.source.SegmentSource:
+    """Wraps what is to be sent in a source that encodes it as a delta
+    against the receiver's existing copy.
+
+    Args:
+        source -- Anything util.source.open_source takes, but for an existing
+                  SegmentSource, which is used as it is.
+        segment_size -- The payload size of each segment.
+        signatures -- The signatures of the receiver's copy.
+    """
+    if isinstance(source, util.source.SegmentSource):
+        return source
+    return CompressedSource(_chunks(source), DeltaCodec(signatures),
+                            segment_size)
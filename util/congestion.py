@@ -0,0 +1,306 @@
+"""
+Round trip time estimation and pluggable congestion control for the
+transport in project.py.
+
+A sender owns one RttEstimator, and one CongestionControl instance chosen by
+name through `create`.  The sender reports acknowledged segments, loss events
+and retransmission timeouts to the controller, and reads back `cwnd`, the
+number of segments it may keep in flight.
+"""
+
+import collections
+import typing
+
+INITIAL_RTO = 1.0
+MIN_RTO = 0.05
+MAX_RTO = 1.0
+# Floor for the variance term, so a perfectly steady link doesn't produce a
+# timeout that scheduling jitter on either end can trip.
+CLOCK_GRANULARITY = 0.01
+
+INITIAL_CWND = 2.0
+MIN_CWND = 1.0
+
+
+class RttEstimator:
+    """EWMA round trip time estimator, following RFC 6298.
+
+    Callers are responsible for Karn's rule: a segment that was transmitted
+    more than once produces an ambiguous measurement, and must not be passed
+    to `sample` unless the measurement is known to belong to a specific
+    transmission.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt: typing.Optional[float] = None
+        self.rttvar: typing.Optional[float] = None
+        self.min_rtt: typing.Optional[float] = None
+        self.latest: typing.Optional[float] = None
+        self._base_rto = INITIAL_RTO
+        self._backoff = 1
+
+    def sample(self, rtt: float):
+        """Folds one unambiguous round trip measurement into the estimate."""
+        self.latest = rtt
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self._base_rto = self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+
+    @property
+    def rto(self) -> float:
+        """The current retransmission timeout, including any backoff."""
+        return min(MAX_RTO, max(MIN_RTO, self._base_rto) * self._backoff)
+
+    def back_off(self):
+        """Doubles the timeout after a retransmission timer fires."""
+        self._backoff = min(self._backoff * 2, 64)
+
+    def reset_backoff(self):
+        """Drops any backoff once the peer is known to be making progress."""
+        self._backoff = 1
+
+
+class CongestionControl:
+    """Interface every congestion controller implements.
+
+    Args:
+        rtt -- The estimator of the sender this controller is attached to.
+    """
+
+    name: str = ""
+
+    def __init__(self, rtt: RttEstimator):
+        self.rtt = rtt
+        self.cwnd = INITIAL_CWND
+
+    def on_ack(self, acked: int, inflight: int, now: float):
+        """Called when `acked` segments are newly acknowledged."""
+        raise NotImplementedError()
+
+    def on_loss(self, sent_at: float, inflight: int, now: float):
+        """Called for every segment presumed lost by SACK-based detection.
+
+        Args:
+            sent_at -- When the lost segment was transmitted, so controllers
+                       can react once per window rather than once per
+                       segment.
+        """
+        raise NotImplementedError()
+
+    def on_timeout(self, inflight: int, now: float):
+        """Called when a retransmission timer expires."""
+        raise NotImplementedError()
+
+
+class Reno(CongestionControl):
+    """Loss based AIMD: slow start, additive increase of one segment per
+    round trip, and a halving of the window once per window of losses.
+    """
+
+    name = "reno"
+
+    def __init__(self, rtt: RttEstimator):
+        super().__init__(rtt)
+        self.ssthresh = float("inf")
+        self._last_reduction = 0.0
+
+    def on_ack(self, acked: int, inflight: int, now: float):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+
+    def on_loss(self, sent_at: float, inflight: int, now: float):
+        if sent_at <= self._last_reduction:
+            return
+        self.ssthresh = max(self.cwnd / 2, INITIAL_CWND)
+        self.cwnd = self.ssthresh
+        self._last_reduction = now
+
+    def on_timeout(self, inflight: int, now: float):
+        self.ssthresh = max(self.cwnd / 2, INITIAL_CWND)
+        self.cwnd = MIN_CWND
+        self._last_reduction = now
+
+
+class Bbr(CongestionControl):
+    """Model based controller in the spirit of BBR.
+
+    Rather than reacting to individual losses, it measures the delivery rate
+    once per round trip, keeps the largest recent measurement as the
+    bottleneck bandwidth, and the smallest round trip time as the path delay.
+    The window is held near their product, periodically probing 25% above it
+    to find more capacity and 25% below it to drain anything queued, so
+    random loss doesn't collapse the window.
+
+    The wire's buffer is shared by data and ACKs, and overrunning it starves
+    the sender of ACKs as well as dropping data.  So, like BBRv2, the
+    controller also learns an upper bound on how much may be in flight: a
+    round that loses much more than usual, or a retransmission timeout, caps
+    the window below the level that caused it, and the cap is raised one
+    segment per clean round to follow a path that improves.
+    """
+
+    name = "bbr"
+
+    STARTUP_GAIN = 2.0
+    DRAIN_GAIN = 1 / 2.0
+    PROBE_GAINS = (1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    BW_WINDOW_ROUNDS = 10
+    MIN_BBR_CWND = 4.0
+    # Startup ends once this many rounds pass without the bandwidth estimate
+    # growing by at least STARTUP_GROWTH, or once the in flight cap is hit.
+    STARTUP_ROUNDS = 3
+    STARTUP_GROWTH = 1.25
+    # A round is taken as having overflowed the wire, rather than suffering
+    # random loss, when it loses at least OVERFLOW_MIN_LOST segments, and a
+    # fraction of what it sent above both OVERFLOW_LOSS and twice the long
+    # run loss rate.
+    OVERFLOW_LOSS = 0.2
+    OVERFLOW_MIN_LOST = 3
+    LOSS_RATE_GAIN = 1 / 8
+    # How far below the level that overflowed the in flight cap is set.
+    OVERFLOW_BETA = 0.85
+    TIMEOUT_BETA = 0.7
+
+    def __init__(self, rtt: RttEstimator):
+        super().__init__(rtt)
+        self.state = "startup"
+        self.btl_bw = 0.0
+        self.inflight_hi = float("inf")
+        self.loss_rate = 0.0
+        self._bw_samples = collections.deque()
+        self._round = 0
+        self._round_start: typing.Optional[float] = None
+        self._round_delivered = 0
+        self._round_lost = 0
+        self._round_max_inflight = 0
+        self._full_bw = 0.0
+        self._full_bw_rounds = 0
+        self._cycle = 0
+
+    def _bdp(self) -> float:
+        return self.btl_bw * (self.rtt.min_rtt or 0)
+
+    def _cap(self, limit: float):
+        self.inflight_hi = max(self.MIN_BBR_CWND, limit)
+        if self.state == "startup":
+            self.state = "drain"
+
+    def _end_round(self, now: float):
+        elapsed = now - self._round_start
+        sample = self._round_delivered / elapsed
+        self._round += 1
+        self._bw_samples.append((self._round, sample))
+        while self._bw_samples[0][0] <= self._round - self.BW_WINDOW_ROUNDS:
+            self._bw_samples.popleft()
+        self.btl_bw = max(bw for _, bw in self._bw_samples)
+
+        sent = self._round_delivered + self._round_lost
+        round_loss = self._round_lost / sent
+        if (self._round_lost >= self.OVERFLOW_MIN_LOST and
+                round_loss > max(self.OVERFLOW_LOSS, 2 * self.loss_rate)):
+            self._cap(self.OVERFLOW_BETA * self._round_max_inflight)
+        else:
+            # Overflowing rounds are left out, so the long run rate
+            # describes the link's own loss.
+            self.loss_rate += self.LOSS_RATE_GAIN * (round_loss -
+                                                     self.loss_rate)
+            if self._round_max_inflight + 1 >= self.inflight_hi:
+                self.inflight_hi += 1
+
+        if self.state == "startup":
+            if self.btl_bw >= self._full_bw * self.STARTUP_GROWTH:
+                self._full_bw = self.btl_bw
+                self._full_bw_rounds = 0
+            else:
+                self._full_bw_rounds += 1
+            if self._full_bw_rounds >= self.STARTUP_ROUNDS:
+                self.state = "drain"
+        elif self.state == "probe_bw":
+            self._cycle = (self._cycle + 1) % len(self.PROBE_GAINS)
+
+        self._round_start = now
+        self._round_delivered = 0
+        self._round_lost = 0
+        self._round_max_inflight = 0
+
+    def _gain(self) -> float:
+        if self.state == "startup":
+            return self.STARTUP_GAIN
+        if self.state == "drain":
+            return self.DRAIN_GAIN
+        return self.PROBE_GAINS[self._cycle]
+
+    def on_ack(self, acked: int, inflight: int, now: float):
+        if self._round_start is None:
+            self._round_start = now
+        self._round_delivered += acked
+        self._round_max_inflight = max(self._round_max_inflight,
+                                       inflight + acked)
+        # A round needs time to have passed to measure a rate over, which a
+        # path with no delay, in simulated time, may never let pass.
+        min_rtt = self.rtt.min_rtt
+        elapsed = now - self._round_start
+        if min_rtt is not None and elapsed >= min_rtt and elapsed > 0:
+            self._end_round(now)
+        if self.state == "drain" and inflight <= self._bdp():
+            self.state = "probe_bw"
+            self._cycle = 0
+
+        if self.state == "startup":
+            self.cwnd += acked
+        elif self.btl_bw:
+            self.cwnd = max(self.MIN_BBR_CWND, self._gain() * self._bdp())
+        self.cwnd = min(self.cwnd, self.inflight_hi)
+
+    def on_loss(self, sent_at: float, inflight: int, now: float):
+        self._round_lost += 1
+
+    def on_timeout(self, inflight: int, now: float):
+        # The expired segments have already left the flight size, so the
+        # window itself is only cut down to the new cap; shrinking it to the
+        # minimum would starve the rate samples and let the model decay.
+        self._round_lost += 1
+        if not self.btl_bw:
+            # Nothing has been measured yet, so the initial window being
+            # lost says nothing about the path.
+            return
+        self._cap(self.TIMEOUT_BETA * self.cwnd)
+        self.cwnd = min(self.cwnd, self.inflight_hi)
+
+
+CONTROLLERS: typing.Dict[str, typing.Type[CongestionControl]] = {
+    Reno.name: Reno,
+    Bbr.name: Bbr,
+}
+
+DEFAULT_CONTROLLER = Bbr.name
+
+
+def create(name: str, rtt: RttEstimator) -> CongestionControl:
+    """Builds the congestion controller registered under the given name.
+
+    Args:
+        name -- One of the keys of CONTROLLERS.
+        rtt -- The estimator of the sender the controller will drive.
+
+    Return:
+        A fresh controller instance.
+    """
+    try:
+        controller_cls = CONTROLLERS[name]
+    except KeyError:
+        raise ValueError("Unknown congestion controller {!r}, expected one "
+                         "of {}".format(name, ", ".join(sorted(CONTROLLERS))))
+    return controller_cls(rtt)
@@ -0,0 +1,381 @@
+"""
+Delta transfers: sending only what differs from a copy of the data the
+receiver already has, the way rsync does.
+
+The receiver splits its existing copy, the basis, into blocks of a fixed
+size, and advertises each block's signature: a weak checksum, Adler-32, that
+can be rolled along the sender's input a byte at a time, and a strong hash,
+BLAKE2b, that confirms a weak match.  The sender slides a block sized window
+over its input, and wherever the window's weak checksum and then its strong
+hash match a block of the basis, it emits an instruction to copy that block,
+and skips past it.  Whatever lies between matches is sent as literal data.
+A block a change touches costs its literal bytes, and every other block a
+few bytes of copy instruction, so the transfer is proportional to the
+differences rather than to the file.
+
+Signatures are computed a block at a time, each with one call into zlib and
+hashlib, reading the basis in chunks into one reused buffer.  The sender's
+window starts from the same zlib checksum at every block boundary and is
+only rolled byte by byte, in Python, through data that doesn't match.
+
+DeltaEncoder and DeltaDecoder have the interface of util.compression's
+streaming compressors, whose DeltaCodec carries a delta transfer.  The
+encoded stream is the block size, as BLOCK_SIZE, followed by instructions,
+each an opcode and its operands:
+
+    OP_COPY     COPY: copy this many blocks of the basis from this block on.
+    OP_LITERAL  LITERAL: this many bytes of literal data follow.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import typing
+import zlib
+
+OP_COPY = 0
+OP_LITERAL = 1
+
+# opcode, first block, number of blocks.
+COPY = struct.Struct("!BII")
+# opcode, length of the data that follows.
+LITERAL = struct.Struct("!BI")
+BLOCK_SIZE = struct.Struct("!I")
+# The advertised signatures: the basis' length and block size, then every
+# block's weak checksum and strong hash.
+SIGNATURE_HEADER = struct.Struct("!QI")
+STRONG_SIZE = 16
+BLOCK_SIGNATURE = struct.Struct("!I{}s".format(STRONG_SIZE))
+
+# Blocks are about the square root of the basis' size, which balances the
+# size of the signatures against the literal data each change costs, within
+# these bounds.
+MIN_BLOCK_SIZE = 512
+MAX_BLOCK_SIZE = 1 << 17
+# The most a single instruction copies, and the longest literal sent as one
+# instruction, so decoding one segment never produces more than a few MiB,
+# and the encoder never holds more than this much unmatched input.
+COPY_LIMIT = 1 << 16
+LITERAL_LIMIT = 1 << 16
+# How much of the basis is read at a time to compute its signatures.
+READ_CHUNK = 1 << 20
+
+# Adler-32's modulus.
+_MOD = 65521
+
+# The suffix of the flow the signatures are sent over, see
+# `signature_flow`.
+_SIGNATURE_FLOW = b'/signatures'
+
+
+def block_size(length: int) -> int:
+    """Returns the block size to sign a basis of the given length with."""
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, math.isqrt(length)))
+
+
+def strong_hash(block) -> bytes:
+    """Returns the strong hash of a block."""
+    return hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+
+
+def signature_flow(flow: bytes) -> bytes:
+    """Returns the ID of the flow a delta transfer's signatures are sent
+    over, ahead of the transfer itself over the given flow.  Keeping them
+    apart means no stray packet of one can be taken for part of the other.
+    """
+    return flow + _SIGNATURE_FLOW
+
+
+class Signatures:
+    """The signatures of every block of a basis.
+
+    Args:
+        length -- The length of the basis.
+        block_size -- The size of every block but the last, which may be
+                      shorter.
+        weak -- Every block's Adler-32.
+        strong -- Every block's strong hash.
+    """
+
+    def __init__(self, length: int, block_size: int,
+                 weak: typing.List[int], strong: typing.List[bytes]):
+        self.length = length
+        self.block_size = block_size
+        self.weak = weak
+        self.strong = strong
+
+    def __len__(self) -> int:
+        return len(self.weak)
+
+    def pack(self) -> bytes:
+        """Returns the signatures encoded to be sent."""
+        packed = bytearray(SIGNATURE_HEADER.size +
+                           len(self) * BLOCK_SIGNATURE.size)
+        SIGNATURE_HEADER.pack_into(packed, 0, self.length, self.block_size)
+        offset = SIGNATURE_HEADER.size
+        for weak, strong in zip(self.weak, self.strong):
+            BLOCK_SIGNATURE.pack_into(packed, offset, weak, strong)
+            offset += BLOCK_SIGNATURE.size
+        return bytes(packed)
+
+    @classmethod
+    def unpack(cls, data) -> "Signatures":
+        """Decodes signatures encoded by `pack`.
+
+        Raises:
+            ValueError -- If the data isn't a whole set of signatures.
+        """
+        if len(data) < SIGNATURE_HEADER.size:
+            raise ValueError("Signatures of {} bytes".format(len(data)))
+        length, size = SIGNATURE_HEADER.unpack_from(data)
+        num_blocks = -(-length // size) if size else 0
+        if (not size or len(data) != SIGNATURE_HEADER.size +
+                num_blocks * BLOCK_SIGNATURE.size):
+            raise ValueError("Signatures don't match a basis of {} bytes in "
+                             "blocks of {}".format(length, size))
+        weak = []
+        strong = []
+        for block_weak, block_strong in BLOCK_SIGNATURE.iter_unpack(
+                memoryview(data)[SIGNATURE_HEADER.size:]):
+            weak.append(block_weak)
+            strong.append(block_strong)
+        return cls(length, size, weak, strong)
+
+
+def signatures(basis: typing.Optional[typing.BinaryIO]) -> Signatures:
+    """Computes the signatures of a basis, from its start.
+
+    Args:
+        basis -- A binary file open for reading, or None for no basis, which
+                 has no blocks.
+    """
+    if basis is None:
+        return Signatures(0, MIN_BLOCK_SIZE, [], [])
+    length = os.fstat(basis.fileno()).st_size
+    size = block_size(length)
+    weak = []
+    strong = []
+    buffer = bytearray(max(1, READ_CHUNK // size) * size)
+    view = memoryview(buffer)
+    basis.seek(0)
+    offset = 0
+    while True:
+        filled = basis.readinto(buffer)
+        if not filled:
+            break
+        for start in range(0, filled, size):
+            block = view[start:min(filled, start + size)]
+            weak.append(zlib.adler32(block))
+            strong.append(strong_hash(block))
+        offset += filled
+    return Signatures(offset, size, weak, strong)
+
+
+class DeltaEncoder:
+    """Encodes an input, fed a chunk at a time, as the instructions that
+    rebuild it from a basis the given signatures describe.  Has the
+    `compress` and `flush` methods of zlib's compressors.
+
+    Unmatched input waits in `_buffer` from `_literal`, and the window being
+    checked starts at `_pos`.  `_sums` holds the two halves of the window's
+    Adler-32 while it is being rolled, and is None when the window should
+    start afresh.  A run of consecutive blocks is held back in `_copy`, as
+    its first block and count, so it goes out as one instruction.
+    """
+
+    def __init__(self, signatures: Signatures):
+        self._block_size = signatures.block_size
+        self._blocks: typing.Dict[int, typing.Dict[bytes, int]] = {}
+        # A short last block can only match the end of the input.
+        num_full = signatures.length // signatures.block_size
+        for index in range(num_full):
+            self._blocks.setdefault(signatures.weak[index], {}).setdefault(
+                signatures.strong[index], index)
+        self._tail = None
+        if num_full < len(signatures):
+            self._tail = (num_full, signatures.length % signatures.block_size,
+                          signatures.strong[num_full])
+        self._max_copy = max(1, COPY_LIMIT // self._block_size)
+        self._buffer = bytearray()
+        self._literal = 0
+        self._pos = 0
+        self._sums: typing.Optional[typing.Tuple[int, int]] = None
+        self._copy: typing.Optional[typing.List[int]] = None
+        self._started = False
+        self.copied = 0
+        self.literal_bytes = 0
+
+    def _emit_copy(self, out: bytearray):
+        if self._copy is not None:
+            first, count = self._copy
+            out += COPY.pack(OP_COPY, first, count)
+            self._copy = None
+
+    def _add_copy(self, out: bytearray, index: int):
+        self.copied += 1
+        copy = self._copy
+        if (copy is not None and copy[0] + copy[1] == index and
+                copy[1] < self._max_copy):
+            copy[1] += 1
+            return
+        self._emit_copy(out)
+        self._copy = [index, 1]
+
+    def _emit_literal(self, out: bytearray, end: int):
+        if end <= self._literal:
+            return
+        self._emit_copy(out)
+        out += LITERAL.pack(OP_LITERAL, end - self._literal)
+        out += self._buffer[self._literal:end]
+        self.literal_bytes += end - self._literal
+        self._literal = end
+
+    def _match(self, weak: int, pos: int) -> typing.Optional[int]:
+        candidates = self._blocks.get(weak)
+        if candidates is None:
+            return None
+        window = memoryview(self._buffer)[pos:pos + self._block_size]
+        try:
+            return candidates.get(strong_hash(window))
+        finally:
+            window.release()
+
+    def _scan(self, out: bytearray):
+        buffer = self._buffer
+        size = self._block_size
+        blocks = self._blocks
+        limit = len(buffer) - size
+        pos = self._pos
+        while pos <= limit:
+            if self._sums is None:
+                weak = zlib.adler32(memoryview(buffer)[pos:pos + size])
+                index = self._match(weak, pos)
+                if index is None:
+                    self._sums = weak & 0xFFFF, weak >> 16
+                else:
+                    self._emit_literal(out, pos)
+                    self._add_copy(out, index)
+                    pos += size
+                    self._literal = pos
+                    continue
+            low, high = self._sums
+            stop = min(limit, self._literal + LITERAL_LIMIT)
+            index = None
+            # The window's Adler-32, rolled one byte along at a time.
+            while pos < stop:
+                dropped = buffer[pos]
+                low = (low - dropped + buffer[pos + size]) % _MOD
+                high = (high - size * dropped + low - 1) % _MOD
+                pos += 1
+                weak = high << 16 | low
+                if weak in blocks:
+                    index = self._match(weak, pos)
+                    if index is not None:
+                        break
+            if index is not None:
+                self._emit_literal(out, pos)
+                self._add_copy(out, index)
+                pos += size
+                self._literal = pos
+                self._sums = None
+                continue
+            self._sums = low, high
+            if pos - self._literal >= LITERAL_LIMIT:
+                self._emit_literal(out, pos)
+            if pos >= limit:
+                break
+        self._pos = pos
+
+    def _start(self, out: bytearray):
+        if not self._started:
+            self._started = True
+            out += BLOCK_SIZE.pack(self._block_size)
+
+    def compress(self, data) -> bytes:
+        """Feeds more input, returning whatever instructions it completes."""
+        out = bytearray()
+        self._start(out)
+        self._buffer += data
+        self._scan(out)
+        # Only the unmatched input and the window need be kept.
+        del self._buffer[:self._literal]
+        self._pos -= self._literal
+        self._literal = 0
+        return bytes(out)
+
+    def flush(self) -> bytes:
+        """Ends the input, returning the remaining instructions."""
+        out = bytearray()
+        self._start(out)
+        end = len(self._buffer)
+        if self._tail is not None:
+            index, length, strong = self._tail
+            if (end - self._literal >= length and
+                    strong_hash(self._buffer[end - length:]) == strong):
+                self._emit_literal(out, end - length)
+                self._add_copy(out, index)
+                self._literal = end
+        self._emit_literal(out, end)
+        self._emit_copy(out)
+        self._buffer = bytearray()
+        self._literal = self._pos = 0
+        return bytes(out)
+
+
+class DeltaDecoder:
+    """Rebuilds data from a DeltaEncoder's instructions, reading the blocks
+    they copy from the basis.  Has the `decompress` method of zlib's
+    decompressors.
+
+    Args:
+        basis -- A binary file open for reading, holding the data the
+                 signatures the encoder was given describe.
+    """
+
+    def __init__(self, basis: typing.BinaryIO):
+        self._fd = basis.fileno()
+        self._pending = bytearray()
+        self._block_size: typing.Optional[int] = None
+        self._literal_left = 0
+
+    def decompress(self, data) -> bytes:
+        """Decodes more of the stream, returning all the data it allows.
+
+        Raises:
+            ValueError -- If the stream holds an unknown instruction.
+        """
+        pending = self._pending
+        pending += data
+        out = bytearray()
+        offset = 0
+        if self._block_size is None:
+            if len(pending) < BLOCK_SIZE.size:
+                return b''
+            self._block_size, = BLOCK_SIZE.unpack_from(pending)
+            offset = BLOCK_SIZE.size
+        size = self._block_size
+        while offset < len(pending):
+            if self._literal_left:
+                end = min(len(pending), offset + self._literal_left)
+                out += pending[offset:end]
+                self._literal_left -= end - offset
+                offset = end
+                continue
+            opcode = pending[offset]
+            if opcode == OP_LITERAL:
+                if len(pending) - offset < LITERAL.size:
+                    break
+                _, self._literal_left = LITERAL.unpack_from(pending, offset)
+                offset += LITERAL.size
+            elif opcode == OP_COPY:
+                if len(pending) - offset < COPY.size:
+                    break
+                _, first, count = COPY.unpack_from(pending, offset)
+                offset += COPY.size
+                out += os.pread(self._fd, count * size, first * size)
+            else:
+                raise ValueError("Unknown delta instruction {}".format(
+                    opcode))
+        del pending[:offset]
+        return bytes(out)
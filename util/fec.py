@@ -0,0 +1,200 @@
+"""
+Forward error correction for the transport: a systematic random linear
+fountain code over GF(2).
+
+Source segments are grouped into blocks of consecutive sequence numbers.
+Besides the segments themselves, the sender emits repair symbols, each the
+XOR of a pseudo-random subset of the block's segments; the subset is derived
+from the block and repair index alone, so it never has to be sent.  Repair
+index 0 is plain XOR parity over the whole block.  The receiver recovers
+every missing segment of a block once it holds any set of segments and
+repair symbols of full rank, which for a random code is rarely more than a
+symbol or two beyond the number that were lost.  Symbols are Python ints, so
+XOR over a whole symbol is a single operation.
+"""
+
+import math
+import random
+import typing
+
+# The default number of source segments per block, and the most a block may
+# hold (the count is sent in a byte).
+BLOCK_SIZE = 16
+MAX_BLOCK_SIZE = 255
+
+# Each symbol carries its payload's length in front of it, so segments
+# shorter than a full symbol (the last of a transfer) come back exactly.
+LENGTH_BYTES = 2
+
+# Bounds on the loss rate repair counts are planned for.
+MIN_LOSS = 0.02
+MAX_LOSS = 0.8
+# Standard deviations of margin planned above the mean number of losses.
+LOSS_MARGIN = 1.0
+# Symbols beyond the number lost that a random GF(2) code typically needs.
+RANK_OVERHEAD = 1
+
+
+def to_symbol(payload, symbol_size: int) -> int:
+    """Encodes a payload of at most symbol_size - LENGTH_BYTES bytes as a
+    symbol.
+    """
+    payload_bits = 8 * (symbol_size - LENGTH_BYTES)
+    return ((len(payload) << payload_bits) |
+            (int.from_bytes(payload, "big") <<
+             8 * (symbol_size - LENGTH_BYTES - len(payload))))
+
+
+def from_symbol(symbol: int, symbol_size: int) -> bytes:
+    """Decodes a symbol built by to_symbol back into its payload."""
+    raw = symbol.to_bytes(symbol_size, "big")
+    length = int.from_bytes(raw[:LENGTH_BYTES], "big")
+    return raw[LENGTH_BYTES:LENGTH_BYTES + length]
+
+
+def coefficients(first: int, count: int, index: int) -> int:
+    """Returns the bitmask of block positions XORed into a repair symbol.
+
+    Args:
+        first -- The sequence number of the block's first segment.
+        count -- The number of segments in the block.
+        index -- The repair symbol's index within the block.
+    """
+    if index == 0:
+        return (1 << count) - 1
+    mask = random.Random((first << 16) | index).getrandbits(count)
+    return mask or 1 << (index % count)
+
+
+def repair_count(count: int, loss: float) -> int:
+    """Returns how many repair symbols to send proactively for a block, so
+    that it is likely to be recovered without any retransmission.
+
+    Args:
+        count -- The number of segments in the block.
+        loss -- The estimated fraction of packets the link drops.
+    """
+    loss = min(MAX_LOSS, max(MIN_LOSS, loss))
+    expected = count * loss / (1 - loss)
+    margin = LOSS_MARGIN * math.sqrt(count * loss) / (1 - loss)
+    return math.ceil(expected + margin) + RANK_OVERHEAD
+
+
+class RepairEncoder:
+    """Accumulates the segments of the block being sent, and produces its
+    repair symbols once the block is complete.
+
+    Args:
+        symbol_size -- The size, in bytes, of every symbol.
+    """
+
+    def __init__(self, symbol_size: int):
+        self.symbol_size = symbol_size
+        self._first: typing.Optional[int] = None
+        self._symbols: typing.List[int] = []
+
+    def add(self, seq: int, payload):
+        """Adds the next segment, in sequence order, to the current block."""
+        if self._first is None:
+            self._first = seq
+        self._symbols.append(to_symbol(payload, self.symbol_size))
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def finish(self, num_repairs: int
+               ) -> typing.Tuple[int, int, typing.List[bytes]]:
+        """Closes the current block.
+
+        Return:
+            The block's first sequence number, its segment count, and
+            num_repairs repair symbols, in repair index order.
+        """
+        first, symbols = self._first, self._symbols
+        self._first, self._symbols = None, []
+        repairs = []
+        for index in range(num_repairs):
+            mask = coefficients(first, len(symbols), index)
+            value = 0
+            for position, symbol in enumerate(symbols):
+                if mask >> position & 1:
+                    value ^= symbol
+            repairs.append(value.to_bytes(self.symbol_size, "big"))
+        return first, len(symbols), repairs
+
+
+class BlockDecoder:
+    """Incremental Gaussian elimination over one block.
+
+    Rows are kept in reduced form, keyed by their pivot position, so any
+    row whose mask has a single bit set is a solved segment.
+
+    Args:
+        first -- The sequence number of the block's first segment.
+        count -- The number of segments in the block.
+        symbol_size -- The size, in bytes, of every symbol.
+    """
+
+    def __init__(self, first: int, count: int, symbol_size: int):
+        self.first = first
+        self.count = count
+        self.symbol_size = symbol_size
+        self._rows: typing.Dict[int, typing.Tuple[int, int]] = {}
+        self._known: typing.Set[int] = set()
+
+    @property
+    def complete(self) -> bool:
+        """Whether every segment of the block is known."""
+        return len(self._known) == self.count
+
+    def _insert(self, mask: int, value: int) -> typing.List[int]:
+        for pivot, (row_mask, row_value) in self._rows.items():
+            if mask >> pivot & 1:
+                mask ^= row_mask
+                value ^= row_value
+        if not mask:
+            return []
+        pivot = (mask & -mask).bit_length() - 1
+        for other, (row_mask, row_value) in list(self._rows.items()):
+            if row_mask >> pivot & 1:
+                self._rows[other] = row_mask ^ mask, row_value ^ value
+        self._rows[pivot] = mask, value
+        solved = []
+        for position, (row_mask, _) in self._rows.items():
+            if position not in self._known and row_mask == 1 << position:
+                self._known.add(position)
+                solved.append(position)
+        return solved
+
+    def _recovered(self, positions: typing.List[int]
+                   ) -> typing.List[typing.Tuple[int, bytes]]:
+        return [(self.first + position,
+                 from_symbol(self._rows[position][1], self.symbol_size))
+                for position in positions]
+
+    def add_source(self, seq: int, symbol: int
+                   ) -> typing.List[typing.Tuple[int, bytes]]:
+        """Adds a received segment, as a symbol.
+
+        Return:
+            (sequence number, payload) of every other segment this recovers.
+        """
+        position = seq - self.first
+        if position in self._known:
+            return []
+        self._known.add(position)
+        solved = self._insert(1 << position, symbol)
+        return self._recovered([pos for pos in solved if pos != position])
+
+    def add_repair(self, index: int, data: bytes
+                   ) -> typing.List[typing.Tuple[int, bytes]]:
+        """Adds a received repair symbol.
+
+        Return:
+            (sequence number, payload) of every segment this recovers.
+        """
+        if self.complete:
+            return []
+        mask = coefficients(self.first, self.count, index)
+        return self._recovered(self._insert(mask, int.from_bytes(data,
+                                                                 "big")))
@@ -0,0 +1,252 @@
+"""
+Flows sharing the wire, the queues that hold their packets at the
+bottleneck, and per flow accounting.
+
+A flow is the set of peers that connected to the wire with the same flow
+ID: the wire only forwards a packet to the other peers of its sender's flow,
+so any number of sender / receiver pairs can share one wire.  Peers that
+connect without an ID all belong to DEFAULT_FLOW, so a single pair works as
+it always has.
+
+Packets accepted onto the wire wait in a queue for the link to transmit
+them.  Which packet goes next is up to the queue's discipline, one of
+QUEUES:
+
+    fifo    One queue, and one buffer limit, shared by every flow, served
+            in arrival order.
+    drr     A queue, and a buffer limit, per flow, served by deficit round
+            robin: flows take turns sending up to a quantum of bytes each,
+            so every backlogged flow gets an equal share of the link
+            whatever its packet sizes or sending rate.
+
+Without a bandwidth limit the link transmits packets as soon as they
+arrive, and the discipline only decides how the buffer is shared.
+"""
+
+import collections
+import typing
+import util
+
+DEFAULT_FLOW = b''
+CONNECT = b'connect'
+
+
+def connect_message(flow: bytes = DEFAULT_FLOW) -> bytes:
+    """Returns the datagram a peer sends to join a flow."""
+    if flow:
+        return CONNECT + b' ' + flow
+    return CONNECT
+
+
+def parse_connect(data: bytes) -> typing.Optional[bytes]:
+    """Returns the flow ID of a connect datagram, or None if the datagram
+    isn't one.
+    """
+    if data == CONNECT:
+        return DEFAULT_FLOW
+    if data.startswith(CONNECT + b' '):
+        return data[len(CONNECT) + 1:]
+    return None
+
+
+class PacketQueue:
+    """Interface every queue discipline implements.
+
+    Attributes:
+        shared_buffer -- Whether flows share one buffer limit, rather than
+                         having one each.
+    """
+
+    name: str = ""
+    shared_buffer = True
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def enqueue(self, flow: bytes, ticket: int, size: int):
+        """Adds a packet to the back of its flow's queue."""
+        raise NotImplementedError()
+
+    def dequeue(self) -> typing.Tuple[bytes, int, int]:
+        """Removes the packet to transmit next, when the queue isn't empty.
+
+        Return:
+            The packet's flow, ticket and size.
+        """
+        raise NotImplementedError()
+
+
+class FifoQueue(PacketQueue):
+    """A single queue in arrival order, with one limit for every flow."""
+
+    name = "fifo"
+
+    def __init__(self):
+        self._queue = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, flow: bytes, ticket: int, size: int):
+        self._queue.append((flow, ticket, size))
+
+    def dequeue(self) -> typing.Tuple[bytes, int, int]:
+        return self._queue.popleft()
+
+
+class DrrQueue(PacketQueue):
+    """Per flow queues, served by deficit round robin.
+
+    Args:
+        quantum -- The bytes a flow may send per turn.
+    """
+
+    name = "drr"
+    shared_buffer = False
+
+    def __init__(self, quantum: int = util.MAX_PACKET):
+        self.quantum = quantum
+        self._queues: typing.Dict[bytes, collections.deque] = {}
+        self._deficits: typing.Dict[bytes, int] = {}
+        # Flows with packets queued, the one whose turn it is first.
+        self._active = collections.deque()
+        self._credited = False
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def enqueue(self, flow: bytes, ticket: int, size: int):
+        queue = self._queues.get(flow)
+        if queue is None:
+            queue = self._queues[flow] = collections.deque()
+        if not queue:
+            self._active.append(flow)
+            self._deficits[flow] = 0
+        queue.append((ticket, size))
+        self._length += 1
+
+    def dequeue(self) -> typing.Tuple[bytes, int, int]:
+        while True:
+            flow = self._active[0]
+            queue = self._queues[flow]
+            ticket, size = queue[0]
+            if self._deficits[flow] >= size:
+                queue.popleft()
+                self._length -= 1
+                self._deficits[flow] -= size
+                if not queue:
+                    # An idle flow doesn't bank credit for later.
+                    self._active.popleft()
+                    self._credited = False
+                return flow, ticket, size
+            if not self._credited:
+                self._deficits[flow] += self.quantum
+                self._credited = True
+            else:
+                self._active.rotate(-1)
+                self._credited = False
+
+
+QUEUES: typing.Dict[str, typing.Type[PacketQueue]] = {
+    FifoQueue.name: FifoQueue,
+    DrrQueue.name: DrrQueue,
+}
+
+DEFAULT_QUEUE = FifoQueue.name
+
+
+def create_queue(name: str) -> PacketQueue:
+    """Builds the queue registered under the given name.
+
+    Args:
+        name -- One of the keys of QUEUES.
+    """
+    try:
+        queue_cls = QUEUES[name]
+    except KeyError:
+        raise ValueError("Unknown queue discipline {!r}, expected one of "
+                         "{}".format(name, ", ".join(sorted(QUEUES))))
+    return queue_cls()
+
+
+class FlowStats:
+    """What the wire did with one flow's packets.
+
+    Attributes:
+        packets -- Packets forwarded.
+        bytes -- Bytes forwarded.
+        dropped_full -- Packets dropped because the buffer was full.
+        dropped_lost -- Packets dropped to simulate loss.
+        first -- When the flow's first packet was forwarded, if it has been.
+        last -- When the flow's latest packet was forwarded.
+    """
+
+    __slots__ = ("packets", "bytes", "dropped_full", "dropped_lost",
+                 "first", "last")
+
+    def __init__(self):
+        self.packets = self.bytes = 0
+        self.dropped_full = self.dropped_lost = 0
+        self.first: typing.Optional[float] = None
+        self.last = 0.0
+
+    def forwarded(self, now: float, size: int):
+        """Counts a packet the wire forwarded."""
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.packets += 1
+        self.bytes += size
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second forwarded while the flow was active."""
+        if self.first is None or self.last <= self.first:
+            return 0.0
+        return self.bytes / (self.last - self.first)
+
+
+def jain_index(values: typing.Sequence[float]) -> float:
+    """Returns Jain's fairness index of a set of allocations: 1 when they
+    are all equal, down to 1 / n when one flow gets everything.
+    """
+    total = sum(values)
+    squares = sum(value * value for value in values)
+    if not squares:
+        return 1.0
+    return total * total / (len(values) * squares)
+
+
+def to_dict(stats: typing.Dict[bytes, FlowStats]) -> dict:
+    """Returns each flow's statistics, and how fairly the wire was shared,
+    as plain data, to be written as JSON.
+    """
+    return {
+        "flows": {flow.decode(errors="replace"): {
+            "packets": flow_stats.packets, "bytes": flow_stats.bytes,
+            "throughput": flow_stats.throughput,
+            "dropped_full": flow_stats.dropped_full,
+            "dropped_lost": flow_stats.dropped_lost}
+                  for flow, flow_stats in sorted(stats.items())},
+        "fairness": jain_index([flow_stats.throughput
+                                for flow_stats in stats.values()]),
+    }
+
+
+def summarize(stats: typing.Dict[bytes, FlowStats]) -> typing.List[str]:
+    """Returns lines describing each flow's share of the wire, and how
+    fairly it was shared.
+    """
+    lines = []
+    for flow in sorted(stats):
+        flow_stats = stats[flow]
+        lines.append(
+            "flow {!r}: {} packets, {} bytes, {:.2f} kB/s, {} dropped "
+            "(buffer full), {} dropped (loss)".format(
+                flow.decode(errors="replace"), flow_stats.packets,
+                flow_stats.bytes, flow_stats.throughput / 1000,
+                flow_stats.dropped_full, flow_stats.dropped_lost))
+    lines.append("Jain's fairness index: {:.3f}".format(
+        jain_index([flow_stats.throughput for flow_stats in stats.values()])))
+    return lines
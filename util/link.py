@@ -0,0 +1,291 @@
+"""
+Models of the impairments the wire in util.wire applies to packets.
+
+A Link decides, for each packet the wire accepts, whether it is lost, how
+many copies of it arrive, and when each copy is delivered.  Delivery time is
+the sum of three parts:
+
+    shaping      A token bucket limiting the link to `rate` bytes per
+                 second, with bursts of up to `burst` bytes, so packets
+                 queue behind each other once the link is saturated.
+    delay        The constant propagation delay.
+    jitter       A random extra delay drawn from one of JITTERS.  Each copy
+                 draws its own, so packets may overtake each other, unless
+                 reordering is disabled, in which case a packet is never
+                 delivered before the one accepted ahead of it.
+
+Losses are drawn from a LossModel: independent (Bernoulli) loss, or the
+Gilbert-Elliott two state model, which loses packets in bursts.  Every
+random choice comes from a single random.Random, so seeding it makes a run
+of the wire repeatable.
+"""
+
+import argparse
+import math
+import random
+import typing
+import util
+
+# Shape of the Pareto jitter distribution; lower is heavier tailed.
+PARETO_SHAPE = 2.5
+
+
+class LossModel:
+    """Interface every loss model implements."""
+
+    name: str = ""
+
+    def lost(self, rng: random.Random) -> bool:
+        """Returns whether the next packet is lost."""
+        raise NotImplementedError()
+
+
+class BernoulliLoss(LossModel):
+    """Loses every packet independently with the same probability.
+
+    Args:
+        rate -- The fraction of packets lost.
+    """
+
+    name = "bernoulli"
+
+    def __init__(self, rate: float = 0.0):
+        self.rate = rate
+
+    def lost(self, rng: random.Random) -> bool:
+        return self.rate > 0 and rng.random() < self.rate
+
+
+class GilbertElliottLoss(LossModel):
+    """Two state Markov loss.  The link moves from its good state to its bad
+    state with probability p before each packet, and back with probability
+    r, and loses packets at a different rate in each, so losses cluster in
+    bursts of 1 / r packets on average.
+
+    Args:
+        p -- Probability of moving from the good to the bad state.
+        r -- Probability of moving from the bad to the good state.
+        good_loss -- The fraction of packets lost in the good state.
+        bad_loss -- The fraction of packets lost in the bad state.
+    """
+
+    name = "gilbert-elliott"
+
+    def __init__(self, p: float, r: float, good_loss: float = 0.0,
+                 bad_loss: float = 1.0):
+        self.p = p
+        self.r = r
+        self.good_loss = good_loss
+        self.bad_loss = bad_loss
+        self.bad = False
+
+    @property
+    def mean_loss(self) -> float:
+        """The long run fraction of packets lost."""
+        if not self.p + self.r:
+            return self.good_loss
+        bad_share = self.p / (self.p + self.r)
+        return (1 - bad_share) * self.good_loss + bad_share * self.bad_loss
+
+    def lost(self, rng: random.Random) -> bool:
+        if rng.random() < (self.r if self.bad else self.p):
+            self.bad = not self.bad
+        rate = self.bad_loss if self.bad else self.good_loss
+        return rate > 0 and rng.random() < rate
+
+
+def _uniform(rng: random.Random, amount: float) -> float:
+    return rng.uniform(-amount, amount)
+
+
+def _normal(rng: random.Random, amount: float) -> float:
+    return rng.gauss(0.0, amount)
+
+
+def _exponential(rng: random.Random, amount: float) -> float:
+    return rng.expovariate(1 / amount)
+
+
+def _pareto(rng: random.Random, amount: float) -> float:
+    # Scaled so the mean extra delay is `amount`.
+    return amount * (PARETO_SHAPE - 1) * (rng.paretovariate(PARETO_SHAPE) - 1)
+
+
+# Jitter distributions, by name.  Each takes the link's random source and
+# the jitter amount, in seconds, and returns the extra delay of one packet:
+# uniform and normal are centred on zero, with `amount` as the half width or
+# standard deviation, while exponential and pareto only ever add delay, with
+# `amount` as the mean.
+JITTERS: typing.Dict[str, typing.Callable[[random.Random, float], float]] = {
+    "uniform": _uniform,
+    "normal": _normal,
+    "exponential": _exponential,
+    "pareto": _pareto,
+}
+
+DEFAULT_JITTER = "uniform"
+
+
+class TokenBucket:
+    """Shapes packets to a byte rate, allowing bursts.
+
+    Args:
+        rate -- The sustained rate, in bytes per second.
+        burst -- The most bytes that may leave back to back after the link
+                 has been idle.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._time: typing.Optional[float] = None
+
+    def release(self, now: float, size: int) -> float:
+        """Returns when a packet accepted now leaves the link, after every
+        packet accepted before it, and charges it to the bucket.
+        """
+        if self._time is None:
+            start, tokens = now, self.burst
+        else:
+            start = max(now, self._time)
+            tokens = min(self.burst,
+                         self._tokens + self.rate * (start - self._time))
+        if tokens < size:
+            start += (size - tokens) / self.rate
+            tokens = size
+        self._tokens = tokens - size
+        self._time = start
+        return start
+
+
+class Link:
+    """The impairments of one wire.
+
+    Args:
+        delay -- The constant propagation delay, in seconds.
+        loss -- How packets are lost; no loss if None.
+        jitter -- The jitter amount, in seconds, see JITTERS.
+        jitter_dist -- The name of the jitter distribution.
+        reorder -- Whether jitter may deliver packets out of order.
+        rate -- The bandwidth limit, in bytes per second, if any.
+        burst -- The token bucket's depth, in bytes; defaults to one
+                 maximum sized packet.
+        duplicate -- The fraction of packets delivered twice.
+        queue_bytes -- The most bytes that may be on the wire at once, if
+                       limited, on top of the wire's packet limit.
+        seed -- Seeds the random source, for a repeatable run.
+    """
+
+    def __init__(self, delay: float = 0.0,
+                 loss: typing.Optional[LossModel] = None,
+                 jitter: float = 0.0, jitter_dist: str = DEFAULT_JITTER,
+                 reorder: bool = True, rate: typing.Optional[float] = None,
+                 burst: typing.Optional[float] = None,
+                 duplicate: float = 0.0,
+                 queue_bytes: typing.Optional[int] = None,
+                 seed: typing.Optional[int] = None):
+        if jitter_dist not in JITTERS:
+            raise ValueError("Unknown jitter distribution {!r}, expected one "
+                             "of {}".format(jitter_dist,
+                                            ", ".join(sorted(JITTERS))))
+        self.delay = delay
+        self.loss = loss or BernoulliLoss()
+        self.jitter = jitter
+        self._jitter = JITTERS[jitter_dist]
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.queue_bytes = queue_bytes
+        self.rng = random.Random(seed)
+        self._bucket = None
+        if rate:
+            self._bucket = TokenBucket(rate, burst or util.MAX_PACKET)
+        self._last_delivery = -math.inf
+
+    def lost(self) -> bool:
+        """Returns whether the next packet is lost."""
+        return self.loss.lost(self.rng)
+
+    def copies(self) -> int:
+        """Returns how many copies of the next packet to deliver."""
+        if self.duplicate > 0 and self.rng.random() < self.duplicate:
+            return 2
+        return 1
+
+    def departure(self, now: float, size: int) -> float:
+        """Returns when a packet the link starts transmitting now has left
+        it, after every packet transmitted before it.
+
+        Args:
+            now -- The current time, on the wire's clock.
+            size -- The size of the packet, in bytes.
+        """
+        if self._bucket is None:
+            return now
+        return self._bucket.release(now, size)
+
+    def arrival(self, departure: float) -> float:
+        """Returns when one copy of a packet that left the link at the given
+        time is delivered.
+        """
+        delay = self.delay
+        if self.jitter > 0:
+            delay = max(0.0, delay + self._jitter(self.rng, self.jitter))
+        when = departure + delay
+        if not self.reorder:
+            when = max(when, self._last_delivery)
+            self._last_delivery = when
+        return when
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds options for the impairments of a Link, besides the --loss and
+    --delay every wire script already takes, to a script's arguments.
+    """
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Seed the wire's random choices, to make a run "
+                             "repeatable.")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Limit the wire to this many bytes per second.")
+    parser.add_argument('--burst', type=int, default=None,
+                        help="The number of bytes the rate limit lets "
+                             "through back to back after an idle period "
+                             "(defaults to one packet).")
+    parser.add_argument('--queue-bytes', type=int, default=None,
+                        help="Also limit the buffer to this many bytes.")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="The number of seconds, as a float, of random "
+                             "delay to add to each packet, which may reorder "
+                             "them.")
+    parser.add_argument('--jitter-dist', default=DEFAULT_JITTER,
+                        choices=sorted(JITTERS),
+                        help="How the jitter is distributed (defaults to "
+                             "{}).".format(DEFAULT_JITTER))
+    parser.add_argument('--no-reorder', action="store_true",
+                        help="Keep packets in order, despite any jitter.")
+    parser.add_argument('--burst-loss', type=float, nargs=2, default=None,
+                        metavar=("P", "R"),
+                        help="Lose packets in bursts, following the "
+                             "Gilbert-Elliott model: move to the bad state "
+                             "with probability P and back with probability R "
+                             "before each packet.  --loss is then the loss "
+                             "rate of the good state.")
+    parser.add_argument('--bad-loss', type=float, default=1.0,
+                        help="The loss rate in the bad state of --burst-loss "
+                             "(defaults to 1).")
+    parser.add_argument('--duplicate', type=float, default=0.0,
+                        help="The fraction of packets to deliver twice.")
+
+
+def from_arguments(args: argparse.Namespace) -> Link:
+    """Builds the Link described by arguments parsed with the options of
+    `add_arguments`, and --loss and --delay.
+    """
+    if args.burst_loss:
+        loss = GilbertElliottLoss(*args.burst_loss, args.loss, args.bad_loss)
+    else:
+        loss = BernoulliLoss(args.loss)
+    return Link(args.delay, loss, jitter=args.jitter,
+                jitter_dist=args.jitter_dist, reorder=not args.no_reorder,
+                rate=args.rate, burst=args.burst, duplicate=args.duplicate,
+                queue_bytes=args.queue_bytes, seed=args.seed)
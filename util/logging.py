@@ -8,9 +8,12 @@ import sys
 
 def get_logger(log_name: str) -> logging.Logger:
     """Returns a logging instance, configured so that all non-filtered messages
-    are sent to STDOUT.
+    are sent to STDOUT.  Calling it again for the same name returns the same
+    logger, without adding another handler, so messages are never repeated.
     """
     logger = logging.getLogger(log_name)
+    if logger.handlers:
+        return logger
     handler = logging.StreamHandler(sys.stdout)
     formatter = logging.Formatter('%(asctime)s - %(name)s: %(message)s')
     handler.setFormatter(formatter)
@@ -0,0 +1,111 @@
+"""
+Telemetry for one end of a transfer.
+
+Pass a Metrics to project.send_async or recv_async, or their blocking
+counterparts, and it fills in as the transfer runs: every `interval` seconds
+it samples a snapshot of the endpoint's state, and when the transfer ends it
+keeps the final snapshot as the totals.
+
+The sender's snapshots hold its congestion window, the packets in flight,
+the RTT estimator's SRTT, RTTVAR and RTO, and counts of retransmissions,
+split by whether loss detection or a timeout queued them, and of duplicate
+ACKs.  The receiver's hold the depth of its out of order buffer, and counts
+of packets and ACKs.  Both hold the bytes delivered so far, from which each
+sample's goodput over the interval before it is worked out.
+
+The endpoints keep their counters whether or not a Metrics is passed, and
+snapshots are only taken from a loop timer, so telemetry adds nothing to
+the handling of each packet, and without a Metrics there is no timer.
+
+`write` exports the samples as CSV, or as JSON lines.
+"""
+
+import asyncio
+import csv
+import json
+import typing
+
+# Seconds between samples by default.
+DEFAULT_INTERVAL = 0.1
+
+Snapshot = typing.Dict[str, typing.Any]
+
+
+class Metrics:
+    """Samples of one endpoint's state over a transfer.
+
+    Args:
+        interval -- The seconds between samples, or zero to only keep the
+                    totals.
+
+    Attributes:
+        samples -- The samples taken, oldest first.  Each is a snapshot,
+                   with the seconds since the transfer started as "time",
+                   and the bytes per second delivered since the previous
+                   sample as "goodput".
+        totals -- The snapshot taken as the transfer ended.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples: typing.List[Snapshot] = []
+        self.totals: Snapshot = {}
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._snapshot: typing.Optional[typing.Callable[[float],
+                                                        Snapshot]] = None
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._start = 0.0
+        self._last_time = 0.0
+        self._last_bytes = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop,
+              snapshot: typing.Callable[[float], Snapshot]):
+        """Starts sampling an endpoint.
+
+        Args:
+            loop -- The loop the endpoint runs on.
+            snapshot -- Returns the endpoint's state at the time it's
+                        given, including the "bytes" delivered so far.
+        """
+        self._loop = loop
+        self._snapshot = snapshot
+        self._start = self._last_time = loop.time()
+        self._sample()
+
+    def _sample(self, again: bool = True) -> Snapshot:
+        now = self._loop.time()
+        sample = {"time": now - self._start}
+        sample.update(self._snapshot(now))
+        elapsed = now - self._last_time
+        delivered = sample.get("bytes", 0) - self._last_bytes
+        sample["goodput"] = delivered / elapsed if elapsed > 0 else 0.0
+        if elapsed > 0 or not self.samples:
+            self.samples.append(sample)
+            self._last_time = now
+            self._last_bytes = sample.get("bytes", 0)
+        if again and self.interval > 0:
+            self._timer = self._loop.call_later(self.interval, self._sample)
+        return sample
+
+    def stop(self):
+        """Stops sampling, keeping a last sample as the totals."""
+        if self._loop is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self.totals = self._sample(again=False)
+        self._timer = self._loop = self._snapshot = None
+
+    def write(self, path: str):
+        """Writes the samples to a file, as CSV if the path ends in .csv,
+        otherwise as one JSON object per line.
+        """
+        with open(path, "w", newline="") as handle:
+            if path.endswith(".csv"):
+                fields = list(self.samples[0]) if self.samples else []
+                writer = csv.DictWriter(handle, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(self.samples)
+            else:
+                for sample in self.samples:
+                    handle.write(json.dumps(sample) + "\n")
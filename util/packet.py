@@ -0,0 +1,322 @@
+"""
+The transport's wire format, shared by both ends.
+
+Every datagram starts with the same fixed header: packet type, flags, and a
+32 bit number, which is the sequence number of a data segment, the
+cumulative acknowledgement of an ACK, or the first sequence number of the
+block a repair symbol protects.  Optional fields follow in a fixed order,
+each present only when its flag is set:
+
+    FLAG_TIMESTAMP  the sender's clock and the timestamp being echoed, both
+                    in microseconds modulo 2**32, so any acknowledged
+                    transmission (retransmissions included) yields an
+                    unambiguous round trip sample.
+    FLAG_CHECKSUM   a CRC32 of the whole datagram, excluding the checksum
+                    itself.
+
+ACKs and repair symbols then carry a small fixed part of their own (see
+ACK_INFO and REPAIR_INFO) before their body.  Every part is encoded through
+a precompiled struct.Struct, packed into and parsed out of caller owned
+buffers, so building or reading a header doesn't allocate beyond the
+unpacked tuple.
+"""
+
+import struct
+import typing
+import zlib
+
+TYPE_DATA = 0
+TYPE_ACK = 1
+TYPE_REPAIR = 2
+
+# Set on the data segment that carries the final byte of the transfer, which
+# doubles as the sender's FIN, and on the repair symbols of its block.
+FLAG_LAST = 0x01
+# Set on data segments of a transfer protected by repair symbols, so the
+# receiver keeps what it needs to decode them.
+FLAG_FEC = 0x02
+FLAG_TIMESTAMP = 0x04
+FLAG_CHECKSUM = 0x08
+# Connection setup and teardown.  The first data segment carries SYN, and the
+# receiver's ACK of it SYN too.  The receiver's ACKs carry FIN once the whole
+# transfer has been delivered, and the sender answers the first of them with
+# an ACK of its own carrying FIN, after which neither end has anything left
+# to send.
+FLAG_SYN = 0x10
+FLAG_FIN = 0x20
+# Set on every data segment and repair symbol of a transfer whose length was
+# known when it started.  The stream of segment payloads then begins with
+# the length, as LENGTH, ahead of the data, so it arrives in the SYN segment
+# and is retransmitted like any data, and every other segment's payload is
+# shifted along by its size, which the receiver needs to know of before the
+# SYN segment itself arrives.
+FLAG_LENGTH = 0x40
+# Set on every data segment and repair symbol of a compressed transfer, whose
+# stream begins with the ID of its codec, see util.compression.  The data
+# is decompressed in order, so a receiver must know not to write segments
+# at their offsets before the first arrives.
+FLAG_COMPRESSED = 0x80
+# The flags that describe the stream as a whole.
+STREAM_FLAGS = FLAG_LENGTH | FLAG_COMPRESSED
+# The flags that change the layout of the header.
+OPTION_FLAGS = FLAG_TIMESTAMP | FLAG_CHECKSUM
+
+# type, flags, sequence / ack number.
+HEADER = struct.Struct("!BBI")
+# timestamp, echoed timestamp.
+TIMESTAMP = struct.Struct("!II")
+CHECKSUM = struct.Struct("!I")
+# ACK:    number of SACK blocks, number of data and repair packets received
+#         so far, followed by the blocks.  Each block is sent as its start's
+#         offset from the cumulative ack and its length, which always fit in
+#         16 bits for any window the wire's buffer allows, halving the size
+#         of a block compared to two absolute sequence numbers.
+ACK_INFO = struct.Struct("!BI")
+SACK_BLOCK = struct.Struct("!HH")
+MAX_SACK_BLOCKS = 16
+_MAX_SACK_OFFSET = 0xFFFF
+# The length of a transfer, in bytes, at the start of its stream.
+LENGTH = struct.Struct("!Q")
+# Repair: segment count of the block, repair index, followed by the symbol.
+REPAIR_INFO = struct.Struct("!BH")
+
+TIMESTAMP_HZ = 1000000
+_MASK = 0xFFFFFFFF
+
+_TYPE_INFO = {TYPE_DATA: 0, TYPE_ACK: ACK_INFO.size,
+              TYPE_REPAIR: REPAIR_INFO.size}
+
+
+class MalformedPacket(ValueError):
+    """Raised for a datagram that is truncated or fails its checksum."""
+
+
+def timestamp(now: float) -> int:
+    """Converts a time.monotonic() reading to a wire timestamp."""
+    return int(now * TIMESTAMP_HZ) & _MASK
+
+
+def elapsed(now: float, since: int) -> float:
+    """Returns the seconds between a wire timestamp and a monotonic time."""
+    return ((timestamp(now) - since) & _MASK) / TIMESTAMP_HZ
+
+
+def header_size(packet_type: int, flags: int) -> int:
+    """Returns the size of a packet's headers, up to the start of its body.
+
+    Args:
+        packet_type -- One of the TYPE_ constants.
+        flags -- The packet's flags; only OPTION_FLAGS matter.
+    """
+    size = HEADER.size + _TYPE_INFO[packet_type]
+    if flags & FLAG_TIMESTAMP:
+        size += TIMESTAMP.size
+    if flags & FLAG_CHECKSUM:
+        size += CHECKSUM.size
+    return size
+
+
+MAX_ACK_LEN = (header_size(TYPE_ACK, OPTION_FLAGS) +
+               MAX_SACK_BLOCKS * SACK_BLOCK.size)
+
+
+def _checksum_offset(flags: int) -> int:
+    if flags & FLAG_TIMESTAMP:
+        return HEADER.size + TIMESTAMP.size
+    return HEADER.size
+
+
+def _crc(buffer, offset: int, end: int, body) -> int:
+    view = memoryview(buffer)
+    crc = zlib.crc32(view[:offset])
+    crc = zlib.crc32(view[offset + CHECKSUM.size:end], crc)
+    return zlib.crc32(body, crc)
+
+
+class Header:
+    """The decoded common header of a datagram.  One instance is meant to be
+    reused for every datagram an endpoint reads.
+
+    Attributes:
+        type -- One of the TYPE_ constants.
+        flags -- The FLAG_ bits set on the packet.
+        number -- The sequence number, cumulative ack or block start.
+        timestamp -- The sender's timestamp, if FLAG_TIMESTAMP is set.
+        echo -- The timestamp being echoed, if FLAG_TIMESTAMP is set.
+        size -- Where the type specific part of the packet starts.
+    """
+
+    __slots__ = ("type", "flags", "number", "timestamp", "echo", "size")
+
+    def __init__(self):
+        self.type = self.flags = self.number = 0
+        self.timestamp = self.echo = 0
+        self.size = 0
+
+    def unpack_from(self, buffer, length: int):
+        """Decodes the header of a datagram, verifying its checksum if it
+        carries one.
+
+        Args:
+            buffer -- The buffer the datagram was received into.
+            length -- The length of the datagram.
+
+        Raises:
+            MalformedPacket -- If the datagram is truncated or corrupted.
+        """
+        if length < HEADER.size:
+            raise MalformedPacket("datagram of {} bytes".format(length))
+        self.type, self.flags, self.number = HEADER.unpack_from(buffer)
+        if self.type not in _TYPE_INFO:
+            raise MalformedPacket("unknown packet type {}".format(self.type))
+        flags = self.flags
+        if length < header_size(self.type, flags):
+            raise MalformedPacket("truncated header")
+        offset = HEADER.size
+        if flags & FLAG_TIMESTAMP:
+            self.timestamp, self.echo = TIMESTAMP.unpack_from(buffer, offset)
+            offset += TIMESTAMP.size
+        if flags & FLAG_CHECKSUM:
+            expected, = CHECKSUM.unpack_from(buffer, offset)
+            if _crc(buffer, offset, length, b'') != expected:
+                raise MalformedPacket("checksum mismatch")
+            offset += CHECKSUM.size
+        self.size = offset
+
+
+def pack_header(buffer, packet_type: int, flags: int, number: int,
+                stamp: int = 0, echo: int = 0) -> int:
+    """Packs the common header and its optional fields.
+
+    Args:
+        buffer -- The buffer to pack into, from offset 0.
+        packet_type -- One of the TYPE_ constants.
+        flags -- FLAG_ bits; FLAG_TIMESTAMP and FLAG_CHECKSUM add fields.
+        number -- The sequence number, cumulative ack or block start.
+        stamp -- The sender's timestamp, see `timestamp`.
+        echo -- The peer's timestamp being echoed.
+
+    Return:
+        The offset just past the common header, where the type specific part
+        goes.  If FLAG_CHECKSUM is set, the packet must be finished with
+        `seal` once complete.
+    """
+    HEADER.pack_into(buffer, 0, packet_type, flags, number & _MASK)
+    offset = HEADER.size
+    if flags & FLAG_TIMESTAMP:
+        TIMESTAMP.pack_into(buffer, offset, stamp, echo)
+        offset += TIMESTAMP.size
+    if flags & FLAG_CHECKSUM:
+        offset += CHECKSUM.size
+    return offset
+
+
+def seal(buffer, length: int, body=b''):
+    """Fills in the checksum of a packet with FLAG_CHECKSUM set.
+
+    Args:
+        buffer -- The buffer holding the packet's headers.
+        length -- How many bytes of the buffer belong to the packet.
+        body -- The rest of the packet, when it is sent from a separate
+                buffer with scatter / gather IO.
+    """
+    offset = _checksum_offset(buffer[1])
+    CHECKSUM.pack_into(buffer, offset, _crc(buffer, offset, length, body))
+
+
+def pack_data(buffer, flags: int, seq: int, stamp: int = 0, echo: int = 0,
+              payload=b'') -> int:
+    """Packs the headers of a data segment.  The payload is left to be sent
+    after them, but is needed here for the checksum.
+
+    Return:
+        The size of the headers.
+    """
+    size = pack_header(buffer, TYPE_DATA, flags, seq, stamp, echo)
+    if flags & FLAG_CHECKSUM:
+        seal(buffer, size, payload)
+    return size
+
+
+def pack_ack(buffer, flags: int, cum_ack: int, received: int,
+             blocks: typing.Sequence[typing.Tuple[int, int]],
+             stamp: int = 0, echo: int = 0) -> int:
+    """Builds a complete ACK.
+
+    Args:
+        buffer -- A buffer of at least MAX_ACK_LEN bytes.
+        flags -- Option flags for the ACK.
+        cum_ack -- The next in order sequence number the receiver expects.
+        received -- How many data and repair packets have arrived so far.
+        blocks -- At most MAX_SACK_BLOCKS SACK ranges, as (start, end)
+                  sequence numbers, end exclusive.  Ranges that can't be
+                  expressed relative to the cumulative ack are left out.
+        stamp -- The receiver's timestamp.
+        echo -- The timestamp of the packet being acknowledged.
+
+    Return:
+        The length of the ACK.
+    """
+    offset = pack_header(buffer, TYPE_ACK, flags, cum_ack, stamp, echo)
+    info_offset = offset
+    offset += ACK_INFO.size
+    num_blocks = 0
+    for start, end in blocks:
+        start_offset = start - cum_ack
+        if not (0 <= start_offset <= _MAX_SACK_OFFSET and
+                0 < end - start <= _MAX_SACK_OFFSET):
+            continue
+        SACK_BLOCK.pack_into(buffer, offset, start_offset, end - start)
+        offset += SACK_BLOCK.size
+        num_blocks += 1
+    ACK_INFO.pack_into(buffer, info_offset, num_blocks, received & _MASK)
+    if flags & FLAG_CHECKSUM:
+        seal(buffer, offset)
+    return offset
+
+
+def unpack_ack(buffer, header: Header, length: int
+               ) -> typing.Tuple[int, typing.List[typing.Tuple[int, int]]]:
+    """Parses the rest of an ACK whose header has been decoded.
+
+    Return:
+        The receiver's packet count, and the SACK ranges that fit in the
+        datagram, as (start, end) sequence numbers.
+    """
+    offset = header.size
+    num_blocks, received = ACK_INFO.unpack_from(buffer, offset)
+    offset += ACK_INFO.size
+    num_blocks = min(num_blocks, MAX_SACK_BLOCKS,
+                     (length - offset) // SACK_BLOCK.size)
+    blocks = []
+    for idx in range(num_blocks):
+        start_offset, size = SACK_BLOCK.unpack_from(
+            buffer, offset + idx * SACK_BLOCK.size)
+        start = header.number + start_offset
+        blocks.append((start, start + size))
+    return received, blocks
+
+
+def pack_repair(buffer, flags: int, first: int, count: int, index: int,
+                stamp: int = 0, symbol=b'') -> int:
+    """Packs the headers of a repair symbol.  Like `pack_data`, the symbol
+    is only needed for the checksum.
+
+    Return:
+        The size of the headers.
+    """
+    offset = pack_header(buffer, TYPE_REPAIR, flags, first, stamp)
+    REPAIR_INFO.pack_into(buffer, offset, count, index)
+    offset += REPAIR_INFO.size
+    if flags & FLAG_CHECKSUM:
+        seal(buffer, offset, symbol)
+    return offset
+
+
+def unpack_repair(buffer, header: Header) -> typing.Tuple[int, int]:
+    """Parses the rest of a repair symbol's headers.
+
+    Return:
+        The block's segment count, and the repair index.
+    """
+    return REPAIR_INFO.unpack_from(buffer, header.size)
@@ -0,0 +1,83 @@
+"""
+Sets of sequence numbers kept as sorted, disjoint ranges, for the SACK
+bookkeeping of both ends of a transfer.
+
+The ranges are held as two parallel sorted lists, of their starts and of
+their ends, so finding the ranges a sequence number or a range touches is a
+bisect of one of them, and adding one merges it with those in place, rather
+than re-sorting every sequence number held.
+"""
+
+import bisect
+import typing
+
+
+class Ranges:
+    """A set of integers, as disjoint (start, end) ranges, end exclusive,
+    none touching another.
+    """
+
+    def __init__(self):
+        self._starts: typing.List[int] = []
+        self._ends: typing.List[int] = []
+
+    def __len__(self) -> int:
+        """The number of ranges."""
+        return len(self._starts)
+
+    def add(self, start: int, end: int):
+        """Adds every number from start up to end, merging the ranges it
+        overlaps or touches.
+        """
+        if start >= end:
+            return
+        first = bisect.bisect_left(self._ends, start)
+        last = bisect.bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+
+    def trim(self, below: int):
+        """Drops every number below the given one."""
+        first = bisect.bisect_right(self._ends, below)
+        del self._starts[:first]
+        del self._ends[:first]
+        if self._starts and self._starts[0] < below:
+            self._starts[0] = below
+
+    def missing(self, start: int, end: int
+                ) -> typing.Iterator[typing.Tuple[int, int]]:
+        """Yields the ranges of the numbers from start up to end that aren't
+        in the set, in order.
+        """
+        idx = bisect.bisect_right(self._starts, start)
+        if idx and self._ends[idx - 1] > start:
+            start = self._ends[idx - 1]
+        while start < end:
+            if idx == len(self._starts) or self._starts[idx] >= end:
+                yield start, end
+                return
+            if self._starts[idx] > start:
+                yield start, self._starts[idx]
+            start = self._ends[idx]
+            idx += 1
+
+    def blocks(self, limit: int, latest: typing.Optional[int] = None
+               ) -> typing.List[typing.Tuple[int, int]]:
+        """Returns the lowest ranges, up to the given number of them.
+
+        Args:
+            limit -- The most ranges to return.
+            latest -- If given, the range holding this number is listed
+                      first, in place of the highest of the others.
+        """
+        first = []
+        if latest is not None:
+            idx = bisect.bisect_right(self._starts, latest) - 1
+            if idx >= 0 and latest < self._ends[idx]:
+                first.append((self._starts[idx], self._ends[idx]))
+        others = zip(self._starts[:limit + 1], self._ends[:limit + 1])
+        return (first + [block for block in others
+                         if block not in first])[:limit]
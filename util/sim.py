@@ -0,0 +1,296 @@
+"""
+Discrete event simulation of the wire and the endpoints talking over it.
+
+Everything in the transport and the wire is written as asyncio datagram
+protocols, driven by loop callbacks and timers.  VirtualEventLoop is an
+asyncio event loop whose clock only moves when there is nothing left to run:
+instead of sleeping until the next timer is due, it jumps straight to it.
+SimNetwork delivers datagrams between the protocols bound to its addresses
+in memory, through the loop, so a transfer that would take a minute of real
+time takes only the CPU time its packets cost to process.
+
+Given the same inputs and a seeded util.link.Link, a run is repeatable bit
+for bit: the only sources of randomness are the link's random.Random and
+the seeded generators of util.fec, and the loop runs callbacks in the order
+they were scheduled.  That includes timers due at the same instant, which
+are common on a simulated clock, and which asyncio would otherwise run in
+whatever order its heap yields them, reordering packets on the wire.
+
+A Simulation wires up one CrummyWireProtocol and hands out SimSockets
+connected to it, which `project.send_async` and `project.recv_async` accept
+in place of real sockets.
+"""
+
+import asyncio
+import heapq
+import itertools
+import selectors
+import typing
+import util.flows
+import util.link
+import util.wire
+
+WIRE_ADDR = ("127.0.0.1", 9999)
+# Where the addresses handed to endpoints start.
+FIRST_PORT = 40000
+
+
+class SimulationStalled(RuntimeError):
+    """Raised when the simulation has nothing left to run, but the transfer
+    being waited for hasn't finished.
+    """
+
+
+class _OrderedTimerHandle(asyncio.TimerHandle):
+    """A timer that sorts after every timer due at the same time that was
+    scheduled before it.
+    """
+
+    __slots__ = ("_order",)
+
+    def __init__(self, when, callback, args, loop, context, order: int):
+        super().__init__(when, callback, args, loop, context)
+        self._order = order
+
+    def __lt__(self, other):
+        if self._when != other._when:
+            return self._when < other._when
+        return self._order < other._order
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    """The selector of a VirtualEventLoop.  Nothing ever becomes readable;
+    waiting for IO moves the loop's clock instead.
+    """
+
+    def __init__(self, loop: "VirtualEventLoop"):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: typing.Optional[float] = None):
+        if timeout is None:
+            raise SimulationStalled("no callbacks or timers left to run")
+        self._loop.advance(timeout)
+        return []
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """An event loop running on simulated time, starting at zero.
+
+    Datagram endpoints created on a SimSocket are bound to its SimNetwork;
+    any other endpoint is created as usual, but real IO is never polled.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        self._order = itertools.count()
+        super().__init__(selector=_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._now
+
+    def call_at(self, when, callback, *args, context=None):
+        # As BaseEventLoop.call_at, but with timers kept in FIFO order.
+        if when is None:
+            raise TypeError("when cannot be None")
+        self._check_closed()
+        timer = _OrderedTimerHandle(when, callback, args, self, context,
+                                    next(self._order))
+        heapq.heappush(self._scheduled, timer)
+        timer._scheduled = True
+        return timer
+
+    def advance(self, seconds: float):
+        """Moves the clock forward."""
+        self._now += seconds
+
+    async def create_datagram_endpoint(self, protocol_factory,
+                                       local_addr=None, remote_addr=None,
+                                       **kwargs):
+        sock = kwargs.get("sock")
+        if isinstance(sock, SimSocket):
+            return sock.bind_protocol(protocol_factory())
+        return await super().create_datagram_endpoint(
+            protocol_factory, local_addr, remote_addr, **kwargs)
+
+
+class _SimTransport(asyncio.DatagramTransport):
+
+    def __init__(self, network: "SimNetwork", addr: tuple,
+                 protocol: asyncio.DatagramProtocol,
+                 peer: typing.Optional[tuple] = None):
+        super().__init__()
+        self._network = network
+        self._addr = addr
+        self._protocol = protocol
+        self._peer = peer
+        self._closing = False
+
+    def get_extra_info(self, name, default=None):
+        if name == "sockname":
+            return self._addr
+        if name == "peername":
+            return self._peer
+        return default
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        self._network.deliver(self._addr, addr or self._peer, data)
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._network.unbind(self._addr)
+        self._network.loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+
+class SimSocket:
+    """Stands in for a connected UDP socket on a SimNetwork.
+
+    Args:
+        network -- The network the socket is on.
+        addr -- The socket's own address.
+    """
+
+    def __init__(self, network: "SimNetwork", addr: tuple):
+        self._network = network
+        self.addr = addr
+        self.peer: typing.Optional[tuple] = None
+
+    def connect(self, addr: tuple):
+        """Sets the address datagrams are sent to."""
+        self.peer = addr
+
+    def send(self, data: bytes) -> int:
+        """Sends a datagram to the connected address."""
+        self._network.deliver(self.addr, self.peer, data)
+        return len(data)
+
+    def dup(self) -> "SimSocket":
+        return self
+
+    def gettimeout(self) -> typing.Optional[float]:
+        return None
+
+    def settimeout(self, timeout: typing.Optional[float]):
+        pass
+
+    def close(self):
+        pass
+
+    def bind_protocol(self, protocol: asyncio.DatagramProtocol
+                      ) -> typing.Tuple[asyncio.DatagramTransport,
+                                        asyncio.DatagramProtocol]:
+        """Attaches a protocol to the socket's address, as a datagram
+        endpoint created on a real socket would be.
+        """
+        return self._network.bind(self.addr, protocol, self.peer)
+
+
+class SimNetwork:
+    """Delivers datagrams between the protocols bound to its addresses.
+    Delivery takes no simulated time, but always goes through the loop,
+    never straight from one protocol into another.  Datagrams sent to an
+    address nothing is bound to are dropped.
+
+    Args:
+        loop -- The loop the network's protocols run on.
+    """
+
+    def __init__(self, loop: VirtualEventLoop):
+        self.loop = loop
+        self._protocols: typing.Dict[tuple, asyncio.DatagramProtocol] = {}
+        self._next_port = FIRST_PORT
+
+    def socket(self) -> SimSocket:
+        """Returns an unconnected socket at a fresh address."""
+        self._next_port += 1
+        return SimSocket(self, ("127.0.0.1", self._next_port))
+
+    def bind(self, addr: tuple, protocol: asyncio.DatagramProtocol,
+             peer: typing.Optional[tuple] = None):
+        """Attaches a protocol to an address.
+
+        Return:
+            The protocol's transport, and the protocol.
+        """
+        transport = _SimTransport(self, addr, protocol, peer)
+        self._protocols[addr] = protocol
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    def unbind(self, addr: tuple):
+        """Detaches whatever protocol is bound to an address."""
+        self._protocols.pop(addr, None)
+
+    def deliver(self, source: tuple, dest: tuple, data):
+        """Queues a datagram for the protocol bound to an address."""
+        protocol = self._protocols.get(dest)
+        if protocol is not None:
+            self.loop.call_soon(protocol.datagram_received, bytes(data),
+                                source)
+
+
+class Simulation:
+    """A simulated wire, with the same parameters as util.wire.create_server,
+    for endpoints to connect to.
+
+    Args:
+        loss -- The fraction of packets to drop.
+        delay -- How long, in seconds, each packet spends on the wire.
+        buffer_size -- How many packets may be on the wire at once.
+        seed -- Seeds the wire's random choices.
+        link -- The link's impairments.  If given, it takes the place of
+                loss, delay and seed.
+        queue -- The name of the wire's queue discipline.
+    """
+
+    def __init__(self, loss: float, delay: float, buffer_size: int,
+                 seed: int = 0, link: typing.Optional[util.link.Link] = None,
+                 queue: str = util.flows.DEFAULT_QUEUE):
+        if link is None:
+            link = util.link.Link(delay, util.link.BernoulliLoss(loss),
+                                  seed=seed)
+        self.loop = VirtualEventLoop()
+        self.network = SimNetwork(self.loop)
+        # The simulated clock is exact, so packets are delivered exactly when
+        # they are due, rather than rounded to the real loop's resolution.
+        self.wire = util.wire.CrummyWireProtocol(self.loop, loss, delay,
+                                                 buffer_size, link=link,
+                                                 queue=queue,
+                                                 batch_window=0.0)
+        self.network.bind(WIRE_ADDR, self.wire)
+
+    def connect(self, flow: bytes = util.flows.DEFAULT_FLOW) -> SimSocket:
+        """Returns a socket connected to the wire, like util.wire.bad_socket.
+        """
+        sock = self.network.socket()
+        sock.connect(WIRE_ADDR)
+        sock.send(util.flows.connect_message(flow))
+        return sock
+
+    def run(self, transfer: typing.Awaitable):
+        """Runs the loop until a transfer completes.
+
+        Return:
+            What the transfer returned.
+
+        Raises:
+            SimulationStalled -- If the transfer can never complete.
+        """
+        return self.loop.run_until_complete(transfer)
+
+    def close(self):
+        """Releases the loop."""
+        self.loop.close()
@@ -0,0 +1,201 @@
+"""
+Sources of the segments a sender transmits.
+
+The sender asks for segments by sequence number as its window opens, rather
+than holding the whole input, so a transfer can start before the input is
+fully read and can be larger than memory.  `open_source` picks the right
+source for bytes-like objects (including mmaps), file objects and iterators
+of chunks.
+
+Sources whose length is known up front, buffers and regular files, announce
+it: their stream of segments begins with the length, packed as
+util.packet.LENGTH, so the receiver can size its output before the rest of
+the data arrives.
+"""
+
+import os
+import stat
+import typing
+import util.packet
+
+Chunks = typing.Iterator[bytes]
+
+
+class SegmentSource:
+    """Interface of every segment source.
+
+    Attributes:
+        segment_size -- The payload size of every segment but the last.
+        num_segments -- The total number of segments, or None while the end
+                        of the input hasn't been reached yet.  Every source
+                        produces at least one (possibly empty) segment.
+        length -- The number of bytes of input produced so far.
+        announced -- Whether the segments begin with the input's length.
+        compressed -- Whether the segments are a compressed stream, see
+                      util.compression.
+    """
+
+    compressed = False
+
+    def __init__(self, segment_size: int):
+        self.segment_size = segment_size
+        self.num_segments: typing.Optional[int] = None
+        self.length = 0
+        self.announced = False
+        self._prefix = b''
+
+    def _announce(self, length: int):
+        # Called by sources of known length before they count segments.
+        self.announced = True
+        self._prefix = util.packet.LENGTH.pack(length)
+        self.length = length
+        self.num_segments = max(1, -(-(length + len(self._prefix)) //
+                                     self.segment_size))
+
+    def _bounds(self, seq: int) -> typing.Tuple[int, int]:
+        # The input a segment holds, as an offset and a size, either of
+        # which the prefix may make negative for the first segment.
+        offset = seq * self.segment_size - len(self._prefix)
+        return offset, min(self.segment_size,
+                           self.length + len(self._prefix) -
+                           seq * self.segment_size)
+
+    def available(self, seq: int) -> bool:
+        """Returns whether the given segment exists, reading more input if
+        that is needed to find out.
+        """
+        raise NotImplementedError()
+
+    def segment(self, seq: int) -> typing.Union[bytes, memoryview]:
+        """Returns the payload of an available, unreleased segment."""
+        raise NotImplementedError()
+
+    def is_last(self, seq: int) -> bool:
+        """Returns whether an available segment is the final one."""
+        return self.num_segments is not None and seq == self.num_segments - 1
+
+    def release(self, seq: int):
+        """Called once a segment is acknowledged and won't be needed again."""
+
+
+class BufferSource(SegmentSource):
+    """Segments of an object supporting the buffer protocol, such as bytes
+    or an mmap, sliced without copying, but for the first, which is copied
+    to put the announced length in front.
+    """
+
+    def __init__(self, data, segment_size: int):
+        super().__init__(segment_size)
+        self._view = memoryview(data).cast("B")
+        self._announce(len(self._view))
+
+    def available(self, seq: int) -> bool:
+        return seq < self.num_segments
+
+    def segment(self, seq: int) -> typing.Union[bytes, memoryview]:
+        offset, size = self._bounds(seq)
+        if offset < 0:
+            return self._prefix + self._view[:offset + size].tobytes()
+        return self._view[offset:offset + size]
+
+
+class FileSource(SegmentSource):
+    """Segments of a regular file, read with pread when (re)transmitted, so
+    nothing of the file is kept in memory between transmissions.  The file
+    is sent from its current position to its size when the source is made.
+    """
+
+    def __init__(self, handle: typing.BinaryIO, segment_size: int):
+        super().__init__(segment_size)
+        self._fd = handle.fileno()
+        self._start = handle.tell()
+        self._announce(max(0, os.fstat(self._fd).st_size - self._start))
+
+    def available(self, seq: int) -> bool:
+        return seq < self.num_segments
+
+    def segment(self, seq: int) -> bytes:
+        offset, size = self._bounds(seq)
+        if offset < 0:
+            return self._prefix + os.pread(self._fd, offset + size,
+                                           self._start)
+        return os.pread(self._fd, size, self._start + offset)
+
+
+class IteratorSource(SegmentSource):
+    """Segments cut from an iterator of arbitrarily sized chunks.  Input is
+    pulled only as new segments are needed, and each segment is kept only
+    until it is released, so memory use follows the window rather than the
+    size of the input.
+    """
+
+    def __init__(self, chunks: Chunks, segment_size: int):
+        super().__init__(segment_size)
+        self._chunks: typing.Optional[Chunks] = chunks
+        self._pending = bytearray()
+        self._segments: typing.Dict[int, bytes] = {}
+        self._produced = 0
+
+    def _produce(self):
+        # Read one byte past the segment, so we know whether it's the last.
+        while self._chunks is not None and (len(self._pending) <=
+                                            self.segment_size):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._chunks = None
+            else:
+                self._pending += chunk
+        segment = bytes(self._pending[:self.segment_size])
+        del self._pending[:self.segment_size]
+        self._segments[self._produced] = segment
+        self._produced += 1
+        self.length += len(segment)
+        if self._chunks is None and not self._pending:
+            self.num_segments = self._produced
+
+    def available(self, seq: int) -> bool:
+        while seq >= self._produced and self.num_segments is None:
+            self._produce()
+        return seq < self._produced
+
+    def segment(self, seq: int) -> bytes:
+        return self._segments[seq]
+
+    def release(self, seq: int):
+        self._segments.pop(seq, None)
+
+
+def is_regular_file(handle) -> bool:
+    """Returns whether a file object is a seekable, regular file, whose
+    descriptor can be read or written at any offset.
+    """
+    try:
+        return (handle.seekable() and
+                stat.S_ISREG(os.fstat(handle.fileno()).st_mode))
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def open_source(source, segment_size: int) -> SegmentSource:
+    """Wraps whatever is to be sent in the matching segment source.
+
+    Args:
+        source -- A bytes-like object or mmap, a binary file object, an
+                  iterable of bytes chunks, or an existing SegmentSource.
+        segment_size -- The payload size of each segment.
+
+    Return:
+        A SegmentSource producing the input.
+    """
+    if isinstance(source, SegmentSource):
+        return source
+    try:
+        return BufferSource(source, segment_size)
+    except TypeError:
+        pass
+    if hasattr(source, "read"):
+        if is_regular_file(source):
+            return FileSource(source, segment_size)
+        return IteratorSource(iter(lambda: source.read(segment_size), b''),
+                              segment_size)
+    return IteratorSource(iter(source), segment_size)
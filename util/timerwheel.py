@@ -0,0 +1,134 @@
+"""
+A hierarchical timer wheel, for keeping one timer per segment in flight.
+
+Time is divided into ticks.  Level 0 of the wheel has a slot for each of the
+next SLOTS ticks, level 1 a slot for each of the next SLOTS spans of SLOTS
+ticks, and so on.  Arming a timer drops it into the slot covering its expiry
+and cancelling it removes it from that slot, both in constant time whatever
+the number of timers.  Whenever level 0 wraps around, the next slot of the
+level above is emptied into the levels below it, so every timer reaches
+level 0 before it is due, and all the timers due in a tick expire together.
+"""
+
+import collections
+import math
+import typing
+
+SLOTS = 64
+LEVELS = 4
+
+# Readings this close to a tick boundary count as having reached it, so a
+# callback scheduled for the boundary isn't undone by float rounding.
+_EPSILON = 1e-6
+
+
+class TimerWheel:
+    """Timers keyed by any hashable value, expiring in batches per tick.
+
+    Args:
+        tick -- The resolution of the wheel, in seconds.  Timers never
+                expire early, and at most a tick late.
+        now -- The current time, on the clock deadlines are given in.
+
+    Attributes:
+        fired -- The total number of timers that have expired.
+        fired_per_tick -- Histogram of how many timers expired in each tick
+                          in which any did, as a Counter of count -> ticks.
+    """
+
+    def __init__(self, tick: float, now: float):
+        self.tick = tick
+        self._bits = SLOTS.bit_length() - 1
+        self._mask = SLOTS - 1
+        self._wheels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._slots: typing.Dict[typing.Hashable, dict] = {}
+        self._current = self._floor(now)
+        self.fired = 0
+        self.fired_per_tick: typing.Counter[int] = collections.Counter()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._slots
+
+    def _floor(self, when: float) -> int:
+        return math.floor(when / self.tick + _EPSILON)
+
+    def _place(self, key: typing.Hashable, expiry: int):
+        delta = max(1, expiry - self._current)
+        level = 0
+        while level < LEVELS - 1 and delta > 1 << (self._bits * (level + 1)):
+            level += 1
+        slot = self._wheels[level][(expiry >> (self._bits * level)) &
+                                   self._mask]
+        slot[key] = expiry
+        self._slots[key] = slot
+
+    def arm(self, key: typing.Hashable, deadline: float):
+        """Sets the timer for a key, replacing any timer it already had.
+
+        Args:
+            key -- What `advance` reports when the timer expires.
+            deadline -- When the timer expires.
+        """
+        self.cancel(key)
+        self._place(key, math.ceil(deadline / self.tick - _EPSILON))
+
+    def cancel(self, key: typing.Hashable):
+        """Stops the timer for a key, if it has one."""
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def _cascade(self, level: int, tick: int):
+        index = (tick >> (self._bits * level)) & self._mask
+        slot = self._wheels[level][index]
+        if not slot:
+            return
+        self._wheels[level][index] = {}
+        for key, expiry in slot.items():
+            self._place(key, expiry)
+
+    def advance(self, now: float) -> typing.List[typing.Hashable]:
+        """Moves the wheel up to the current time.
+
+        Return:
+            The keys of every timer that expired, in order of expiry, and
+            within a tick in the order they were armed.
+        """
+        target = self._floor(now)
+        expired = []
+        while self._current < target:
+            if not self._slots:
+                self._current = target
+                break
+            tick = self._current + 1
+            for level in range(LEVELS - 1, 0, -1):
+                if tick & ((1 << (self._bits * level)) - 1) == 0:
+                    self._cascade(level, tick)
+            slot = self._wheels[0][tick & self._mask]
+            if slot:
+                self._wheels[0][tick & self._mask] = {}
+                for key in slot:
+                    del self._slots[key]
+                expired.extend(slot)
+                self.fired += len(slot)
+                self.fired_per_tick[len(slot)] += 1
+            self._current = tick
+        return expired
+
+    def next_expiry(self) -> typing.Optional[float]:
+        """Returns when `advance` should next be called: the tick of the
+        earliest timer on level 0, or the next time level 0 wraps around and
+        is refilled from the levels above, whichever comes first.  None if
+        no timer is armed.
+        """
+        if not self._slots:
+            return None
+        level0 = self._wheels[0]
+        wrap = (self._current >> self._bits) + 1 << self._bits
+        for tick in range(self._current + 1, wrap):
+            if level0[tick & self._mask]:
+                return tick * self.tick
+        return wrap * self.tick
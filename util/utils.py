@@ -1,25 +1,155 @@
 """
 Shared utilities for testing implementations.
 """
+import collections
+import json
+import os
 import pathlib
+import select
+import tempfile
 import typing
 import hashlib
 
-def file_summary(path: pathlib.Path) -> typing.Tuple[int, str]:
+# The lines a launched script writes to its status pipe: that it's ready
+# for the next script to start, followed by the port it listens on if it
+# listens on one, when the data it received first and last arrived, and the
+# length and digest of what it wrote.
+STATUS_READY = "ready"
+STATUS_TIMES = "times"
+STATUS_DIGEST = "digest"
+
+# How much of a file is read at a time to hash it.
+HASH_CHUNK = 1 << 20
+# Where the digests of files hashed before are kept, and how many are kept,
+# the least recently used going first.
+DIGEST_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "project", "digests.json")
+DIGEST_CACHE_SIZE = 256
+
+# A cached file: its resolved path, inode, size and modification time, in
+# nanoseconds.  A file rewritten in place changes at least one of them.
+DigestKey = typing.Tuple[str, int, int, int]
+
+
+def _load_digests(path: str) -> "collections.OrderedDict[DigestKey, str]":
+    digests = collections.OrderedDict()
+    try:
+        with open(path) as handle:
+            for *key, digest in json.load(handle):
+                digests[tuple(key)] = digest
+    except (OSError, ValueError, TypeError):
+        pass
+    return digests
+
+
+def _store_digests(path: str,
+                   digests: "collections.OrderedDict[DigestKey, str]"):
+    # Written to a temporary file and moved into place, so scripts hashing
+    # at the same time never read a partial cache; the last one to finish
+    # wins.
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, "w") as temp:
+            json.dump([list(key) + [digest]
+                       for key, digest in digests.items()], temp)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+def _hash_file(path: pathlib.Path) -> typing.Tuple[int, str]:
+    hasher = hashlib.sha256()
+    chunk = bytearray(HASH_CHUNK)
+    view = memoryview(chunk)
+    length = 0
+    with open(path, 'rb', buffering=0) as handle:
+        while True:
+            read = handle.readinto(chunk)
+            if not read:
+                break
+            hasher.update(view[:read])
+            length += read
+    return length, hasher.hexdigest()
+
+
+def file_summary(path: pathlib.Path,
+                 cache: bool = True) -> typing.Tuple[int, str]:
     """Reads a file off disk, and returns the size of the file and the sha256
-    hash of it.
+    hash of it.  The file is read a chunk at a time, so memory use doesn't
+    grow with its size.
 
     Args:
         path -- A path to a file that should be summarized.
+        cache -- Whether to look the digest up in, and add it to, the cache
+                 at DIGEST_CACHE_PATH, which spares hashing the same
+                 unchanged file run after run.
 
     Return:
         Two values, first the size of the file, in bytes, and second, the
         sha256 hex digest of the contents of the file.
     """
-    with open(path, 'rb') as handle:
-        data: bytes = handle.read()
-        data_len: int = len(data)
-        hasher = hashlib.sha256()
-        hasher.update(data)
-        hash_hex: str = hasher.hexdigest()
-    return data_len, hash_hex
+    if not cache:
+        return _hash_file(path)
+    info = os.stat(path)
+    key = (str(pathlib.Path(path).resolve()), info.st_ino, info.st_size,
+           info.st_mtime_ns)
+    digests = _load_digests(DIGEST_CACHE_PATH)
+    digest = digests.pop(key, None)
+    if digest is None:
+        length, digest = _hash_file(path)
+        if length != info.st_size:
+            # Changed while being read, so not worth remembering.
+            return length, digest
+    digests[key] = digest
+    while len(digests) > DIGEST_CACHE_SIZE:
+        digests.popitem(last=False)
+    _store_digests(DIGEST_CACHE_PATH, digests)
+    return info.st_size, digest
+
+
+def report_status(fd: typing.Optional[int], *fields):
+    """Writes a line to the status pipe a launching script passed down, if
+    it passed one.
+
+    Args:
+        fd -- The pipe's file descriptor, or None.
+        fields -- What to write, separated by spaces.
+    """
+    if fd is None:
+        return
+    line = " ".join(str(a_field) for a_field in fields) + "\n"
+    os.write(fd, line.encode())
+
+
+def read_status(handle: typing.TextIO,
+                timeout: typing.Optional[float] = None
+                ) -> typing.Optional[typing.List[str]]:
+    """Waits for the next line on the read end of a status pipe.
+
+    Args:
+        handle -- The read end of the pipe.
+        timeout -- The longest, in seconds, to wait, if limited.
+
+    Return:
+        The fields of the line, or None if no line came in time, or the
+        writer closed the pipe without sending one.
+    """
+    readable, _, _ = select.select([handle], [], [], timeout)
+    if not readable:
+        return None
+    line = handle.readline()
+    if not line:
+        return None
+    return line.split()
+
+
+def percentile(values: typing.Sequence[float], fraction: float) -> float:
+    """Returns the value a fraction of the way through the sorted values, or
+    NaN if there are none.
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -3,12 +3,34 @@ Implementation of an async based lossy wire, that simulates network
 conditions between two communicating sockets.
 """
 import asyncio
-import random
+import collections
+import itertools
 import socket
 import binascii
 import hashlib
+import logging
+import math
 import struct
+import typing
+import util.capture
+import util.flows
+import util.link
 import util.logging
+import util.utils
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Packets due within the same window of this many seconds are released
+# together, by one timer.  The default matches the millisecond resolution
+# epoll waits with, so it costs no accuracy the loop would otherwise have.
+BATCH_WINDOW = 0.001
+
+# Why the wire dropped a packet.
+DROP_BUFFER_FULL = "buffer-full"
+DROP_LOSS = "loss"
 
 
 def data_rep(data: bytes) -> str:
@@ -26,94 +48,375 @@ def data_rep(data: bytes) -> str:
     return sha1er.hexdigest()
 
 
+def _endpoint(addr) -> str:
+    return "{}:{}".format(*addr[:2])
+
+
+class WireStats:
+    """What a wire did with the packets it was sent.
+
+    Args:
+        now -- When the wire started, on its loop's clock.
+
+    Attributes:
+        dropped -- Packets dropped, by cause: DROP_BUFFER_FULL or
+                   DROP_LOSS.
+        occupancy -- How many packets each arriving packet found on the
+                     wire, as a count of arrivals by the number found.
+        received -- Packets and bytes the wire was sent, by the address
+                    that sent them.
+        forwarded -- Packets and bytes the wire forwarded, by the address
+                     that sent them.
+    """
+
+    def __init__(self, now: float):
+        self.started = now
+        self.dropped = collections.Counter()
+        self.occupancy = collections.Counter()
+        self.received = collections.defaultdict(lambda: [0, 0])
+        self.forwarded = collections.defaultdict(lambda: [0, 0])
+        self._busy = 0.0
+        self._busy_since: typing.Optional[float] = None
+
+    def busy(self, now: float):
+        """Notes that the wire went from empty to holding packets."""
+        self._busy_since = now
+
+    def idle(self, now: float):
+        """Notes that the wire went from holding packets to empty."""
+        if self._busy_since is not None:
+            self._busy += now - self._busy_since
+            self._busy_since = None
+
+    def busy_time(self, now: float) -> float:
+        """Returns the seconds the wire has held packets for."""
+        if self._busy_since is None:
+            return self._busy
+        return self._busy + now - self._busy_since
+
+    def to_dict(self, now: float) -> dict:
+        """Returns the statistics as plain data, to be written as JSON."""
+        elapsed = now - self.started
+        busy = self.busy_time(now)
+        found = sorted(self.occupancy.elements())
+        return {
+            "elapsed": elapsed,
+            "busy": busy,
+            "idle": elapsed - busy,
+            "arrivals": len(found),
+            "dropped": {cause: self.dropped[cause]
+                        for cause in (DROP_BUFFER_FULL, DROP_LOSS)},
+            "occupancy": {str(a_count): arrivals for a_count, arrivals
+                          in sorted(self.occupancy.items())},
+            "occupancy_p50": util.utils.percentile(found, 0.5),
+            "occupancy_p95": util.utils.percentile(found, 0.95),
+            "occupancy_max": found[-1] if found else 0,
+            "received": {_endpoint(addr): {"packets": packets,
+                                           "bytes": size}
+                         for addr, (packets, size) in self.received.items()},
+            "forwarded": {_endpoint(addr): {"packets": packets,
+                                            "bytes": size}
+                          for addr, (packets, size)
+                          in self.forwarded.items()},
+        }
+
+    def summarize(self, now: float) -> typing.List[str]:
+        """Returns lines describing the statistics."""
+        return summarize_stats(self.to_dict(now))
+
+
+def summarize_stats(stats: dict) -> typing.List[str]:
+    """Returns lines describing statistics from `WireStats.to_dict`."""
+    dropped = stats["dropped"]
+    lines = ["Drops: {} (buffer full), {} (loss), of {} packets".format(
+        dropped[DROP_BUFFER_FULL], dropped[DROP_LOSS], stats["arrivals"])]
+    if stats["arrivals"]:
+        lines.append("Occupancy found on arrival: median {}, p95 {}, max "
+                     "{}".format(stats["occupancy_p50"],
+                                 stats["occupancy_p95"],
+                                 stats["occupancy_max"]))
+    for source, received in sorted(stats["received"].items()):
+        forwarded = stats["forwarded"].get(source,
+                                           {"packets": 0, "bytes": 0})
+        lines.append("From {}: {} packets / {} bytes received, {} packets / "
+                     "{} bytes forwarded".format(
+                         source, received["packets"], received["bytes"],
+                         forwarded["packets"], forwarded["bytes"]))
+    elapsed = stats["elapsed"]
+    lines.append("Busy {:.2f} secs, idle {:.2f} secs ({:.1%} utilized)".format(
+        stats["busy"], stats["idle"],
+        stats["busy"] / elapsed if elapsed else 0))
+    return lines
+
+
 class CrummyWireProtocol(asyncio.DatagramProtocol):
+    """Forwards every datagram it receives to every other peer in the
+    sender's flow, dropping any that arrive while the buffer is full, and
+    subjecting the rest to the impairments of a util.link.Link: loss, delay,
+    jitter, bandwidth limits and duplication.
+
+    Peers join a flow with a connect datagram naming it, see util.flows, and
+    any peer that sends without connecting joins DEFAULT_FLOW.  Accepted
+    packets wait in the wire's queue until the link is free to transmit
+    them, and the queue discipline decides both which flow's packet goes
+    next and whether the flows share one buffer.  What happened to each
+    flow's packets is kept in `flow_stats`.
+
+    Each packet accepted onto the wire is given a ticket, unique for the
+    life of the wire, and the buffer maps tickets to the packets in flight.
+    Checking a packet is still buffered and removing it once forwarded are
+    then constant time however large the buffer is, and identical payloads
+    in flight together each keep their own slot.
+
+    Packets leaving the link are grouped into release batches by when they
+    are due, rounded up to the batch window, and each batch is released by a
+    single timer, rather than each packet scheduling its own.  Who each
+    packet goes to is worked out once per sender, not per packet.
 
-    def __init__(self, loop, loss: float, delay: float, buffer_size: int):
+    What the wire did with every packet is counted in `stats`.
+
+    Per packet log lines are only built when the logger would emit them.
+    For tracing that doesn't disturb the timing being measured, pass a
+    CaptureRing, and every packet's fate is recorded into it instead.
+
+    Args:
+        loop -- The event loop the wire runs on.
+        loss -- The fraction of packets to drop.
+        delay -- How long, in seconds, each packet spends on the wire.
+        buffer_size -- How many packets may be on the wire at once, in
+                       total or per flow, depending on the queue.
+        capture -- Where to record packets, if anywhere.
+        link -- The link's impairments.  If given, it takes the place of
+                loss and delay.
+        queue -- The name of the queue discipline, one of util.flows.QUEUES.
+        batch_window -- Round due times up to a multiple of this many
+                        seconds, to batch their release; zero to only batch
+                        packets due at exactly the same time.
+    """
+
+    def __init__(self, loop, loss: float, delay: float, buffer_size: int,
+                 capture: typing.Optional[util.capture.CaptureRing] = None,
+                 link: typing.Optional[util.link.Link] = None,
+                 queue: str = util.flows.DEFAULT_QUEUE,
+                 batch_window: float = BATCH_WINDOW):
         self._loop = loop
-        self._loss = loss
-        self._delay = delay
+        if link is None:
+            link = util.link.Link(delay, util.link.BernoulliLoss(loss))
+        self._link = link
         self._buffer_size = buffer_size
-        self._wirebuffer = []
-        self._peer_addrs = set()
+        self._queue = util.flows.create_queue(queue)
+        self._wirebuffer = {}
+        self._tickets = itertools.count()
+        # Packets and bytes on the wire, per flow, or all under
+        # DEFAULT_FLOW if the flows share the buffer.
+        self._occupancy = collections.Counter()
+        self._occupancy_bytes = collections.Counter()
+        # The timer that starts the next transmission, while the link is
+        # busy transmitting.
+        self._transmitter = None
+        self._batch_window = batch_window
+        # Tickets to release, by when they are due.
+        self._batches = {}
+        self._flow_of = {}
+        self._flow_peers = collections.defaultdict(set)
+        # Who a packet from a sender in a flow goes to, by (flow, sender).
+        self._targets = {}
+        self.flow_stats: typing.Dict[bytes, util.flows.FlowStats] = {}
+        self.stats = WireStats(loop.time())
         self._transport = None
         self._logger = util.logging.get_logger("project-wire")
+        self._capture = capture
 
     def connection_made(self, transport):
         self._transport = transport
 
+    def _record(self, direction: int, verdict: int, data: bytes):
+        if self._capture is not None:
+            self._capture.record(self._loop.time(), direction, verdict,
+                                 data)
+
+    def _join(self, addr, flow: bytes):
+        previous = self._flow_of.get(addr)
+        if previous is not None:
+            self._flow_peers[previous].discard(addr)
+        self._flow_of[addr] = flow
+        self._flow_peers[flow].add(addr)
+        self._targets.clear()
+        if flow not in self.flow_stats:
+            self.flow_stats[flow] = util.flows.FlowStats()
+
+    def _buffer_key(self, flow: bytes) -> bytes:
+        if self._queue.shared_buffer:
+            return util.flows.DEFAULT_FLOW
+        return flow
+
     def datagram_received(self, data, addr):
-        self._logger.info(" --> Received %d bytes from %s - %s", len(data),
-                          addr, data_rep(data))
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(" --> Received %d bytes from %s - %s",
+                              len(data), addr, data_rep(data))
 
-        self._peer_addrs.add(addr)
-        if data == b'connect':
+        flow = util.flows.parse_connect(data)
+        if flow is not None:
+            self._join(addr, flow)
+            self._record(util.capture.DIRECTION_IN,
+                         util.capture.VERDICT_CONNECT, data)
             return
 
+        flow = self._flow_of.get(addr)
+        if flow is None:
+            flow = util.flows.DEFAULT_FLOW
+            self._join(addr, flow)
+        stats = self.flow_stats[flow]
+        wire_stats = self.stats
+        received = wire_stats.received[addr]
+        received[0] += 1
+        received[1] += len(data)
+        wire_stats.occupancy[len(self._wirebuffer)] += 1
+
         # First, see if the buffer is full.  If it is, then just drop
         # the packet and pretend nothing happened.
         # Song: changed the following line to enable correct buffer size overflows
         # if len(self._wirebuffer) >= self._buffer_size:
-        if len(self._wirebuffer) >= self._buffer_size:
-            self._logger.debug(" !!-> Dropping, buffer is full: len(wirebuffer): %d >= buff_size: %d", len(self._wirebuffer), self._buffer_size)
+        link = self._link
+        key = self._buffer_key(flow)
+        if (self._occupancy[key] >= self._buffer_size or
+                (link.queue_bytes is not None and
+                 self._occupancy_bytes[key] + len(data) > link.queue_bytes)):
+            self._logger.debug(" !!-> Dropping, buffer is full: len(wirebuffer): %d >= buff_size: %d", self._occupancy[key], self._buffer_size)
             # print("drop due to buffer overflow")
-
+            stats.dropped_full += 1
+            wire_stats.dropped[DROP_BUFFER_FULL] += 1
+            self._record(util.capture.DIRECTION_IN,
+                         util.capture.VERDICT_BUFFER_FULL, data)
             return
 
         # Second, see if we should drop the packet.  If so, then we just
         # discard it as if nothing ever happened.
-        rand = random.random()
-        # print("loss random:", rand, " threshold:", self._loss)
-        if self._loss > 0 and rand < self._loss:
-            self._logger.debug(" !-> Dropping to simulate a lossy connection: rand: %f < loss %f", rand, self._loss)
+        if link.lost():
+            self._logger.debug(" !-> Dropping to simulate a lossy connection")
             # print("drop due to loss")
+            stats.dropped_lost += 1
+            wire_stats.dropped[DROP_LOSS] += 1
+            self._record(util.capture.DIRECTION_IN,
+                         util.capture.VERDICT_LOST, data)
             return
 
-        self._logger.debug(" --> Added %d bytes to send in %f seconds",
-                           len(data), self._delay)
+        self._record(util.capture.DIRECTION_IN, util.capture.VERDICT_QUEUED,
+                     data)
+
+        # And now, queue the data (and any duplicate of it) for the link to
+        # transmit.
+        if not self._wirebuffer:
+            wire_stats.busy(self._loop.time())
+        for _ in range(link.copies()):
+            ticket = next(self._tickets)
+            self._wirebuffer[ticket] = data, addr, flow
+            self._occupancy[key] += 1
+            self._occupancy_bytes[key] += len(data)
+            self._queue.enqueue(flow, ticket, len(data))
+        if self._transmitter is None:
+            self._transmit()
+
+    def _transmit(self):
+        # Hands queued packets to the link until it is busy, then waits for
+        # it to free up again.
+        self._transmitter = None
+        link = self._link
+        now = self._loop.time()
+        while self._queue:
+            _, ticket, size = self._queue.dequeue()
+            departure = link.departure(now, size)
+            when = link.arrival(departure)
+            self._logger.debug(" --> Added %d bytes to send in %f seconds",
+                               size, when - now)
+            self._release_at(when, ticket)
+            if departure > now:
+                self._transmitter = self._loop.call_at(departure,
+                                                       self._transmit)
+                return
 
-        # And now, schedule the data to actually be sent in the future.
-        self._wirebuffer.append(data)
-        self._loop.call_later(self._delay, self.send_to_peer_addrs, (data, addr))
+    def _release_at(self, when: float, ticket: int):
+        window = self._batch_window
+        if window > 0:
+            when = math.ceil(when / window) * window
+        batch = self._batches.get(when)
+        if batch is None:
+            batch = self._batches[when] = []
+            self._loop.call_at(when, self._release, when)
+        batch.append(ticket)
 
-    def send_to_peer_addrs(self, package):
-        data, sender_addr = package
+    def _release(self, when: float):
+        for ticket in self._batches.pop(when):
+            self.send_to_peer_addrs(ticket)
 
-        if data not in self._wirebuffer:
+    def send_to_peer_addrs(self, ticket: int):
+        package = self._wirebuffer.pop(ticket, None)
+        if package is None:
             self._logger.error(" !!! Was scheduled to send data that is not "
                                "in the write buffer")
             return
+        data, sender_addr, flow = package
+        key = self._buffer_key(flow)
+        self._occupancy[key] -= 1
+        self._occupancy_bytes[key] -= len(data)
+        now = self._loop.time()
+        self.flow_stats[flow].forwarded(now, len(data))
+        forwarded = self.stats.forwarded[sender_addr]
+        forwarded[0] += 1
+        forwarded[1] += len(data)
+        if not self._wirebuffer:
+            self.stats.idle(now)
+        self._record(util.capture.DIRECTION_OUT,
+                     util.capture.VERDICT_FORWARDED, data)
 
-        for a_peer_addr in self._peer_addrs:
-            if a_peer_addr == sender_addr:
-                continue
-            self._logger.debug(" <-- Sending %d bytes to %s - %s", len(data),
-                               a_peer_addr, data_rep(data))
-            self._transport.sendto(data, addr=a_peer_addr)
+        targets = self._targets.get((flow, sender_addr))
+        if targets is None:
+            targets = self._targets[flow, sender_addr] = tuple(
+                a_peer_addr for a_peer_addr in self._flow_peers[flow]
+                if a_peer_addr != sender_addr)
 
-        self._wirebuffer.remove(data)
+        tracing = self._logger.isEnabledFor(logging.DEBUG)
+        sendto = self._transport.sendto
+        for a_peer_addr in targets:
+            if tracing:
+                self._logger.debug(" <-- Sending %d bytes to %s - %s",
+                                   len(data), a_peer_addr, data_rep(data))
+            sendto(data, a_peer_addr)
 
 
-def bad_socket(port: int) -> socket.socket:
+def bad_socket(port: int,
+               flow: bytes = util.flows.DEFAULT_FLOW) -> socket.socket:
     """Establishes a connection to the server, that simulates a crummy
     network, on the given port.
 
     Args:
         port -- the port to listen to the service simulating a lossy network.
+        flow -- the ID of the flow to join on the wire.
 
     Return:
         socket instance, connected and ready to communicate on.
     """
     lossy_socket = socket.socket(type=socket.SOCK_DGRAM)
     lossy_socket.connect(('127.0.0.1', port))
-    lossy_socket.send(b'connect')
+    lossy_socket.send(util.flows.connect_message(flow))
     return lossy_socket
 
 
-def create_server(port: int, loss: float, delay: float, buff_size: int) -> tuple:
+def create_server(port: int, loss: float, delay: float, buff_size: int,
+                  capture: typing.Optional[util.capture.CaptureRing] = None,
+                  link: typing.Optional[util.link.Link] = None,
+                  queue: str = util.flows.DEFAULT_QUEUE,
+                  batch_window: float = BATCH_WINDOW,
+                  use_uvloop: bool = False) -> tuple:
 
+    if use_uvloop:
+        if uvloop is None:
+            raise RuntimeError("uvloop was asked for, but isn't installed")
+        asyncio.set_event_loop(uvloop.new_event_loop())
     loop = asyncio.get_event_loop()
     listen = loop.create_datagram_endpoint(
-        lambda: CrummyWireProtocol(loop, loss, delay, buff_size),
+        lambda: CrummyWireProtocol(loop, loss, delay, buff_size, capture,
+                                   link, queue, batch_window),
         local_addr=('127.0.0.1', port))
     transport, _ = loop.run_until_complete(listen)
     return transport, loop